@@ -8,7 +8,11 @@
 #       GET  /health
 #       POST /predict        (1 транзакция)
 #       POST /predict_batch  (пачка транзакций)
-#       GET  /forecast       (прогноз total_volume на N месяцев)
+#       GET  /forecast       (прогноз total_volume на N месяцев, ?intervals=1 — интервалы)
+#       POST /jobs/score     (фоновый пересчёт таблицы SQLite)
+#       GET  /jobs/<id>      (прогресс задания)
+#       GET  /drift          (PSI живого трафика против обучающей выборки)
+#       GET  /metrics        (счётчики сервиса: доля эскалаций каскада)
 #
 # Важно:
 #   - Модели 3.1 сохранены как sklearn Pipeline и ожидают DataFrame
@@ -17,9 +21,14 @@
 # =========================================================
 
 import os
+import re
 import json
+import uuid
+import sqlite3
+import threading
 import traceback
 from datetime import datetime
+from operator import itemgetter
 
 import numpy as np
 import pandas as pd
@@ -27,6 +36,8 @@ import joblib
 
 from flask import Flask, request, jsonify
 
+import snapshot_cache
+
 # =========================================================
 # 0) НАСТРОЙКИ (обычно меняются на соревнованиях)
 # =========================================================
@@ -41,12 +52,45 @@ MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(BASE_DIR, "models"))
 RISK_MODEL_PATH = os.getenv("RISK_MODEL_PATH", os.path.join(MODEL_DIR, "best_model_risk.joblib"))
 CX_MODEL_PATH = os.getenv("CX_MODEL_PATH", os.path.join(MODEL_DIR, "best_model_complexity.joblib"))
 
+# Каскад для risk_level (необязателен): дешёвая stage-1 модель + пороги из continuous_training_32
+CASCADE_MODEL_PATH = os.getenv("CASCADE_MODEL_PATH", os.path.join(MODEL_DIR, "cascade_risk.joblib"))
+USE_CASCADE = os.getenv("USE_CASCADE", "1") == "1"
+
+# Дистиллированные модели-ученики (необязательны): маленький HistGB вместо ансамбля-учителя.
+# Подменяют учителя, только если continuous_training_32 их принял (согласие И f1 не хуже учителя)
+# и ученик обучен на загруженной версии учителя
+STUDENT_RISK_PATH = os.getenv("STUDENT_RISK_PATH", os.path.join(MODEL_DIR, "student_risk.joblib"))
+STUDENT_CX_PATH = os.getenv("STUDENT_CX_PATH", os.path.join(MODEL_DIR, "student_complexity.joblib"))
+USE_STUDENT = os.getenv("USE_STUDENT", "1") == "1"
+
+# Совместная multi-output модель (необязательна): один лес предсказывает оба таргета за один проход.
+# Обслуживает запросы вместо пары моделей (и каскада), только если continuous_training_32 её принял
+# (f1 по обоим таргетам не хуже пары в пределах допуска и быстрее) и сравнивал с загруженной версией пары
+JOINT_MODEL_PATH = os.getenv("JOINT_MODEL_PATH", os.path.join(MODEL_DIR, "joint.joblib"))
+USE_JOINT = os.getenv("USE_JOINT", "1") == "1"
+
 # 3.3 — артефакты прогноза total_volume
 FORECAST_MODEL_PATH = os.getenv("FORECAST_MODEL_PATH", os.path.join(MODEL_DIR, "forecast_total_volume.joblib"))
 FORECAST_HISTORY_PATH = os.getenv(
     "FORECAST_HISTORY_PATH", os.path.join(MODEL_DIR, "forecast_total_volume_history.csv")
 )
 DEFAULT_FORECAST_MONTHS = int(os.getenv("DEFAULT_FORECAST_MONTHS", "6"))
+MAX_FORECAST_MONTHS = 24
+
+# Интервалы прогноза: residual bootstrap, все траектории считаются одним 2-D массивом
+FORECAST_BOOTSTRAP_PATHS = int(os.getenv("FORECAST_BOOTSTRAP_PATHS", "500"))
+FORECAST_INTERVAL_LEVEL = float(os.getenv("FORECAST_INTERVAL_LEVEL", "0.9"))
+FORECAST_BOOTSTRAP_SEED = 42
+
+# Мониторинг дрейфа: границы бинов и counts обучающей выборки (пишет continuous_training_32)
+DRIFT_REF_PATH = os.getenv("DRIFT_REF_PATH", os.path.join(MODEL_DIR, "drift_reference.json"))
+DRIFT_PSI_THRESHOLD = float(os.getenv("DRIFT_PSI_THRESHOLD", "0.2"))
+
+# 4.2 — фоновые задания пересчёта (bulk scoring) по SQLite
+DB_PATH = os.getenv("DB_PATH", os.path.join(BASE_DIR, "db", "app.db"))
+JOBS_TABLE = os.getenv("JOBS_TABLE", "score_jobs")
+JOB_CHUNK_ROWS = int(os.getenv("JOB_CHUNK_ROWS", "20000"))
+JOBS_AUTO_RESUME = os.getenv("JOBS_AUTO_RESUME", "1") == "1"
 
 # Сервер
 HOST = os.getenv("API_HOST", "127.0.0.1")
@@ -62,8 +106,29 @@ app = Flask(__name__)
 # Загруженные артефакты
 risk_model = None
 cx_model = None
+cascade = None  # dict: stage1, thresholds, target_agreement, ...
+joint_model = None  # Pipeline с multi-output моделью: predict_proba -> [proba risk, proba cx]
+serving_models = {}  # target -> {"source": "teacher"/"student"/"joint", ...}
 forecast_model = None
 forecast_history = None
+# Ожидаемые колонки моделей — компилируются один раз в load_artifacts
+expected_cols = set()
+expected_order = []
+
+forecast_version = None  # (mtime модели, mtime истории) — ключ кэша интервалов
+
+# Счётчики каскада: сколько строк прошло и сколько ушло в тяжёлую модель
+_cascade_stats = {"rows": 0, "escalated": 0}
+_cascade_lock = threading.Lock()
+
+# Онлайн-гистограммы дрейфа: {col: {"inner": edges[1:-1], "ref": counts, "live": counts}}
+drift_state = None
+drift_version = None
+_drift_lock = threading.Lock()
+
+# Задания, которые сейчас крутятся в потоках этого процесса
+_jobs_running = set()
+_jobs_lock = threading.Lock()
 
 # =========================================================
 # 2) УТИЛИТЫ: загрузка, валидация, подготовка признаков
@@ -75,9 +140,60 @@ def _require_file(path: str, label: str):
         raise FileNotFoundError(f"{label} not found: {path}")
 
 
+def _maybe_student(teacher, path: str):
+    """Ученик вместо учителя, если он есть, принят при обучении, быстрее и меньше учителя
+    и дистиллирован из этой же версии учителя (после incremental-прогона учитель новый,
+    а ученик — от старого); иначе учитель.
+
+    Возвращает (модель, {"source": ..., "agreement": ..., "reason": ...}).
+    """
+    if not USE_STUDENT or not os.path.exists(path):
+        return teacher, {"source": "teacher", "agreement": None}
+    art = joblib.load(path)
+    agreement = art.get("fidelity", {}).get("agreement")
+    if not art.get("accepted"):
+        return teacher, {"source": "teacher", "agreement": agreement, "reason": "student not accepted"}
+    # артефакты, принятые до правила скорость/размер, его не проверяли
+    fidelity = art.get("fidelity", {})
+    if not (fidelity.get("speedup", 0) > art.get("min_speedup", 1.0)
+            and fidelity.get("size_ratio", 0) > art.get("min_size_ratio", 1.0)):
+        return teacher, {"source": "teacher", "agreement": agreement, "reason": "student not faster and smaller"}
+    if art.get("teacher_version") is None or art.get("teacher_version") != getattr(teacher, "model_version", None):
+        return teacher, {"source": "teacher", "agreement": agreement, "reason": "student of another teacher version"}
+    return art["pipeline"], {"source": "student", "agreement": agreement}
+
+
+def _load_joint(risk_teacher, cx_teacher):
+    """Совместная модель, если она есть, принята, предсказывает ровно наши два таргета
+    и обучена вместе с загруженной парой (incremental-прогон обновляет пару, но не её); иначе None."""
+    if not USE_JOINT or not os.path.exists(JOINT_MODEL_PATH):
+        return None
+    art = joblib.load(JOINT_MODEL_PATH)
+    if not art.get("accepted") or list(art.get("targets", [])) != ["risk_level", "verification_complexity"]:
+        return None
+    pair_version = art.get("pair_version")
+    if pair_version is None or any(getattr(m, "model_version", None) != pair_version
+                                   for m in (risk_teacher, cx_teacher)):
+        return None
+    return art["pipeline"]
+
+
+def _load_cascade(risk_teacher):
+    """Каскад, если он есть и откалиброван против загруженной версии risk-модели
+    (пороги stage-1 подобраны под согласие именно с ней); иначе None."""
+    if not USE_CASCADE or not os.path.exists(CASCADE_MODEL_PATH):
+        return None
+    art = joblib.load(CASCADE_MODEL_PATH)
+    heavy_version = art.get("heavy_version")
+    if heavy_version is None or heavy_version != getattr(risk_teacher, "model_version", None):
+        return None
+    return art
+
+
 def load_artifacts():
     """Загружаем всё один раз при старте."""
-    global risk_model, cx_model, forecast_model, forecast_history
+    global risk_model, cx_model, joint_model, cascade, forecast_model, forecast_history, forecast_version
+    global drift_state, drift_version, expected_cols, expected_order, serving_models
 
     _require_file(RISK_MODEL_PATH, "Risk model")
     _require_file(CX_MODEL_PATH, "Complexity model")
@@ -85,6 +201,21 @@ def load_artifacts():
     risk_model = joblib.load(RISK_MODEL_PATH)
     cx_model = joblib.load(CX_MODEL_PATH)
 
+    # совместная модель и каскад сверяются с версией учителей, до подмены на учеников
+    joint_model = _load_joint(risk_model, cx_model)
+    # каскад ускоряет только risk_model — совместной модели он не нужен
+    cascade = _load_cascade(risk_model) if joint_model is None else None
+
+    # подмена на учеников — до _compile_expected_columns (колонки берутся у обслуживающих моделей)
+    risk_model, risk_info = _maybe_student(risk_model, STUDENT_RISK_PATH)
+    cx_model, cx_info = _maybe_student(cx_model, STUDENT_CX_PATH)
+    serving_models = {"risk_level": risk_info, "verification_complexity": cx_info}
+
+    if joint_model is not None:
+        serving_models = {t: {"source": "joint"} for t in serving_models}
+
+    expected_cols, expected_order = _compile_expected_columns()
+
     # Прогноз может быть не готов, но по заданию 4.1 — желательно
     if os.path.exists(FORECAST_MODEL_PATH) and os.path.exists(FORECAST_HISTORY_PATH):
         forecast_model = joblib.load(FORECAST_MODEL_PATH)
@@ -98,9 +229,27 @@ def load_artifacts():
 
         forecast_history["month"] = pd.to_datetime(forecast_history["month"], errors="coerce")
         forecast_history = forecast_history.dropna(subset=["month"]).sort_values("month").reset_index(drop=True)
+        forecast_version = (os.path.getmtime(FORECAST_MODEL_PATH), os.path.getmtime(FORECAST_HISTORY_PATH))
     else:
         forecast_model = None
         forecast_history = None
+        forecast_version = None
+
+    # Референс для дрейфа — необязателен (появляется после continuous_training_32)
+    drift_state, drift_version = None, None
+    if os.path.exists(DRIFT_REF_PATH):
+        with open(DRIFT_REF_PATH, "r", encoding="utf-8") as f:
+            ref = json.load(f)
+        drift_version = ref.get("version")
+        drift_state = {
+            col: {
+                "inner": np.asarray(h["edges"][1:-1], dtype=float),
+                "ref": np.asarray(h["counts"], dtype=np.int64),
+                "live": np.zeros(len(h["counts"]), dtype=np.int64),
+            }
+            for col, h in ref.get("columns", {}).items()
+            if h.get("type", "numeric") == "numeric"
+        }
 
 
 def _safe_to_numeric(s: pd.Series, default=0.0):
@@ -109,6 +258,62 @@ def _safe_to_numeric(s: pd.Series, default=0.0):
     return out.fillna(default)
 
 
+def _drift_update(df: pd.DataFrame):
+    """Добавляем значения запроса в онлайн-гистограммы.
+
+    Границы бинов фиксированы, поэтому стоимость = searchsorted по ~10 границам
+    на значение, независимо от того, сколько трафика уже прошло.
+    Значения вне диапазона обучающей выборки попадают в крайние бины.
+    df — до заполнения дефолтами: null и нечисловые строки (coerce -> NaN) пропускаются.
+    """
+    if not drift_state:
+        return
+    with _drift_lock:
+        for col, h in drift_state.items():
+            if col not in df.columns:
+                continue
+            x = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+            x = x[np.isfinite(x)]
+            if x.size == 0:
+                continue
+            idx = np.searchsorted(h["inner"], x, side="right")
+            h["live"] += np.bincount(idx, minlength=len(h["live"]))
+
+
+def _psi_from_counts(ref_counts: np.ndarray, act_counts: np.ndarray) -> float:
+    """PSI по готовым counts (та же формула, что psi_from_counts() в continuous_training_32)."""
+    eps = 1e-6
+    exp_perc = np.clip(ref_counts / max(ref_counts.sum(), 1), eps, 1)
+    act_perc = np.clip(act_counts / max(act_counts.sum(), 1), eps, 1)
+    return float(np.sum((act_perc - exp_perc) * np.log(act_perc / exp_perc)))
+
+
+def drift_report() -> dict:
+    """PSI по каждой колонке: O(bins), считается из накопленных counts."""
+    with _drift_lock:
+        snap = {col: (h["ref"], h["live"].copy()) for col, h in (drift_state or {}).items()}
+
+    cols = {}
+    for col, (ref, live) in snap.items():
+        n = int(live.sum())
+        cols[col] = {
+            "n": n,
+            "psi": _psi_from_counts(ref, live) if n > 0 else None,
+            "live_counts": live.tolist(),
+        }
+
+    psis = [v["psi"] for v in cols.values() if v["psi"] is not None]
+    psi_max = float(max(psis)) if psis else 0.0
+    return {
+        "reference_version": drift_version,
+        "psi_threshold": DRIFT_PSI_THRESHOLD,
+        "psi_mean": float(np.mean(psis)) if psis else 0.0,
+        "psi_max": psi_max,
+        "drift_flag": psi_max >= DRIFT_PSI_THRESHOLD,
+        "columns": cols,
+    }
+
+
 def _parse_hour_from_tr_datetime(x):
     """Пытаемся извлечь hour из tr_datetime.
 
@@ -145,7 +350,7 @@ def _parse_hour_from_tr_datetime(x):
 def _infer_expected_columns():
     """Берём ожидаемые колонки из fitted sklearn Pipeline, если доступны."""
     cols = set()
-    for mdl in (risk_model, cx_model):
+    for mdl in (joint_model, risk_model, cx_model):
         if mdl is None:
             continue
         if hasattr(mdl, "feature_names_in_"):
@@ -156,7 +361,93 @@ def _infer_expected_columns():
     return cols
 
 
-def build_features(df_raw: pd.DataFrame) -> pd.DataFrame:
+def _compile_expected_columns():
+    """(set, порядок) ожидаемых колонок — порядок как сохранён в модели.
+
+    Если order не доступен, сортировка — стабильнее, чем произвольный порядок.
+    """
+    expected = _infer_expected_columns()
+    if not expected:
+        return set(), []
+
+    if hasattr(joint_model, "feature_names_in_"):
+        order = list(getattr(joint_model, "feature_names_in_"))
+    elif hasattr(risk_model, "feature_names_in_"):
+        order = list(getattr(risk_model, "feature_names_in_"))
+    elif hasattr(cx_model, "feature_names_in_"):
+        order = list(getattr(cx_model, "feature_names_in_"))
+    else:
+        order = sorted(list(expected))
+    return expected, order
+
+
+# Числовые поля и их дефолты (общие для build_features и декодера /predict_batch)
+NUMERIC_DEFAULTS = {
+    "amount": 0.0,
+    "mcc_code": 0,
+    "tr_type": 0,
+    "hour": 0,
+    "rule_score": 0.0,
+    "anomaly_score": 0.0,
+    "risk_score": 0.0,
+    "customer_id": 0,
+    "term_id": 0,
+}
+
+# Строковые поля: дефолт для отсутствующего ключа
+STRING_DEFAULTS = {"flow": "unknown"}
+
+
+def decode_rows_to_frame(body) -> pd.DataFrame:
+    """Декодер тела /predict_batch сразу в типизированные колонки.
+
+    JSON разбирается C-декодером stdlib, затем каждая ожидаемая моделями колонка
+    (+ tr_datetime для hour) собирается одним проходом в свой буфер:
+    числа — сразу в float64-массив, строки — в object-массив.
+    Отсутствующий числовой ключ = NaN (дефолт подставит build_features уже после
+    учёта дрейфа), отсутствующая строка = дефолт колонки. pd.DataFrame(rows) с построчным
+    выводом типов и последующий to_numeric по object-колонкам не нужны.
+
+    (object_pairs_hook в json медленнее, чем C-сборка dict, поэтому не используется.)
+    """
+    payload = json.loads(body)
+    rows = payload.get("rows") if isinstance(payload, dict) else None
+
+    if not isinstance(rows, list) or len(rows) == 0:
+        raise ValueError("Expected JSON: { rows: [ {...}, ... ] }")
+    if not all(isinstance(r, dict) for r in rows):
+        raise ValueError("Each row must be a JSON object")
+
+    # колонки, которые встретились хотя бы в одной строке (set.union — на C);
+    # колонки /drift нужны, даже если модели их не используют
+    present = set().union(*rows)
+    if expected_cols:
+        present &= expected_cols | set(drift_state) | {"tr_datetime"}
+
+    n = len(rows)
+    order = [c for c in expected_order if c in present] + sorted(present - set(expected_order))
+
+    cols = {}
+    for k in order:
+        d = STRING_DEFAULTS.get(k)  # для чисел None -> NaN
+        try:
+            # быстрый путь: ключ есть во всех строках -> map(itemgetter) целиком на C
+            values = list(map(itemgetter(k), rows))
+        except KeyError:
+            values = [r.get(k, d) for r in rows]
+
+        if k in NUMERIC_DEFAULTS:
+            try:
+                cols[k] = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):  # null / строки вроде "12.5" — медленный путь
+                cols[k] = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+        else:
+            cols[k] = np.array(values, dtype=object)
+
+    return pd.DataFrame(cols, index=pd.RangeIndex(n))
+
+
+def build_features(df_raw: pd.DataFrame, track_drift: bool = False) -> pd.DataFrame:
     """Единая функция подготовки признаков для /predict и /predict_batch.
 
     Логика:
@@ -166,6 +457,9 @@ def build_features(df_raw: pd.DataFrame) -> pd.DataFrame:
 
     ВАЖНО: мы НЕ делаем сложный feature engineering здесь.
     Если на соревнованиях нужно — добавишь 2–3 строки внутри этой функции.
+
+    track_drift=True — значения живого трафика идут в /drift
+    (до заполнения дефолтами, чтобы не считать подставленные нули).
     """
     df = df_raw.copy()
 
@@ -173,18 +467,12 @@ def build_features(df_raw: pd.DataFrame) -> pd.DataFrame:
     if "tr_datetime" in df.columns and "hour" not in df.columns:
         df["hour"] = df["tr_datetime"].apply(_parse_hour_from_tr_datetime)
 
+    # дрейф — по сырым значениям: null / нечисловые отбрасываются, а не считаются дефолтом
+    if track_drift:
+        _drift_update(df)
+
     # числовые поля
-    for col, default in [
-        ("amount", 0.0),
-        ("mcc_code", 0),
-        ("tr_type", 0),
-        ("hour", 0),
-        ("rule_score", 0.0),
-        ("anomaly_score", 0.0),
-        ("risk_score", 0.0),
-        ("customer_id", 0),
-        ("term_id", 0),
-    ]:
+    for col, default in NUMERIC_DEFAULTS.items():
         if col in df.columns:
             df[col] = _safe_to_numeric(df[col], default=default)
 
@@ -198,29 +486,19 @@ def build_features(df_raw: pd.DataFrame) -> pd.DataFrame:
     if "verification_complexity" in df.columns:
         df["verification_complexity"] = df["verification_complexity"].astype(str)
 
-    # --- Выравнивание под ожидаемые колонки моделей ---
-    expected = _infer_expected_columns()
-
-    if expected:
+    # --- Выравнивание под ожидаемые колонки моделей (скомпилированы в load_artifacts) ---
+    if expected_cols:
         # добавим отсутствующие
-        for c in expected:
+        for c in expected_cols:
             if c not in df.columns:
                 # дефолт: числа -> 0, строки -> "unknown"
-                if c in {"flow"}:
-                    df[c] = "unknown"
+                if c in STRING_DEFAULTS:
+                    df[c] = STRING_DEFAULTS[c]
                 else:
                     df[c] = 0
 
         # оставим только expected в том порядке, как сохранён в модели
-        # (если order не доступен, сортировка — стабильнее, чем произвольный порядок)
-        if hasattr(risk_model, "feature_names_in_"):
-            order = list(getattr(risk_model, "feature_names_in_"))
-        elif hasattr(cx_model, "feature_names_in_"):
-            order = list(getattr(cx_model, "feature_names_in_"))
-        else:
-            order = sorted(list(expected))
-
-        df = df[order]
+        df = df[expected_order]
 
     # финальная чистка
     df = df.replace([np.inf, -np.inf], np.nan)
@@ -230,55 +508,408 @@ def build_features(df_raw: pd.DataFrame) -> pd.DataFrame:
 def _predict_one(payload: dict):
     """Предсказание для одного объекта."""
     df = pd.DataFrame([payload])
-    X = build_features(df)
-
-    risk = str(risk_model.predict(X)[0])
-    cx = str(cx_model.predict(X)[0])
+    risk_pred, cx_pred, proba, classes = _score_frame(df, track_drift=True)
 
     proba_map = None
+    if proba is not None:
+        proba_map = {str(c): float(p) for c, p in zip(classes, proba[0])}
+
+    return str(risk_pred[0]), str(cx_pred[0]), proba_map
+
+
+def _heavy_risk(X: pd.DataFrame):
+    """risk_model: (pred, proba, classes) — proba/classes = None, если недоступны."""
+    pred = risk_model.predict(X)
+
+    proba, classes = None, None
     if hasattr(risk_model, "predict_proba"):
         try:
-            proba = risk_model.predict_proba(X)[0]
+            proba = risk_model.predict_proba(X)
             classes = list(getattr(risk_model, "classes_", []))
-            if classes:
-                proba_map = {str(c): float(p) for c, p in zip(classes, proba)}
+            if not classes:
+                proba = None
         except Exception:
-            proba_map = None
+            proba, classes = None, None
+
+    return pred, proba, classes
 
-    return risk, cx, proba_map
 
+def _cascade_risk(X: pd.DataFrame):
+    """Каскад: stage-1 скорит всё, в risk_model уходят только строки,
+    где уверенность stage-1 ниже откалиброванного порога своего класса."""
+    stage1 = cascade["stage1"]
+    p1 = stage1.predict_proba(X)
+    cls1 = np.asarray(stage1.classes_)
+    idx = p1.argmax(axis=1)
+    conf = p1.max(axis=1)
+    thr = np.array([cascade["thresholds"].get(c, np.inf) for c in cls1])
+    escalated = conf < thr[idx]
 
-def _predict_batch(rows: list):
-    """Предсказание для пачки объектов."""
-    df = pd.DataFrame(rows)
-    X = build_features(df)
+    pred = cls1[idx].astype(object)
+
+    # proba в порядке классов тяжёлой модели (для совместимости ответа)
+    classes = list(getattr(risk_model, "classes_", cls1))
+    col = {c: j for j, c in enumerate(classes)}
+    proba = np.zeros((len(X), len(classes)), dtype=float)
+    for j, c in enumerate(cls1):
+        if c in col:
+            proba[:, col[c]] = p1[:, j]
+
+    if escalated.any():
+        h_pred, h_proba, h_classes = _heavy_risk(X[escalated])
+        pred[escalated] = h_pred
+        if h_proba is not None and list(h_classes) == classes:
+            proba[escalated] = h_proba
+
+    with _cascade_lock:
+        _cascade_stats["rows"] += int(len(X))
+        _cascade_stats["escalated"] += int(escalated.sum())
+
+    return pred, proba, classes
+
+
+def _joint_score(X: pd.DataFrame):
+    """Один predict_proba совместной модели -> (risk_pred, cx_pred, proba risk, classes risk)."""
+    p_risk, p_cx = joint_model.predict_proba(X)
+    cls_risk, cls_cx = (np.asarray(c) for c in joint_model.classes_)
+    return cls_risk[p_risk.argmax(axis=1)], cls_cx[p_cx.argmax(axis=1)], p_risk, list(cls_risk)
+
+
+def _score_frame(df: pd.DataFrame, track_drift: bool = False):
+    """Векторный скоринг DataFrame: (risk_pred, cx_pred, proba, classes).
+
+    proba/classes = None, если risk_model не умеет predict_proba.
+    Совместная модель (если загружена) скорит оба таргета одним проходом.
+    """
+    X = build_features(df, track_drift=track_drift)
+
+    if joint_model is not None:
+        return _joint_score(X)
+
+    if cascade is not None:
+        risk_pred, proba, classes = _cascade_risk(X)
+    else:
+        risk_pred, proba, classes = _heavy_risk(X)
 
-    risk_pred = risk_model.predict(X)
     cx_pred = cx_model.predict(X)
 
-    proba_rows = None
-    if hasattr(risk_model, "predict_proba"):
-        try:
-            proba = risk_model.predict_proba(X)
-            classes = list(getattr(risk_model, "classes_", []))
-            if classes:
-                proba_rows = pd.DataFrame(proba, columns=classes).to_dict(orient="records")
-        except Exception:
-            proba_rows = None
+    return risk_pred, cx_pred, proba, classes
+
+
+def _predict_batch(df: pd.DataFrame):
+    """Предсказание для пачки объектов (df — из decode_rows_to_frame)."""
+    risk_pred, cx_pred, proba, classes = _score_frame(df, track_drift=True)
 
     out = []
-    for i in range(len(X)):
+    for i in range(len(risk_pred)):
         item = {
             "risk_level": str(risk_pred[i]),
             "verification_complexity": str(cx_pred[i]),
         }
-        if proba_rows is not None:
-            item["risk_proba"] = {str(k): float(v) for k, v in proba_rows[i].items()}
+        if proba is not None:
+            item["risk_proba"] = {str(c): float(p) for c, p in zip(classes, proba[i])}
         out.append(item)
 
     return out
 
 
+# =========================================================
+# 3.1) ФОНОВЫЕ ЗАДАНИЯ: пересчёт таблицы SQLite чанками по rowid
+# ---------------------------------------------------------
+# Состояние задания хранится в таблице JOBS_TABLE той же БД.
+# Каждый чанк: читаем rowid > last_rowid (keyset, без OFFSET),
+# скорим, вставляем результат и двигаем last_rowid — в ОДНОЙ транзакции.
+# Поэтому после падения процесса задание продолжается с последнего
+# полностью записанного чанка, без дублей.
+# Фильтр задания — не SQL-строка, а список условий {column, op, value}:
+# колонка проверяется по схеме исходной таблицы, оператор — по белому списку,
+# значения передаются параметрами (?), в текст запроса не попадают.
+# =========================================================
+
+_IDENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+FILTER_OPS = {"=", "!=", "<", "<=", ">", ">=", "in", "not in", "is null", "is not null"}
+FILTER_MAX_IN = 1000  # значений в одном in / not in
+
+JOB_FIELDS = [
+    "job_id", "source_table", "filter_json", "output_table", "status",
+    "last_rowid", "max_rowid", "rows_total", "rows_done", "chunks_done",
+    "error", "created_at", "updated_at",
+]
+
+
+def _jobs_conn():
+    con = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    con.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {JOBS_TABLE} (
+            job_id TEXT PRIMARY KEY,
+            source_table TEXT NOT NULL,
+            filter_json TEXT,
+            output_table TEXT NOT NULL,
+            status TEXT NOT NULL,
+            last_rowid INTEGER NOT NULL DEFAULT 0,
+            max_rowid INTEGER NOT NULL DEFAULT 0,
+            rows_total INTEGER NOT NULL DEFAULT 0,
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            chunks_done INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        )
+        """
+    )
+    return con
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _get_job(con, job_id: str):
+    row = con.execute(
+        f"SELECT {', '.join(JOB_FIELDS)} FROM {JOBS_TABLE} WHERE job_id = ?", (job_id,)
+    ).fetchone()
+    return dict(zip(JOB_FIELDS, row)) if row else None
+
+
+def _proba_col(cls) -> str:
+    return "risk_proba_" + re.sub(r"\W", "_", str(cls))
+
+
+def _risk_proba_classes():
+    """Классы risk_proba_* колонок, которые запишет _score_frame загруженными моделями (None — без proba)."""
+    if joint_model is not None:
+        return list(joint_model.classes_[0])
+    if cascade is not None:
+        return list(getattr(risk_model, "classes_", cascade["stage1"].classes_))
+    if hasattr(risk_model, "predict_proba"):
+        return list(getattr(risk_model, "classes_", [])) or None
+    return None
+
+
+def _output_columns(classes) -> list:
+    return ["job_id", "source_rowid", "risk_level", "verification_complexity"] + [_proba_col(c) for c in classes or []]
+
+
+def _ensure_output_table(con, table: str, classes):
+    proba_cols = "".join(f", {_proba_col(c)} REAL" for c in (classes or []))
+    con.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            job_id TEXT,
+            source_rowid INTEGER,
+            risk_level TEXT,
+            verification_complexity TEXT{proba_cols}
+        )
+        """
+    )
+
+
+def _normalize_filter(where) -> list:
+    """where из запроса -> список {column, op, value}: None / [] = все строки, dict = одно условие."""
+    if where is None:
+        return []
+    if isinstance(where, dict):
+        where = [where]
+    if not isinstance(where, list):
+        raise ValueError("where must be a list of {column, op, value} conditions")
+
+    out = []
+    for cond in where:
+        if not isinstance(cond, dict) or not _IDENT_RE.match(str(cond.get("column") or "")):
+            raise ValueError(f"Invalid condition: {cond!r}")
+        op = str(cond.get("op", "=")).strip().lower()
+        if op not in FILTER_OPS:
+            raise ValueError(f"Invalid op {op!r}, allowed: {sorted(FILTER_OPS)}")
+        value = cond.get("value")
+        if op in ("in", "not in"):
+            if not isinstance(value, list) or not 0 < len(value) <= FILTER_MAX_IN:
+                raise ValueError(f"{op} needs a list of 1..{FILTER_MAX_IN} values")
+            bad = [v for v in value if not isinstance(v, (str, int, float))]
+        else:
+            bad = [] if op in ("is null", "is not null") or isinstance(value, (str, int, float)) else [value]
+        if bad:
+            raise ValueError(f"Invalid value for {cond['column']}: {bad[0]!r}")
+        out.append({"column": cond["column"], "op": op, "value": None if op.startswith("is ") else value})
+    return out
+
+
+def _filter_sql(con, table: str, conditions: list):
+    """(SQL-фрагмент с ?, параметры). Колонки — только существующие колонки table."""
+    columns = {r[1] for r in con.execute(f"PRAGMA table_info({table})")}
+    if not columns:
+        raise ValueError(f"Table not found: {table}")
+
+    parts, params = [], []
+    for c in conditions:
+        if c["column"] not in columns:
+            raise ValueError(f"Unknown column {c['column']!r} in {table}")
+        col, op = f'"{c["column"]}"', c["op"]
+        if op in ("is null", "is not null"):
+            parts.append(f"{col} {op.upper()}")
+        elif op in ("in", "not in"):
+            parts.append(f"{col} {op.upper()} ({', '.join('?' * len(c['value']))})")
+            params.extend(c["value"])
+        else:
+            parts.append(f"{col} {op} ?")
+            params.append(c["value"])
+    return " AND ".join(parts) or "1=1", params
+
+
+def create_score_job(source_table: str, where, output_table: str) -> str:
+    """Регистрируем задание и фиксируем верхнюю границу rowid на момент старта."""
+    for name in (source_table, output_table):
+        if not _IDENT_RE.match(name or ""):
+            raise ValueError(f"Invalid table name: {name!r}")
+    # имена таблиц в SQLite без учёта регистра
+    if source_table.lower() == output_table.lower():
+        raise ValueError("output_table must differ from table")
+    # служебные таблицы: задания и счётчики перезаписи (snapshot_cache) — даже если их ещё нет
+    for reserved in (JOBS_TABLE, snapshot_cache.GENERATIONS_TABLE):
+        if output_table.lower() == reserved.lower():
+            raise ValueError(f"output_table must not be the service table {reserved!r}")
+
+    conditions = _normalize_filter(where)
+
+    con = _jobs_conn()
+    try:
+        where_sql, params = _filter_sql(con, source_table, conditions)
+        # дописывать можно только в таблицу с теми же колонками, что создаст _ensure_output_table
+        existing = [r[1] for r in con.execute(f"PRAGMA table_info({output_table})")]
+        expected = _output_columns(_risk_proba_classes())
+        if existing and existing != expected:
+            raise ValueError(f"output_table {output_table!r} exists with columns {existing}, expected {expected}")
+        rows_total, max_rowid = con.execute(
+            f"SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM {source_table} WHERE ({where_sql})", params
+        ).fetchone()
+
+        job_id = uuid.uuid4().hex[:12]
+        ts = _now()
+        with con:
+            con.execute(
+                f"""
+                INSERT INTO {JOBS_TABLE}
+                    (job_id, source_table, filter_json, output_table, status,
+                     last_rowid, max_rowid, rows_total, created_at, updated_at)
+                VALUES (?, ?, ?, ?, 'queued', 0, ?, ?, ?, ?)
+                """,
+                (job_id, source_table, json.dumps(conditions), output_table, int(max_rowid), int(rows_total), ts, ts),
+            )
+    finally:
+        con.close()
+
+    return job_id
+
+
+def _run_score_job(job_id: str):
+    con = _jobs_conn()
+    try:
+        job = _get_job(con, job_id)
+        src, out_table = job["source_table"], job["output_table"]
+        max_rowid = int(job["max_rowid"])
+        where_sql, params = _filter_sql(con, src, json.loads(job["filter_json"] or "[]"))
+
+        with con:
+            con.execute(
+                f"UPDATE {JOBS_TABLE} SET status = 'running', error = NULL, updated_at = ? WHERE job_id = ?",
+                (_now(), job_id),
+            )
+
+        last_rowid = int(job["last_rowid"])
+        output_ready = False
+
+        while last_rowid < max_rowid:
+            df = pd.read_sql(
+                f"""
+                SELECT rowid AS _rowid_, * FROM {src}
+                WHERE rowid > ? AND rowid <= ? AND ({where_sql})
+                ORDER BY rowid
+                LIMIT ?
+                """,
+                con,
+                params=(last_rowid, max_rowid, *params, JOB_CHUNK_ROWS),
+            )
+            if df.empty:
+                break
+
+            rowids = df.pop("_rowid_").astype("int64").to_numpy()
+            risk_pred, cx_pred, proba, classes = _score_frame(df)
+
+            if not output_ready:
+                _ensure_output_table(con, out_table, classes)
+                output_ready = True
+
+            cols = _output_columns(classes if proba is not None else None)
+            data = {
+                "job_id": [job_id] * len(rowids),
+                "source_rowid": rowids.tolist(),
+                "risk_level": [str(v) for v in risk_pred],
+                "verification_complexity": [str(v) for v in cx_pred],
+            }
+            if proba is not None:
+                for j, c in enumerate(classes):
+                    data[_proba_col(c)] = proba[:, j].astype(float).tolist()
+
+            last_rowid = int(rowids[-1])
+            with con:
+                con.executemany(
+                    f"INSERT INTO {out_table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                    zip(*(data[c] for c in cols)),
+                )
+                con.execute(
+                    f"""
+                    UPDATE {JOBS_TABLE}
+                    SET last_rowid = ?, rows_done = rows_done + ?, chunks_done = chunks_done + 1, updated_at = ?
+                    WHERE job_id = ?
+                    """,
+                    (last_rowid, len(rowids), _now(), job_id),
+                )
+
+        with con:
+            con.execute(
+                f"UPDATE {JOBS_TABLE} SET status = 'done', updated_at = ? WHERE job_id = ?",
+                (_now(), job_id),
+            )
+
+    except Exception as e:
+        with con:
+            con.execute(
+                f"UPDATE {JOBS_TABLE} SET status = 'failed', error = ?, updated_at = ? WHERE job_id = ?",
+                (f"{type(e).__name__}: {e}", _now(), job_id),
+            )
+    finally:
+        con.close()
+        with _jobs_lock:
+            _jobs_running.discard(job_id)
+
+
+def start_score_job(job_id: str) -> bool:
+    """Запуск (или продолжение) задания в фоновом потоке. False — уже идёт."""
+    with _jobs_lock:
+        if job_id in _jobs_running:
+            return False
+        _jobs_running.add(job_id)
+
+    threading.Thread(target=_run_score_job, args=(job_id,), daemon=True, name=f"score-job-{job_id}").start()
+    return True
+
+
+def resume_unfinished_jobs():
+    """После рестарта сервиса продолжаем queued/running задания с last_rowid."""
+    con = _jobs_conn()
+    try:
+        ids = [r[0] for r in con.execute(
+            f"SELECT job_id FROM {JOBS_TABLE} WHERE status IN ('queued', 'running')"
+        )]
+    finally:
+        con.close()
+
+    for job_id in ids:
+        start_score_job(job_id)
+    return ids
+
+
 # =========================================================
 # 3) ПРОГНОЗ total_volume (как в 3.3)
 # =========================================================
@@ -331,6 +962,98 @@ def forecast_total_volume_next_months(months: int = 6) -> pd.DataFrame:
     return pd.DataFrame({"month": future_months, "total_volume_forecast": preds})
 
 
+# Порядок признаков как в forecast_total_volume_next_months (если модель не сохранила свой)
+FORECAST_FEATURES = ["month_idx", "sin_m", "cos_m", "lag_1", "lag_2", "lag_3", "roll_mean_3"]
+
+# {(forecast_version, n_paths, level): DataFrame на MAX_FORECAST_MONTHS}
+_forecast_interval_cache = {}
+
+
+def _forecast_feature_order():
+    if hasattr(forecast_model, "feature_names_in_"):
+        return list(forecast_model.feature_names_in_)
+    return FORECAST_FEATURES
+
+
+def _forecast_step_features(paths: np.ndarray, t: int, month: pd.Timestamp) -> pd.DataFrame:
+    """Признаки шага t сразу для всех траекторий (строка = траектория).
+
+    Лаги, которых ещё нет (t < L), = 0.0 — как fillna(0.0) в рекурсивном прогнозе.
+    """
+    n = paths.shape[0]
+    feats = _time_features_one(month, month_idx=t)
+    cols = {k: np.full(n, v, dtype=float) for k, v in feats.items()}
+
+    for L in (1, 2, 3):
+        cols[f"lag_{L}"] = paths[:, t - L] if t >= L else np.zeros(n)
+    cols["roll_mean_3"] = paths[:, t - 3:t].mean(axis=1) if t >= 3 else np.zeros(n)
+
+    return pd.DataFrame(cols)[_forecast_feature_order()]
+
+
+def _forecast_residuals(y: np.ndarray) -> np.ndarray:
+    """In-sample остатки one-step прогноза по истории (один вызов predict)."""
+    months = pd.to_datetime(forecast_history["month"])
+    X = pd.concat(
+        [_forecast_step_features(y[None, :], t, months.iloc[t]) for t in range(len(y))],
+        ignore_index=True,
+    )
+    resid = y - forecast_model.predict(X)
+
+    # первые 3 месяца без полных лагов — не показательны, если есть из чего выбирать
+    if len(resid) > 6:
+        resid = resid[3:]
+    return resid[np.isfinite(resid)]
+
+
+def forecast_intervals(months: int, level: float, n_paths: int = FORECAST_BOOTSTRAP_PATHS) -> pd.DataFrame:
+    """Bootstrap-интервалы total_volume на N месяцев.
+
+    Все n_paths траекторий двигаются вместе: на каждом шаге горизонта —
+    один batched predict по матрице (n_paths x признаки) + случайный остаток.
+    Таблица считается один раз на MAX_FORECAST_MONTHS и кэшируется на версию
+    артефактов: фиксированный seed => меньший горизонт = префикс большего.
+    """
+    if forecast_model is None or forecast_history is None:
+        raise RuntimeError(
+            "Forecast artifacts are missing. "
+            "Need forecast_total_volume.joblib and forecast_total_volume_history.csv in models/"
+        )
+
+    key = (forecast_version, n_paths, round(level, 4))
+    table = _forecast_interval_cache.get(key)
+
+    if table is None:
+        y = forecast_history["total_volume"].to_numpy(dtype=float)
+        resid = _forecast_residuals(y)
+        if resid.size == 0:
+            resid = np.zeros(1)
+
+        n_hist, horizon = len(y), MAX_FORECAST_MONTHS
+        last_month = forecast_history["month"].max()
+        future_months = pd.date_range(last_month + pd.offsets.MonthBegin(1), periods=horizon, freq="MS")
+
+        rng = np.random.default_rng(FORECAST_BOOTSTRAP_SEED)
+        paths = np.empty((n_paths, n_hist + horizon), dtype=float)
+        paths[:, :n_hist] = y
+
+        for h, fm in enumerate(future_months):
+            t = n_hist + h
+            X_step = _forecast_step_features(paths, t, pd.to_datetime(fm))
+            paths[:, t] = forecast_model.predict(X_step) + rng.choice(resid, size=n_paths)
+
+        q_lo, q_hi = (1 - level) / 2, 1 - (1 - level) / 2
+        lower, upper = np.quantile(paths[:, n_hist:], [q_lo, q_hi], axis=0)
+
+        table = pd.DataFrame({"month": future_months, "lower": lower, "upper": upper})
+        # таблицы старых версий артефактов больше не нужны
+        for k in [k for k in _forecast_interval_cache if k[0] != forecast_version]:
+            del _forecast_interval_cache[k]
+        _forecast_interval_cache[key] = table
+
+    return table.iloc[:months].reset_index(drop=True)
+
+
 # =========================================================
 # 4) ENDPOINTS
 # =========================================================
@@ -344,13 +1067,31 @@ def health():
             "status": "ok",
             "risk_model_loaded": risk_model is not None,
             "complexity_model_loaded": cx_model is not None,
+            "cascade_enabled": cascade is not None,
+            "joint_model_loaded": joint_model is not None,
+            "serving_models": serving_models,
             "forecast_ready": ok_forecast,
+            "drift_ready": drift_state is not None,
             "model_dir": MODEL_DIR,
             "ts": datetime.now().isoformat(timespec="seconds"),
         }
     )
 
 
+@app.get("/metrics")
+def metrics():
+    """Счётчики сервиса. Каскад: доля строк, ушедших в тяжёлую risk_model."""
+    with _cascade_lock:
+        rows, escalated = _cascade_stats["rows"], _cascade_stats["escalated"]
+
+    out = {"cascade_enabled": cascade is not None, "cascade_rows": rows, "cascade_escalated": escalated}
+    out["cascade_escalated_fraction"] = round(escalated / rows, 4) if rows else None
+    if cascade is not None:
+        out["cascade_target_agreement"] = cascade.get("target_agreement")
+        out["cascade_train_escalation_rate"] = cascade.get("escalation_rate")
+    return jsonify(out)
+
+
 @app.post("/predict")
 def predict():
     """Предсказание для одной транзакции.
@@ -399,13 +1140,12 @@ def predict_batch():
     Возвращает список результатов в том же порядке.
     """
     try:
-        payload = request.get_json(force=True) or {}
-        rows = payload.get("rows")
-
-        if not isinstance(rows, list) or len(rows) == 0:
-            return jsonify({"error": "Expected JSON: { rows: [ {...}, ... ] }"}), 400
+        try:
+            df = decode_rows_to_frame(request.get_data())
+        except ValueError as e:  # включая json.JSONDecodeError
+            return jsonify({"error": str(e)}), 400
 
-        result = _predict_batch(rows)
+        result = _predict_batch(df)
         return jsonify({"count": len(result), "result": result})
 
     except Exception as e:
@@ -418,25 +1158,135 @@ def forecast():
 
     Пример:
       GET /forecast?months=6
+      GET /forecast?months=6&intervals=1&level=0.9   (+ lower/upper)
     """
     try:
         months = int(request.args.get("months", DEFAULT_FORECAST_MONTHS))
-        months = max(1, min(months, 24))  # защита 1..24
+        months = max(1, min(months, MAX_FORECAST_MONTHS))  # защита 1..24
+
+        with_intervals = request.args.get("intervals", "0") in {"1", "true", "yes"}
+        level = float(request.args.get("level", FORECAST_INTERVAL_LEVEL))
+        level = max(0.5, min(level, 0.99))
 
         fc = forecast_total_volume_next_months(months=months)
 
-        return jsonify(
+        result = [
             {
-                "months": months,
-                "result": [
-                    {
-                        "month": pd.to_datetime(d).strftime("%Y-%m-%d"),
-                        "total_volume_forecast": float(v),
-                    }
-                    for d, v in zip(fc["month"], fc["total_volume_forecast"])
-                ],
+                "month": pd.to_datetime(d).strftime("%Y-%m-%d"),
+                "total_volume_forecast": float(v),
             }
-        )
+            for d, v in zip(fc["month"], fc["total_volume_forecast"])
+        ]
+
+        out = {"months": months, "result": result}
+
+        if with_intervals:
+            iv = forecast_intervals(months=months, level=level)
+            for item, lo, hi in zip(result, iv["lower"], iv["upper"]):
+                item["lower"] = float(lo)
+                item["upper"] = float(hi)
+            out["interval_level"] = level
+            out["bootstrap_paths"] = FORECAST_BOOTSTRAP_PATHS
+
+        return jsonify(out)
+
+    except Exception as e:
+        return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
+
+
+@app.get("/drift")
+def drift():
+    """PSI живого трафика (/predict, /predict_batch) против обучающей выборки.
+
+    Гистограммы накапливаются с момента старта или последнего POST /drift/reset.
+    """
+    if drift_state is None:
+        return jsonify({"error": f"Drift reference not found: {DRIFT_REF_PATH}"}), 404
+    return jsonify(drift_report())
+
+
+@app.post("/drift/reset")
+def drift_reset():
+    """Обнулить накопленные онлайн-гистограммы (например, после переобучения)."""
+    with _drift_lock:
+        for h in (drift_state or {}).values():
+            h["live"][:] = 0
+    return jsonify({"status": "ok"})
+
+
+@app.post("/jobs/score")
+def jobs_score():
+    """Фоновый пересчёт таблицы SQLite загруженными моделями.
+
+    JSON пример:
+      {
+        "table": "transactions_labeled",
+        "where": [{"column": "amount", "op": "<", "value": 0}],   (необязательно, условия через AND;
+                 op: = != < <= > >= in, not in (value — список), is null, is not null)
+        "output_table": "scores_2024"
+      }
+
+    Возвращает job_id; прогресс — GET /jobs/<job_id>.
+    """
+    try:
+        payload = request.get_json(force=True) or {}
+        table = payload.get("table")
+        output_table = payload.get("output_table")
+
+        if not table or not output_table:
+            return jsonify({"error": "Expected JSON: { table, output_table, where? }"}), 400
+
+        try:
+            job_id = create_score_job(table, payload.get("where"), output_table)
+        except (ValueError, sqlite3.Error) as e:
+            return jsonify({"error": str(e)}), 400
+
+        start_score_job(job_id)
+        return jsonify({"job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+    except Exception as e:
+        return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
+
+
+@app.get("/jobs/<job_id>")
+def jobs_status(job_id):
+    """Прогресс задания: rows_done / rows_total, last_rowid, status."""
+    try:
+        con = _jobs_conn()
+        try:
+            job = _get_job(con, job_id)
+        finally:
+            con.close()
+
+        if job is None:
+            return jsonify({"error": f"Job not found: {job_id}"}), 404
+
+        job["progress"] = round(job["rows_done"] / job["rows_total"], 4) if job["rows_total"] else 1.0
+        with _jobs_lock:
+            job["active"] = job_id in _jobs_running
+        return jsonify(job)
+
+    except Exception as e:
+        return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
+
+
+@app.post("/jobs/<job_id>/resume")
+def jobs_resume(job_id):
+    """Продолжить упавшее/прерванное задание с последнего записанного чанка."""
+    try:
+        con = _jobs_conn()
+        try:
+            job = _get_job(con, job_id)
+        finally:
+            con.close()
+
+        if job is None:
+            return jsonify({"error": f"Job not found: {job_id}"}), 404
+        if job["status"] == "done":
+            return jsonify({"job_id": job_id, "status": "done"})
+
+        started = start_score_job(job_id)
+        return jsonify({"job_id": job_id, "resumed": started, "from_rowid": job["last_rowid"]}), 202
 
     except Exception as e:
         return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
@@ -449,6 +1299,10 @@ def forecast():
 if __name__ == "__main__":
     load_artifacts()
 
+    # при debug-перезагрузчике код выполняется дважды — задания поднимаем только в рабочем процессе
+    if JOBS_AUTO_RESUME and (not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true"):
+        resume_unfinished_jobs()
+
     # Подсказка для запуска:
     #   API_PORT=8000 API_HOST=127.0.0.1 python api_app.py
     #   API_PORT=8080 API_DEBUG=0 python api_app.py
@@ -0,0 +1,131 @@
+# benchmark_32.py
+# ============================================================
+# BENCHMARK of continuous_training_32 on synthetic data
+# - per size: bench/<size>/db/app.db from synthetic_data.py (generated once, reused)
+# - state is set so that the last BENCH_NEW_FRACTION of the rows are "new":
+#   drift is measured against older rows, then one full training run
+# - main() runs in a child process with cwd = bench/<size>, so the relative
+#   paths of continuous_training_32 / snapshot_cache resolve there and memory
+#   is released between sizes
+# - report: wall seconds per main() stage + every candidate fit -> JSON
+#
+# python benchmark_32.py              -> 100k 1m 10m
+# python benchmark_32.py 100k 1m      -> selected sizes
+# ============================================================
+
+import os
+import sys
+import json
+import time
+import shutil
+import multiprocessing as mp
+from datetime import datetime
+
+import continuous_training_32 as ct
+import synthetic_data
+
+
+# ============================================================
+# 0) SETTINGS
+# ============================================================
+
+BENCH_ROOT = "bench"
+BENCH_SIZES = ["100k", "1m", "10m"]
+BENCH_NEW_FRACTION = 0.1     # rows after last_rowid -> drift check + "new data" of the run
+BENCH_COLD = True            # drop models / snapshot of the size first: every run starts from scratch
+REPORT_PATH = os.path.join(BENCH_ROOT, "benchmark_report.json")
+
+
+# ============================================================
+# 1) ONE SIZE
+# ============================================================
+
+def _run_main(workdir: str, n_rows: int, out_path: str) -> None:
+    """Child process: state -> main() -> {stages, candidates} in out_path."""
+    os.chdir(workdir)
+    if BENCH_COLD:
+        shutil.rmtree(ct.MODEL_ROOT, ignore_errors=True)
+        shutil.rmtree(os.path.join(os.path.dirname(ct.DB_PATH), "snapshots"), ignore_errors=True)
+    ct.save_state(ct.STATE_PATH, {"last_rowid": int(n_rows * (1 - BENCH_NEW_FRACTION)), "last_train_time": None})
+    ct.TRAIN_MODE = "full"
+
+    t0 = time.perf_counter()
+    row = ct.main() or {}
+    total = time.perf_counter() - t0
+
+    candidates = []
+    for prefix, target in (("risk", ct.TARGET_RISK), ("cx", ct.TARGET_COMPLEX)):
+        trace = row.get(f"{prefix}_selection_trace")
+        candidates += [{"target": target, **c} for c in json.loads(trace)] if trace else []
+
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "total_seconds": total,
+            "stages": dict(ct.STAGE_SECONDS),
+            "train_mode": row.get("train_mode"),
+            "trained_rows": row.get("trained_rows"),
+            "risk_model": row.get("risk_model"),
+            "cx_model": row.get("cx_model"),
+            "candidates": candidates,
+        }, f, indent=2, default=float)
+
+
+def bench_size(size: str) -> dict:
+    n_rows = synthetic_data.SIZES[size] if size in synthetic_data.SIZES else int(size)
+    workdir = os.path.abspath(os.path.join(BENCH_ROOT, size))
+    db_path = os.path.join(workdir, ct.DB_PATH)
+
+    out = {"size": size, "rows": n_rows, "generate_seconds": None}
+    if not os.path.exists(db_path):
+        out["generate_seconds"] = synthetic_data.generate_db(n_rows, db_path)["seconds"]
+    out["db_mb"] = os.path.getsize(db_path) / 2**20
+
+    # same start method as the daemon (fork: inherits imports)
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context()
+    result_path = os.path.join(workdir, "bench_result.json")
+    if os.path.exists(result_path):
+        os.remove(result_path)
+    p = ctx.Process(target=_run_main, args=(workdir, n_rows, result_path), name=f"bench-{size}")
+    p.start()
+    p.join()
+
+    out["exit_code"] = p.exitcode
+    if p.exitcode == 0 and os.path.exists(result_path):
+        with open(result_path, "r", encoding="utf-8") as f:
+            out.update(json.load(f))
+    return out
+
+
+# ============================================================
+# 2) REPORT
+# ============================================================
+
+def print_summary(results: list[dict]) -> None:
+    for r in results:
+        stages = " ".join(f"{k}={v:.1f}s" for k, v in r.get("stages", {}).items())
+        print(f"[BENCH] {r['size']:>5} ({r['rows']:,} rows, {r['db_mb']:,.0f} MB) "
+              f"total={r.get('total_seconds', float('nan')):.1f}s | {stages or 'failed, exit code ' + str(r['exit_code'])}")
+        for c in r.get("candidates", []):
+            print(f"        {c['target']:<24} rung={c['rung']!s:<5} rows={c['rows']:>9,} "
+                  f"fit={c['fit_seconds']:8.2f}s f1={c['f1_macro']:.4f} {c['model']}")
+
+
+def run_benchmark(sizes: list[str] = BENCH_SIZES, report_path: str = REPORT_PATH) -> list[dict]:
+    results = [bench_size(size) for size in sizes]
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "cpu_count": os.cpu_count(),
+            "settings": {"MAX_TRAIN_ROWS": ct.MAX_TRAIN_ROWS, "SELECTION": ct.SELECTION,
+                         "PARALLEL_TRAINING": ct.PARALLEL_TRAINING, "USE_SNAPSHOT": ct.USE_SNAPSHOT,
+                         "new_fraction": BENCH_NEW_FRACTION, "cold": BENCH_COLD},
+            "results": results,
+        }, f, indent=2, default=float)
+    print_summary(results)
+    print("[SAVED] benchmark ->", report_path)
+    return results
+
+
+if __name__ == "__main__":
+    run_benchmark(sys.argv[1:] or BENCH_SIZES)
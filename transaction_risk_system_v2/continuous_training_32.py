@@ -2,29 +2,48 @@
 # ============================================================
 # MODULE C / 3.2 — CONTINUOUS TRAINING AGENT (UNIVERSAL)
 # - detects new data in DB
-# - checks data drift (simple PSI)
+# - checks data drift (PSI per feature, numeric + categorical)
 # - retrains models (risk_level + verification_complexity)
 # - versions models and logs metrics
+# - calibrates an optional cheap->heavy cascade for risk_level
+# - without drift, updates the previous models on new rows only (warm start)
 # ============================================================
 
 import os
+import csv
 import json
+import time
+import pickle
+import warnings
+import tracemalloc
+import sys
 import sqlite3
+import multiprocessing as mp
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
 import numpy as np
 import pandas as pd
 import joblib
+import sklearn
 
+from sklearn.base import clone
 from sklearn.model_selection import train_test_split
-from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, StandardScaler
-from sklearn.impute import SimpleImputer
-from sklearn.metrics import accuracy_score, recall_score, f1_score, roc_auc_score
+from sklearn.metrics import f1_score
+from sklearn.inspection import permutation_importance
 
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+from sklearn.tree import DecisionTreeClassifier
+from threadpoolctl import threadpool_limits
+
+import snapshot_cache
+import table_schema
+import feature_encoding
+import model_registry
+import streaming_training
 
 
 # ============================================================
@@ -41,6 +60,11 @@ MODEL_ROOT = "models"
 VERSIONS_DIR = os.path.join(MODEL_ROOT, "versions")
 LOG_PATH = os.path.join(MODEL_ROOT, "training_log.csv")
 STATE_PATH = os.path.join(MODEL_ROOT, "training_state.json")
+REGISTRY_PATH = os.path.join(MODEL_ROOT, "registry.db")          # model_registry.py: versions, metrics, promoted flag
+DRIFT_REF_PATH = os.path.join(MODEL_ROOT, "drift_reference.json")  # read by api_app /drift
+DRIFT_REPORT_PATH = os.path.join(MODEL_ROOT, "drift_report.csv")    # per-feature table of the last run
+BACKTEST_REPORT_PATH = os.path.join(MODEL_ROOT, "backtest_report.csv")  # --backtest: per-fold metrics
+FEATURES_PATH = os.path.join(MODEL_ROOT, "features.json")          # input columns of the last full run + importances
 
 RANDOM_STATE = 42
 TEST_SIZE = 0.2
@@ -48,10 +72,77 @@ TEST_SIZE = 0.2
 # training speed
 MAX_TRAIN_ROWS = 300_000          # None / 100k / 300k / 500k
 MIN_NEW_ROWS_TO_TRAIN = 10_000    # retrain only if enough new rows
+PARALLEL_TRAINING = True          # candidate fits (models x targets) in a process pool
+N_TRAIN_WORKERS = None            # None -> min(#fits, cpu_count); cores are split between workers
+SELECTION = "halving"             # "halving" (successive halving over MODELS x MODEL_GRID) | "full"
+HALVING_FACTOR = 3                # keep top 1/3 per rung, next rung has 3x the rows
+HALVING_MIN_ROWS = 5_000          # smallest rung subsample
+OUT_OF_CORE_ROWS = 2_000_000      # full retrain on a larger window -> streaming trainer (streaming_training.py); None = never
+OOC_CHUNK_ROWS = 200_000          # rows per chunk of the out-of-core trainer
+# cost-aware selection: best f1_macro among candidates within the serving budgets (None = no limit)
+MAX_LATENCY_B1_MS = 50.0          # predict_proba, batch of 1, ms per row
+MAX_LATENCY_B1K_MS = 1.0          # predict_proba, batch of LATENCY_BATCH, ms per row
+MAX_MODEL_MB = 200.0              # pickled estimator size
+LATENCY_BATCH = 1000
+LATENCY_REPEATS = 5
+MEASURE_PEAK_MEMORY = False       # peak_mem_mb: extra traced fit (tracemalloc) of every candidate, doubles fit cost
+EVAL_CHUNK_ROWS = 50_000          # candidate evaluation: rows per predict_proba call (flat memory)
+KEEP_VERSIONS = 10                # retention: newest N versions per target keep their files (+ promoted ones)
+AUTO_PROMOTE = True               # promote every new version; False -> promote by hand (model_registry.promote)
+# distillation: compact student fitted on the teacher's predict_proba (full runs only)
+DISTILL_ENABLED = True
+DISTILL_MAX_DEPTH = 4             # shallow HistGB student
+DISTILL_MAX_ITER = 100
+DISTILL_MIN_WEIGHT = 0.01         # soft-label rows with teacher proba below this are dropped
+DISTILL_MIN_AGREEMENT = 0.99      # fidelity threshold: api_app serves the student only at/above it ...
+DISTILL_F1_TOLERANCE = 0.01       # ... with f1_macro >= teacher f1_macro - tolerance (minority classes) ...
+DISTILL_MIN_SPEEDUP = 1.0         # ... and only if it is actually faster (teacher/student latency > this) ...
+DISTILL_MIN_SIZE_RATIO = 1.0      # ... and smaller (teacher/student pickle size > this)
+# joint model: one multi-output RandomForest predicts both targets in one pass (full runs only)
+JOINT_ENABLED = True
+JOINT_PARAMS = {"max_depth": 12, "min_samples_leaf": 5}  # on top of MODELS["RandomForest"]
+JOINT_F1_TOLERANCE = 0.005        # accepted (served by api_app) if every target f1_macro >= pair - tolerance
+                                  # and predicting both targets is faster than the two selected pipelines
+# feature pruning (full runs): smallest top-k feature set within the f1 tolerance, shared by both targets
+PRUNE_FEATURES = True
+PRUNE_F1_TOLERANCE = 0.005        # every target: f1_macro(top-k) >= f1_macro(all features) - tolerance
+PRUNE_CV_FOLDS = 3                # k is chosen on the mean f1 over this many validation folds of the train split
+PRUNE_VAL_ROWS = 20_000           # validation rows per fold: importance + choice of k
+PRUNE_REPEATS = 3                 # permutations per column
+PRUNE_FIT_ROWS = 20_000           # train rows (outside the fold) of the trial fits; winner refitted on all rows
+
+# --backtest: rolling origins over the training window in rowid order
+BACKTEST_FOLDS = 5                # origins t_1 < ... < t_K; fold k trains on rows < t_k, tests on the next block
+BACKTEST_TEST_ROWS = None         # rows per test block; None -> window // (BACKTEST_FOLDS + 1)
+DAEMON_POLL_SECONDS = 30          # --daemon: PRAGMA data_version poll interval
+DAEMON_RETRY_SECONDS = 300        # --daemon: wait after a failed training run
+USE_SNAPSHOT = True               # training window from Parquet snapshot (snapshot_cache.py) if pyarrow is installed
+
+# incremental retraining: previous best models are updated on the new rows only
+TRAIN_MODE = "auto"               # "auto" | "full" | "incremental"; drift (psi_max >= PSI_THRESHOLD) always -> full
+INCR_MAX_RUNS = 5                 # auto: full retrain after this many incremental runs in a row
+INCR_EXTRA_TREES = 50             # RandomForest: trees grown on new rows (warm_start)
+INCR_EXTRA_ITERS = 50             # HistGB: extra boosting iterations on new rows (warm_start)
+INCR_SGD_EPOCHS = 5               # linear: partial_fit passes over new rows (LogReg -> SGD, warm-started)
+INCR_SGD_ALPHA = 1e-5
+INCR_SGD_ETA0 = 1e-3              # small first step: start point is already a fitted model
+INCR_SGD_POWER_T = 0.5            # invscaling: eta = eta0 / t^power_t, later epochs move the model less
+INCR_F1_TOLERANCE = 0.005         # update rejected (-> full retrain) if test f1_macro drops more than this
+INCR_HGB_SKLEARN = ((1, 0), (1, 9))  # sklearn (major, minor) range where the frozen-bin HistGB update is verified
 
 # drift settings
 DRIFT_NUM_COLS = ["amount", "hour", "rule_score", "anomaly_score", "risk_score"]  # <-- adjust
+DRIFT_CAT_COLS = ["mcc_code", "tr_type", "flow"]                                   # <-- adjust
+DRIFT_MAX_CATEGORIES = 50  # rarer categories share one "__other__" bucket
 PSI_THRESHOLD = 0.2  # 0.1 small, 0.2 medium, 0.3+ strong drift
+DRIFT_BINS = 10
+DRIFT_CHUNK_ROWS = 100_000  # new rows are streamed through the saved reference edges
+DRIFT_SAMPLE_ROWS = 100_000 # no saved reference yet: uniform sample size of ref / new rows
+
+# cascade: cheap stage-1 scores everything, only uncertain rows go to the heavy risk model
+CASCADE_ENABLED = True
+CASCADE_STAGE1_DEPTH = 4            # shallow tree = microseconds per row
+CASCADE_TARGET_AGREEMENT = 0.99     # accepted stage-1 labels must match heavy model this often
 
 DROP_COLS = [TARGET_RISK, TARGET_COMPLEX]  # add "tr_datetime" if мешает
 
@@ -60,6 +151,32 @@ DROP_COLS = [TARGET_RISK, TARGET_COMPLEX]  # add "tr_datetime" if мешает
 # 1) UTIL: STATE
 # ============================================================
 
+# Daemon mode: the parent process keeps these between cycles and forks the
+# training run, so the child starts with them already in memory.
+_WARM = {}
+
+# Wall seconds per stage of the last main() run (training log column; benchmark_32.py reads it)
+STAGE_SECONDS = {}
+_STAGE_T0 = [0.0]
+
+
+def stage_start() -> None:
+    STAGE_SECONDS.clear()
+    _STAGE_T0[0] = time.perf_counter()
+
+
+def stage_done(name: str) -> None:
+    """Time since the previous stage_done() / stage_start() is added to STAGE_SECONDS[name]."""
+    now = time.perf_counter()
+    STAGE_SECONDS[name] = STAGE_SECONDS.get(name, 0.0) + now - _STAGE_T0[0]
+    _STAGE_T0[0] = now
+
+
+def connect_ro() -> sqlite3.Connection:
+    """Read-only connection: training never writes to the DB."""
+    return sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+
+
 def load_state(path: str) -> dict:
     if os.path.exists(path):
         with open(path, "r", encoding="utf-8") as f:
@@ -76,24 +193,7 @@ def save_state(path: str, state: dict) -> None:
 # 2) UTIL: PSI (Population Stability Index)
 # ============================================================
 
-def psi(expected: pd.Series, actual: pd.Series, bins: int = 10) -> float:
-    # drop NaN
-    expected = expected.dropna()
-    actual = actual.dropna()
-    if expected.empty or actual.empty:
-        return 0.0
-
-    # quantile bins on expected
-    try:
-        cuts = np.unique(np.quantile(expected, np.linspace(0, 1, bins + 1)))
-        if len(cuts) < 3:
-            return 0.0
-    except Exception:
-        return 0.0
-
-    exp_counts, _ = np.histogram(expected, bins=cuts)
-    act_counts, _ = np.histogram(actual, bins=cuts)
-
+def psi_from_counts(exp_counts: np.ndarray, act_counts: np.ndarray) -> float:
     exp_perc = exp_counts / max(exp_counts.sum(), 1)
     act_perc = act_counts / max(act_counts.sum(), 1)
 
@@ -105,69 +205,229 @@ def psi(expected: pd.Series, actual: pd.Series, bins: int = 10) -> float:
     return float(np.sum((act_perc - exp_perc) * np.log(act_perc / exp_perc)))
 
 
-def compute_drift(df_ref: pd.DataFrame, df_new: pd.DataFrame, cols: list[str]) -> dict:
+def category_keys(s: pd.Series) -> pd.Series:
+    """Non-null values of a categorical column as string keys.
+
+    An int column with NULLs arrives as float (read_sql, table_schema), so
+    integral floats are keyed like ints: 4814.0 -> "4814", not "4814.0".
+    """
+    s = s.dropna()
+    if not pd.api.types.is_float_dtype(s.dtype):
+        return s.astype(str)
+    v = s.to_numpy(dtype=float)
+    integral = np.isfinite(v) & (v == np.round(v))
+    keys = s.astype(str).to_numpy(dtype=object)
+    keys[integral] = v[integral].astype(np.int64).astype(str)
+    return pd.Series(keys, index=s.index, dtype=object)
+
+
+def build_drift_reference(df: pd.DataFrame, num_cols: list[str], cat_cols: list[str] = (),
+                          bins: int = DRIFT_BINS) -> dict:
+    """Reference histograms for all drift columns in one pass.
+
+    numeric:     quantile edges of every column from a single nanquantile(axis=0),
+                 counts via searchsorted
+    categorical: top DRIFT_MAX_CATEGORIES values (category_keys) from value_counts + "__other__"
+    """
     out = {}
-    for c in cols:
-        if c in df_ref.columns and c in df_new.columns:
-            out[c] = psi(df_ref[c], df_new[c])
-    out["psi_mean"] = float(np.mean(list(out.values()))) if out else 0.0
-    out["psi_max"] = float(np.max(list(out.values()))) if out else 0.0
+
+    num_cols = [c for c in num_cols if c in df.columns]
+    if num_cols:
+        A = df[num_cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float, copy=True)
+        A[~np.isfinite(A)] = np.nan
+        has_data = ~np.isnan(A).all(axis=0)
+
+        Q = np.full((bins + 1, A.shape[1]), np.nan)
+        if has_data.any():
+            Q[:, has_data] = np.nanquantile(A[:, has_data], np.linspace(0, 1, bins + 1), axis=0)
+
+        for j, c in enumerate(num_cols):
+            if not has_data[j]:
+                continue
+            cuts = np.unique(Q[:, j])
+            if len(cuts) < 3:
+                continue
+            x = A[:, j][~np.isnan(A[:, j])]
+            counts = np.bincount(np.searchsorted(cuts[1:-1], x, side="right"), minlength=len(cuts) - 1)
+            out[c] = {"type": "numeric", "edges": cuts.tolist(), "counts": counts.astype(int).tolist()}
+
+    for c in cat_cols:
+        if c not in df.columns:
+            continue
+        vc = category_keys(df[c]).value_counts()
+        if vc.empty:
+            continue
+        top = vc.iloc[:DRIFT_MAX_CATEGORIES]
+        out[c] = {
+            "type": "categorical",
+            "categories": top.index.tolist(),
+            # last bucket = everything outside the top categories
+            "counts": top.astype(int).tolist() + [int(vc.iloc[DRIFT_MAX_CATEGORIES:].sum())],
+        }
+
     return out
 
 
-# ============================================================
-# 3) UTIL: METRICS
-# ============================================================
+def save_drift_reference(path: str, ref: dict, version: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "bins": DRIFT_BINS, "columns": ref}, f, ensure_ascii=False, indent=2)
 
-def eval_multiclass(y_true, y_pred, y_proba=None):
-    out = {
-        "accuracy": accuracy_score(y_true, y_pred),
-        "recall_macro": recall_score(y_true, y_pred, average="macro", zero_division=0),
-        "f1_macro": f1_score(y_true, y_pred, average="macro", zero_division=0),
-        "roc_auc_ovr": np.nan
-    }
-    if y_proba is not None:
-        try:
-            out["roc_auc_ovr"] = roc_auc_score(y_true, y_proba, multi_class="ovr")
-        except Exception:
-            pass
+
+def load_drift_reference(path: str) -> dict | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        ref = json.load(f)
+    return ref.get("columns") or None
+
+
+def cached_drift_reference(path: str = DRIFT_REF_PATH) -> dict | None:
+    """load_drift_reference, re-read only when the file changed (daemon keeps it warm)."""
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    cached = _WARM.get("drift_ref")
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, load_drift_reference(path))
+        _WARM["drift_ref"] = cached
+    return cached[1]
+
+
+def drift_counts(ref: dict, df: pd.DataFrame) -> dict:
+    """Counts of df in the reference bins/categories (add across chunks)."""
+    out = {}
+    for c, h in ref.items():
+        if c not in df.columns:
+            continue
+        k = len(h["counts"])
+        if h.get("type", "numeric") == "numeric":
+            x = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=float)
+            x = x[np.isfinite(x)]
+            idx = np.searchsorted(np.asarray(h["edges"][1:-1], dtype=float), x, side="right")
+        else:
+            idx = pd.Index(h["categories"], dtype=object).get_indexer(category_keys(df[c]))
+            idx[idx < 0] = k - 1  # unseen / rare -> "__other__"
+        out[c] = np.bincount(idx, minlength=k).astype(np.int64)
+    return out
+
+
+def drift_report(ref: dict, act_counts: dict) -> pd.DataFrame:
+    """Per-feature drift table: PSI for every column, chi-square for categorical."""
+    from scipy.stats import chi2
+
+    rows = []
+    for c, h in ref.items():
+        exp = np.asarray(h["counts"], dtype=np.int64)
+        act = act_counts.get(c)
+        n_new = int(act.sum()) if act is not None else 0
+        row = {
+            "feature": c,
+            "type": h.get("type", "numeric"),
+            "n_ref": int(exp.sum()),
+            "n_new": n_new,
+            "psi": psi_from_counts(exp, act) if n_new > 0 else np.nan,
+            "chi2": np.nan,
+            "chi2_pvalue": np.nan,
+        }
+        if row["type"] == "categorical" and n_new > 0:
+            # add-half smoothing: an empty reference bucket must not divide by zero
+            exp_perc = (exp + 0.5) / (exp.sum() + 0.5 * len(exp))
+            expected = exp_perc * n_new
+            stat = float(np.sum((act - expected) ** 2 / expected))
+            row["chi2"] = stat
+            row["chi2_pvalue"] = float(chi2.sf(stat, max(len(exp) - 1, 1)))
+        rows.append(row)
+
+    rep = pd.DataFrame(rows, columns=["feature", "type", "n_ref", "n_new", "psi", "chi2", "chi2_pvalue"])
+    rep["drift_flag"] = (rep["psi"] >= PSI_THRESHOLD).astype(int)
+    return rep.sort_values("psi", ascending=False, na_position="last").reset_index(drop=True)
+
+
+def drift_summary(report: pd.DataFrame) -> dict:
+    """{feature: psi, ..., psi_mean, psi_max} — the shape main()/log expect."""
+    out = {r.feature: float(r.psi) for r in report.itertuples() if pd.notna(r.psi)}
+    vals = list(out.values())
+    out["psi_mean"] = float(np.mean(vals)) if vals else 0.0
+    out["psi_max"] = float(np.max(vals)) if vals else 0.0
     return out
 
 
+def iter_rowid_chunks(con, cols: list[str], after_rowid: int, chunk_rows: int):
+    """Keyset scan of LABELED_TABLE: rowid > after_rowid, chunk_rows at a time."""
+    select = ", ".join(["rowid AS _rowid_"] + cols)
+    last = int(after_rowid)
+    while True:
+        chunk = pd.read_sql(
+            f"SELECT {select} FROM {LABELED_TABLE} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            con, params=(last, chunk_rows)
+        )
+        if chunk.empty:
+            return
+        last = int(chunk["_rowid_"].iloc[-1])
+        yield table_schema.compact(chunk)
+
+
+def table_columns(con, table: str = LABELED_TABLE) -> list[str]:
+    return [r[1] for r in con.execute(f"PRAGMA table_info({table})")]
+
+
+def reservoir_sample(con, cols: list[str], after_rowid: int, k: int,
+                     chunk_rows: int = DRIFT_CHUNK_ROWS, seed: int = RANDOM_STATE) -> pd.DataFrame:
+    """Uniform sample of k rows with rowid > after_rowid, memory <= k + chunk_rows.
+
+    Bottom-k reservoir: every row gets a random key, the k smallest keys survive.
+    Equivalent to classic reservoir sampling, but vectorized per chunk.
+    """
+    rng = np.random.default_rng(seed)
+    res = None
+    for chunk in iter_rowid_chunks(con, cols, after_rowid, chunk_rows):
+        chunk["_key_"] = rng.random(len(chunk))
+        res = chunk if res is None else pd.concat([res, chunk], ignore_index=True)
+        if len(res) > k:
+            res = res.nsmallest(k, "_key_")
+
+    if res is None:
+        return pd.DataFrame(columns=["_rowid_"] + cols)
+    return res.drop(columns="_key_").sort_values("_rowid_").reset_index(drop=True)
+
+
+def stream_drift(con, ref: dict, after_rowid: int) -> pd.DataFrame:
+    """Drift report of rows with rowid > after_rowid against saved reference histograms.
+
+    Only the drift columns of the new rows are read, chunk by chunk, and binned
+    with the reference edges/categories (numeric values outside the reference
+    range go to the edge bins, like the api_app monitor). History is never re-read.
+    """
+    act = {}
+    for chunk in iter_rowid_chunks(con, list(ref.keys()), after_rowid, DRIFT_CHUNK_ROWS):
+        for c, cnt in drift_counts(ref, chunk).items():
+            act[c] = act[c] + cnt if c in act else cnt
+    return drift_report(ref, act)
+
+
+def compute_drift(df_ref: pd.DataFrame, df_new: pd.DataFrame, num_cols: list[str],
+                  cat_cols: list[str] = ()) -> pd.DataFrame:
+    ref = build_drift_reference(df_ref, num_cols, cat_cols)
+    return drift_report(ref, drift_counts(ref, df_new))
+
+
 # ============================================================
-# 4) TRAIN PIPELINES (like in 3.1, fixed sparse vs dense)
+# 3) TRAIN PIPELINES (like in 3.1, fixed sparse vs dense)
 # ============================================================
 
 def make_preprocessors(X: pd.DataFrame):
-    num_cols = X.select_dtypes(include=["int64","int32","float64","float32"]).columns.tolist()
-    cat_cols = [c for c in X.columns if c not in num_cols]
-
-    preprocess_onehot = ColumnTransformer(
-        transformers=[
-            ("num", Pipeline([
-                ("imputer", SimpleImputer(strategy="median")),
-                ("scaler", StandardScaler(with_mean=False))
-            ]), num_cols),
-            ("cat", Pipeline([
-                ("imputer", SimpleImputer(strategy="most_frequent")),
-                ("onehot", OneHotEncoder(handle_unknown="ignore"))
-            ]), cat_cols),
-        ],
-        remainder="drop"
-    )
-
-    preprocess_ordinal = ColumnTransformer(
-        transformers=[
-            ("num", Pipeline([
-                ("imputer", SimpleImputer(strategy="median"))
-            ]), num_cols),
-            ("cat", Pipeline([
-                ("imputer", SimpleImputer(strategy="most_frequent")),
-                ("ord", OrdinalEncoder(handle_unknown="use_encoded_value", unknown_value=-1))
-            ]), cat_cols),
-        ],
-        remainder="drop"
-    )
+    """Unfitted (onehot, ordinal) preprocessors + the numeric / categorical split of X.
+
+    The encoding of every column is chosen again when a preprocessor is fitted
+    (feature_encoding.CardinalityEncoder): low-cardinality strings one-hot / ordinal,
+    mid-cardinality ones hashed, high-cardinality datetimes (tr_datetime) parsed into
+    parts, other high-cardinality strings dropped. cat_cols = kept string columns.
+    """
+    plan = feature_encoding.plan_encodings(X)
+    num_cols = [c for c, p in plan.items() if p["encoding"] == "numeric"]
+    cat_cols = [c for c, p in plan.items() if p["encoding"] in ("category", "hash")]
+
+    preprocess_onehot = feature_encoding.CardinalityEncoder(kind="onehot")
+    preprocess_ordinal = feature_encoding.CardinalityEncoder(kind="ordinal")
     return preprocess_onehot, preprocess_ordinal, num_cols, cat_cols
 
 
@@ -179,102 +439,453 @@ MODELS = {
     "HistGB": ("ordinal", HistGradientBoostingClassifier(random_state=RANDOM_STATE)),
 }
 
+COST_COLS = ["f1_macro", "fit_seconds", "latency_b1_ms", "latency_b1k_ms", "peak_mem_mb", "model_mb"]
 
-def train_and_select(X_train, y_train, X_test, y_test, preprocess_onehot, preprocess_ordinal, target_name: str):
-    rows = []
-    best_name, best_pipe, best_f1 = None, None, -1
+# small per-family grid for successive halving ({} = MODELS defaults)
+MODEL_GRID = {
+    "LogReg": [{}, {"C": 0.1}],
+    "RandomForest": [{}, {"max_depth": 12, "min_samples_leaf": 5}],
+    "HistGB": [{}, {"learning_rate": 0.05, "max_leaf_nodes": 63}],
+}
 
-    for name, (kind, clf) in MODELS.items():
-        preprocess = preprocess_onehot if kind == "onehot" else preprocess_ordinal
-        pipe = Pipeline([("preprocess", preprocess), ("model", clf)])
-        pipe.fit(X_train, y_train)
 
-        pred = pipe.predict(X_test)
-        proba = None
-        if hasattr(pipe.named_steps["model"], "predict_proba"):
-            try:
-                proba = pipe.predict_proba(X_test)
-            except Exception:
-                pass
+# Data shared by all fits of one run. Pool workers receive it once
+# (initializer), not once per job.
+_TRAIN_DATA = {}
 
-        m = eval_multiclass(y_test, pred, proba)
-        m["model"] = name
-        m["target"] = target_name
-        rows.append(m)
 
-        if m["f1_macro"] > best_f1:
-            best_f1 = m["f1_macro"]
-            best_name = name
-            best_pipe = pipe
+def _init_train_worker(data: dict) -> None:
+    _TRAIN_DATA.clear()
+    _TRAIN_DATA.update(data)
 
-    res = pd.DataFrame(rows).sort_values("f1_macro", ascending=False).reset_index(drop=True)
-    return res, best_name, best_pipe
 
+def fit_preprocessors(X_train, X_test, preprocessors: dict) -> dict:
+    """Fit each preprocessor kind ONCE -> {kind: (fitted, Xt_train, Xt_test)}.
 
-# ============================================================
-# 5) MAIN: LOAD NEW DATA + DRIFT + TRAIN
-# ============================================================
+    All candidates of that kind and both targets reuse the transformed matrices
+    instead of refitting the same ColumnTransformer inside every Pipeline.
+    """
+    out = {}
+    for kind, pre in preprocessors.items():
+        pre = clone(pre)
+        Xt_train = pre.fit_transform(X_train)
+        out[kind] = (pre, Xt_train, pre.transform(X_test))
+    return out
 
-def main():
-    os.makedirs(VERSIONS_DIR, exist_ok=True)
-    os.makedirs(MODEL_ROOT, exist_ok=True)
 
-    state = load_state(STATE_PATH)
-    last_rowid = int(state.get("last_rowid", 0))
+def _fit_candidate(job: dict, d: dict | None = None) -> dict:
+    """Fit one (target, model) estimator on cached preprocessed matrices and evaluate it.
+
+    d: shared run data (default: _TRAIN_DATA of this worker).
+    job["rows"] (halving rungs): fit on the first rows of the target's stratified order.
+    job["keep_model"] = False: the fitted estimator is not sent back (metrics only).
+    """
+    d = _TRAIN_DATA if d is None else d
+    target, kind, model = job["target"], job["kind"], job["model"]
+    Xt_train, Xt_test = d["Xt_train"][kind], d["Xt_test"][kind]
+    y_train, y_test = d["y_train"][target], d["y_test"][target]
+
+    rows = job.get("rows")
+    if rows is not None and rows < len(y_train):
+        idx = d["order"][target][:rows]
+        Xt_train, y_train = Xt_train[idx], y_train.iloc[idx]
+
+    # BLAS / OpenMP (HistGB) threads limited to this job's share of the cores
+    with threadpool_limits(limits=job["n_threads"]):
+        # fit_seconds ranks candidates and sizes the rungs: timed without tracing
+        t0 = time.perf_counter()
+        model.fit(Xt_train, y_train)
+        fit_seconds = time.perf_counter() - t0
+
+        # tracemalloc slows Python-heavy fits several-fold: peak memory from a separate fit of a clone
+        peak_mem_mb = np.nan
+        if MEASURE_PEAK_MEMORY:
+            tracemalloc.start()
+            try:
+                clone(model).fit(Xt_train, y_train)
+                peak_mem_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            finally:
+                tracemalloc.stop()
+
+        # one predict_proba pass in EVAL_CHUNK_ROWS slices (labels = argmax), flat memory
+        m = streaming_training.evaluate_chunked(model, Xt_test, y_test, EVAL_CHUNK_ROWS)
+        latency = predict_latency_ms(model, Xt_test)
+
+    m["model"] = job["name"]
+    m["target"] = target
+    m["rows"] = len(y_train)
+    m["fit_seconds"] = fit_seconds
+    m.update(latency)
+    m["peak_mem_mb"] = peak_mem_mb
+    m["model_mb"] = len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 2**20
+    m["within_budget"] = within_budget(m)
+    return {"target": target, "name": job["name"], "kind": kind, "metrics": m,
+            "model": model if job.get("keep_model", True) else None}
+
+
+def predict_latency_ms(model, Xt, predict=None) -> dict:
+    """Per-row predict_proba latency (ms) at batch 1 and batch LATENCY_BATCH, median of repeats.
+
+    Model only: the preprocessor is shared by all candidates of its kind.
+    predict: callable timed instead of model.predict_proba (e.g. several pipelines in a row).
+    """
+    if predict is None:
+        predict = model.predict_proba if hasattr(model, "predict_proba") else model.predict
+    out = {}
+    for key, n in (("latency_b1_ms", 1), ("latency_b1k_ms", LATENCY_BATCH)):
+        X = Xt[:min(n, Xt.shape[0])]
+        times = []
+        for _ in range(LATENCY_REPEATS):
+            t0 = time.perf_counter()
+            predict(X)
+            times.append(time.perf_counter() - t0)
+        out[key] = float(np.median(times)) * 1000 / max(X.shape[0], 1)
+    return out
 
-    con = sqlite3.connect(DB_PATH)
 
-    # How many rows now?
-    total_rows = pd.read_sql(f"SELECT COUNT(*) AS n FROM {LABELED_TABLE}", con)["n"].iloc[0]
+def within_budget(m: dict) -> bool:
+    """Serving budgets (None = no limit) on the measured costs of one candidate."""
+    checks = [
+        (MAX_LATENCY_B1_MS, m.get("latency_b1_ms")),
+        (MAX_LATENCY_B1K_MS, m.get("latency_b1k_ms")),
+        (MAX_MODEL_MB, m.get("model_mb")),
+    ]
+    return all(limit is None or value is None or value <= limit for limit, value in checks)
 
-    # Load NEW rows by rowid
-    df_new = pd.read_sql(
-        f"SELECT rowid AS _rowid_, * FROM {LABELED_TABLE} WHERE rowid > {last_rowid}",
-        con
-    )
 
-    print(f"[INFO] total_rows={total_rows:,} | last_rowid={last_rowid:,} | new_rows={len(df_new):,}")
+def rank_candidates(results: list[dict]) -> list[dict]:
+    """Best first: within budget before over budget, then f1_macro."""
+    return sorted(results, key=lambda r: (not r["metrics"]["within_budget"], -r["metrics"]["f1_macro"]))
 
-    if len(df_new) < MIN_NEW_ROWS_TO_TRAIN:
-        print("[SKIP] Not enough new data to retrain. Exiting.")
-        con.close()
+
+@contextmanager
+def candidate_runner(data: dict, n_workers: int, fit=_fit_candidate):
+    """-> run(jobs) executing fits in ONE process pool (n_workers > 1) or in-process.
+
+    The pool outlives several run() calls (halving rungs), so workers receive
+    the shared matrices once per training run.
+    fit: top-level job function (picklable), _fit_candidate by default.
+    """
+    if n_workers <= 1:
+        _init_train_worker(data)
+        try:
+            yield lambda jobs: [fit(j) for j in jobs]
+        finally:
+            _TRAIN_DATA.clear()
         return
 
-    # Load reference sample = previous data (small slice) for drift comparison
-    # (take last 100k older rows)
-    df_ref = pd.read_sql(
-        f"""
-        SELECT rowid AS _rowid_, * FROM {LABELED_TABLE}
-        WHERE rowid <= {last_rowid}
-        ORDER BY rowid DESC
-        LIMIT 100000
-        """,
-        con
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_train_worker, initargs=(data,)) as ex:
+        yield lambda jobs: list(ex.map(fit, jobs))
+
+
+def run_candidate_jobs(jobs: list[dict], data: dict, n_workers: int) -> list[dict]:
+    """Run fits in a process pool (n_workers > 1) or in-process; keeps job order."""
+    with candidate_runner(data, n_workers if len(jobs) > 1 else 1) as run:
+        return run(jobs)
+
+
+def candidate_grid() -> dict:
+    """{candidate_name: (kind, unfitted estimator)}: MODELS x MODEL_GRID.
+
+    Default params keep the family name ("HistGB"), variants get a suffix
+    ("HistGB_learning_rate-0.05_max_leaf_nodes-63"); names go into file names.
+    """
+    out = {}
+    for family, (kind, clf) in MODELS.items():
+        for params in MODEL_GRID.get(family) or [{}]:
+            name = "_".join([family] + [f"{k}-{v}" for k, v in params.items()])
+            out[name] = (kind, clone(clf).set_params(**params))
+    return out
+
+
+def stratified_order(y: pd.Series, seed: int = RANDOM_STATE) -> np.ndarray:
+    """Row order whose every prefix keeps the class proportions of y (halving subsamples)."""
+    rng = np.random.default_rng(seed)
+    y = np.asarray(y)
+    _, inv, counts = np.unique(y, return_inverse=True, return_counts=True)
+    # random rank inside the class, scaled to [0, 1): classes interleave evenly
+    rank = np.empty(len(y))
+    for c in range(len(counts)):
+        m = np.nonzero(inv == c)[0]
+        rank[m] = rng.permutation(len(m))
+    key = (rank + rng.random(len(y))) / counts[inv]
+    return np.argsort(key, kind="stable")
+
+
+def halving_schedule(n_candidates: int, n_train: int) -> list[int]:
+    """Rows per rung: n_train * factor^(k - n_rungs), at least HALVING_MIN_ROWS."""
+    n_rungs = max(1, int(np.ceil(np.log(max(n_candidates, 1)) / np.log(HALVING_FACTOR))))
+    sizes = [int(n_train * HALVING_FACTOR ** (k - n_rungs)) for k in range(n_rungs)]
+    return [min(max(s, HALVING_MIN_ROWS), n_train) for s in sizes]
+
+
+def trace_entry(r: dict, rung, kept: bool) -> dict:
+    m = r["metrics"]
+    out = {"rung": rung, "rows": m["rows"], "model": r["name"]}
+    out.update({k: round(float(m[k]), 6) for k in COST_COLS})
+    out.update({"within_budget": int(m["within_budget"]), "kept": int(kept)})
+    return out
+
+
+def train_and_select_all(X_train, X_test, y_train: dict, y_test: dict, preprocess_onehot, preprocess_ordinal,
+                         prepped: dict | None = None):
+    """All candidates x all targets -> {target: (results_df, best_name, best_pipe, trace)}.
+
+    y_train / y_test: {target_name: Series}. With PARALLEL_TRAINING the fits run
+    concurrently; each estimator gets cpu_count // workers threads instead of
+    n_jobs=-1, so RF and LogReg do not oversubscribe the machine.
+    prepped: output of fit_preprocessors (fitted here if not given).
+
+    SELECTION="halving": every candidate (MODELS x MODEL_GRID) is fitted on a small
+    stratified subsample, the top 1/HALVING_FACTOR by f1_macro survive to the next,
+    HALVING_FACTOR times larger rung; only the finalist is fitted on all of X_train.
+    SELECTION="full": every MODELS entry is fitted on all of X_train (old behaviour).
+    Candidates over the latency / size budgets rank after all others (rank_candidates),
+    at every rung and in the final pick.
+    trace: [{"rung", "rows", "model", f1 + COST_COLS, "within_budget", "kept"}] per target,
+    rung "final" = fits on all of X_train.
+    Returned best pipelines are full Pipeline(preprocess -> model), as before.
+    """
+    halving = SELECTION == "halving"
+    cands = candidate_grid() if halving else dict(MODELS)
+
+    if prepped is None:
+        kinds = {kind for kind, _ in cands.values()}
+        all_pre = {"onehot": preprocess_onehot, "ordinal": preprocess_ordinal}
+        prepped = fit_preprocessors(X_train, X_test, {k: all_pre[k] for k in kinds})
+
+    n_train = len(X_train)
+    rungs = halving_schedule(len(cands), n_train) if halving else []
+
+    cores = os.cpu_count() or 1
+    n_first = len(cands) * len(y_train)  # widest stage
+    n_workers = min(n_first, N_TRAIN_WORKERS or cores) if PARALLEL_TRAINING else 1
+    n_threads = max(1, cores // n_workers)
+
+    def make_job(target, name, rows):
+        kind, clf = cands[name]
+        # fresh copy: the same candidate objects are reused for every target / rung
+        model = clone(clf)
+        if "n_jobs" in model.get_params():
+            model.set_params(n_jobs=n_threads)
+        return {"target": target, "name": name, "kind": kind, "model": model, "n_threads": n_threads, "rows": rows}
+
+    print(f"[TRAIN] {len(cands)} candidates x {len(y_train)} targets | "
+          f"{'halving rungs=' + str(rungs) if halving else 'full fits'} | "
+          f"workers={n_workers} | threads/fit={n_threads}")
+    data = {
+        "Xt_train": {k: v[1] for k, v in prepped.items()},
+        "Xt_test": {k: v[2] for k, v in prepped.items()},
+        "y_train": y_train,
+        "y_test": y_test,
+        "order": {t: stratified_order(y) for t, y in y_train.items()} if halving else {},
+    }
+
+    alive = {t: list(cands) for t in y_train}
+    trace = {t: [] for t in y_train}
+    rung_rows = {t: [] for t in y_train}
+    with candidate_runner(data, n_workers) as run:
+        for k, rows in enumerate(rungs):
+            if all(len(a) <= 1 for a in alive.values()):
+                break
+            results = run([make_job(t, name, rows) for t in y_train for name in alive[t] if len(alive[t]) > 1])
+            for t in y_train:
+                res_t = rank_candidates([r for r in results if r["target"] == t])
+                if not res_t:
+                    continue
+                n_keep = max(1, int(np.ceil(len(res_t) / HALVING_FACTOR)))
+                alive[t] = [r["name"] for r in res_t[:n_keep]]
+                for i, r in enumerate(res_t):
+                    rung_rows[t].append({**r["metrics"], "rung": k})
+                    trace[t].append(trace_entry(r, k, kept=i < n_keep))
+
+        # finalists (or every candidate without halving) on all of X_train
+        results = run([make_job(t, name, None) for t in y_train for name in alive[t]])
+
+    out = {}
+    for target in y_train:
+        # best f1 within the latency / size budgets
+        ranked = rank_candidates([r for r in results if r["target"] == target])
+        best = ranked[0]
+        if not best["metrics"]["within_budget"]:
+            print(f"[WARN] {target}: no candidate within latency/size budgets, best f1 taken")
+        trace[target] += [trace_entry(r, "final", kept=r is best) for r in ranked]
+
+        # serving artifact = shared fitted preprocessor + fitted model
+        best_pipe = Pipeline([("preprocess", prepped[best["kind"]][0]), ("model", best["model"])])
+        res = pd.DataFrame([{**r["metrics"], "rung": "final"} for r in ranked])
+        if rung_rows[target]:
+            res = pd.concat([res, pd.DataFrame(rung_rows[target]).iloc[::-1]])
+        out[target] = (res.reset_index(drop=True), best["name"], best_pipe, trace[target])
+    return out
+
+
+def train_and_select(X_train, y_train, X_test, y_test, preprocess_onehot, preprocess_ordinal, target_name: str):
+    return train_and_select_all(
+        X_train, X_test, {target_name: y_train}, {target_name: y_test}, preprocess_onehot, preprocess_ordinal
+    )[target_name][:3]
+
+
+# ============================================================
+# 3b) CASCADE: stage-1 thresholds calibrated to target agreement
+# ============================================================
+
+def calibrate_cascade_thresholds(conf: np.ndarray, pred1: np.ndarray, heavy_pred: np.ndarray,
+                                 classes, target_agreement: float) -> dict:
+    """Per predicted class: lowest stage-1 confidence that keeps agreement >= target.
+
+    Rows of class c are accepted if conf >= thr[c], the rest are escalated.
+    Cuts are only placed between distinct confidence values (trees give ties).
+    """
+    thresholds = {}
+    for c in classes:
+        m = pred1 == c
+        if not m.any():
+            thresholds[c] = float("inf")
+            continue
+
+        order = np.argsort(-conf[m], kind="stable")
+        conf_c = conf[m][order]
+        agree = (heavy_pred[m] == c)[order]
+        prefix = np.cumsum(agree) / np.arange(1, len(agree) + 1)
+
+        cut_ok = np.r_[conf_c[:-1] != conf_c[1:], True]
+        ok = np.nonzero((prefix >= target_agreement) & cut_ok)[0]
+        thresholds[c] = float(conf_c[ok[-1]]) if ok.size else float("inf")
+    return thresholds
+
+
+def apply_cascade(stage1, thresholds: dict, heavy, X):
+    """Cascade prediction: returns (pred, escalated_mask)."""
+    p1 = stage1.predict_proba(X)
+    cls1 = np.asarray(stage1.classes_)
+    idx = p1.argmax(axis=1)
+    conf = p1.max(axis=1)
+    thr = np.array([thresholds.get(c, float("inf")) for c in cls1])
+
+    escalated = conf < thr[idx]
+    pred = cls1[idx].astype(object)
+    if escalated.any():
+        pred[escalated] = heavy.predict(X[escalated])
+    return pred, escalated
+
+
+def train_cascade(X_train, y_train, X_cal, X_eval, y_eval, preprocess_ordinal, heavy_pipe, Xt_train=None):
+    """Fit stage-1, calibrate thresholds on X_cal, report on (X_eval, y_eval).
+
+    Xt_train given -> preprocess_ordinal is already fitted and Xt_train is its
+    output on X_train (shared with the candidate fits).
+    """
+    tree = DecisionTreeClassifier(max_depth=CASCADE_STAGE1_DEPTH, random_state=RANDOM_STATE)
+    if Xt_train is None:
+        stage1 = Pipeline([("preprocess", clone(preprocess_ordinal)), ("model", tree)])
+        stage1.fit(X_train, y_train)
+    else:
+        tree.fit(Xt_train, y_train)
+        stage1 = Pipeline([("preprocess", preprocess_ordinal), ("model", tree)])
+
+    p1 = stage1.predict_proba(X_cal)
+    classes = np.asarray(stage1.classes_)
+    thresholds = calibrate_cascade_thresholds(
+        conf=p1.max(axis=1),
+        pred1=classes[p1.argmax(axis=1)],
+        heavy_pred=np.asarray(heavy_pipe.predict(X_cal)),
+        classes=classes,
+        target_agreement=CASCADE_TARGET_AGREEMENT,
     )
 
-    con.close()
+    pred, escalated = apply_cascade(stage1, thresholds, heavy_pipe, X_eval)
+    heavy_pred = heavy_pipe.predict(X_eval)
 
-    # Drift check
-    drift = compute_drift(df_ref, df_new, DRIFT_NUM_COLS) if len(df_ref) > 0 else {"psi_mean": 0.0, "psi_max": 0.0}
-    drift_flag = drift.get("psi_max", 0.0) >= PSI_THRESHOLD
+    metrics = {
+        "escalation_rate": float(escalated.mean()) if len(escalated) else 0.0,
+        "agreement": float(np.mean(pred == heavy_pred)) if len(pred) else 0.0,
+        "f1_macro": f1_score(y_eval, pred.astype(str), average="macro", zero_division=0),
+    }
+    artifact = {
+        "stage1": stage1,
+        "thresholds": thresholds,
+        "target_agreement": CASCADE_TARGET_AGREEMENT,
+        **metrics,
+    }
+    return artifact, metrics
 
-    print("[DRIFT] psi_mean={:.4f} psi_max={:.4f} flag={}".format(
-        drift.get("psi_mean", 0.0), drift.get("psi_max", 0.0), drift_flag
-    ))
 
-    # Training set = previous + new (or only recent slice)
-    # Universal approach: retrain on recent window (fast + adapts)
-    con = sqlite3.connect(DB_PATH)
+# ============================================================
+# 3c) TRAINING WINDOW: Parquet snapshot, SQLite as fallback
+# ============================================================
+
+def load_training_window(con, n_rows: int) -> pd.DataFrame:
+    """Last n_rows of LABELED_TABLE, newest first (same order as the SQL query).
+
+    With the snapshot, only rowid ranges exported since the last run are read
+    from SQLite; the window itself is assembled from memory-mapped partitions,
+    so consecutive runs share most of their data.
+    In daemon mode the window cached by the parent is topped up with new rows instead.
+    """
+    if "window" in _WARM and n_rows <= _WARM["window_rows"]:
+        warm = refresh_warm_window(con)
+        if warm is not None:
+            print(f"[DATA] window from daemon cache: {min(n_rows, len(warm)):,} rows")
+            return warm.iloc[-n_rows:].iloc[::-1].reset_index(drop=True)  # already compact
+
+    if USE_SNAPSHOT and snapshot_cache.SNAPSHOT_AVAILABLE:
+        try:
+            snapshot_cache.export_new_partitions(con, LABELED_TABLE)
+            df = snapshot_cache.load_window(LABELED_TABLE, n_rows)
+            if df is not None:
+                print(f"[DATA] window from snapshot: {len(df):,} rows")
+                return table_schema.compact(df.iloc[::-1].reset_index(drop=True), report=True, label="window")
+        except Exception as e:
+            print(f"[WARN] snapshot unavailable ({type(e).__name__}: {e}), reading SQLite", file=sys.stderr)
+
     df = pd.read_sql(
         f"""
         SELECT rowid AS _rowid_, * FROM {LABELED_TABLE}
         ORDER BY rowid DESC
-        LIMIT {MAX_TRAIN_ROWS if MAX_TRAIN_ROWS is not None else 2000000}
+        LIMIT {int(n_rows)}
         """,
         con
     )
-    con.close()
-
+    return table_schema.compact(df, report=True, label="window")
+
+
+def refresh_warm_window(con) -> pd.DataFrame | None:
+    """Append rows committed since the cached window (oldest first), keep the last window_rows.
+
+    A rewritten table (labeling_23 replaces it with the same or more rows and new
+    labels) is detected by its generation marker (snapshot_cache.mark_rewritten).
+    """
+    warm = _WARM.get("window")
+    if warm is None:
+        return None
+    if snapshot_cache.table_generation(con, LABELED_TABLE) != _WARM.get("window_generation"):
+        print("[DATA] table rewritten since the daemon cache was built -> reloading")
+        _WARM.pop("window", None)
+        return None
+
+    last = int(warm["_rowid_"].iloc[-1]) if len(warm) else 0
+    max_rowid = con.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {LABELED_TABLE}").fetchone()[0]
+    if max_rowid > last:
+        delta = pd.read_sql(
+            f"SELECT rowid AS _rowid_, * FROM {LABELED_TABLE} WHERE rowid > ? ORDER BY rowid",
+            con, params=(last,)
+        )
+        if list(delta.columns) != list(warm.columns):
+            max_rowid = -1  # schema changed -> drop the cache
+        else:
+            warm = pd.concat([warm, delta], ignore_index=True).iloc[-_WARM["window_rows"]:].reset_index(drop=True)
+            warm = table_schema.compact(warm)  # concat with the raw delta undoes the categoricals
+            _WARM["window"] = warm
+
+    if max_rowid < last:  # table shrank (rewritten without a marker) or schema changed
+        _WARM.pop("window", None)
+        return None
+    return warm
+
+
+def prepare_xy(df: pd.DataFrame):
+    """Training frame -> (df, X, y_risk, y_cx) with the same cleaning for full and incremental runs."""
     df = df.drop(columns=["_rowid_"], errors="ignore")
     df = df.replace([np.inf, -np.inf], np.nan)
 
@@ -283,35 +894,897 @@ def main():
         if t not in df.columns:
             raise ValueError(f"Missing target: {t}")
 
-    # Build X,y
     feature_cols = [c for c in df.columns if c not in DROP_COLS]
     X = df[feature_cols].copy()
-    y_risk = df[TARGET_RISK].astype(str)
-    y_cx = df[TARGET_COMPLEX].astype(str)
+    return df, X, df[TARGET_RISK].astype(str), df[TARGET_COMPLEX].astype(str)
+
+
+# ============================================================
+# 3d) INCREMENTAL: update the previous best models on new rows
+# ============================================================
+
+def choose_train_mode(state: dict, drift_flag: bool) -> tuple[str, str]:
+    """-> (mode, reason). Drift always forces a full retrain."""
+    if TRAIN_MODE == "full":
+        return "full", "TRAIN_MODE=full"
+    if drift_flag:
+        return "full", f"drift psi_max >= {PSI_THRESHOLD}"
+    paths = [state.get("risk_model_path"), state.get("cx_model_path")]
+    if not all(p and os.path.exists(p) for p in paths):
+        return "full", "no previous models"
+    if TRAIN_MODE == "auto" and int(state.get("incremental_runs", 0)) >= INCR_MAX_RUNS:
+        return "full", f"{INCR_MAX_RUNS} incremental runs in a row"
+    return "incremental", "no drift"
+
+
+def _fit_on_frozen_bins(model: HistGradientBoostingClassifier, Xt, y) -> None:
+    """Continue boosting with the bin mapper of the previous fit.
+
+    HistGB re-bins the training data on every fit(), but warm-started trees hold
+    thresholds in the OLD bin indices: new rows must be binned the same way or the
+    starting raw predictions (and the old trees at serving time) disagree.
+    Relies on the private _bin_data/_bin_mapper: only called when
+    frozen_bins_supported() is true.
+    """
+    mapper = model._bin_mapper
+
+    def _bin_data(X, sample_weight, is_training_data):
+        model._bin_mapper = mapper  # fit() has just replaced it with an unfitted one
+        X_binned = mapper.transform(X)
+        return X_binned if is_training_data else np.ascontiguousarray(X_binned)
+
+    model._bin_data = _bin_data
+    try:
+        model.fit(Xt, y)
+    finally:
+        del model._bin_data
+
+
+def frozen_bins_supported(model: HistGradientBoostingClassifier) -> bool:
+    version = tuple(int(p) for p in sklearn.__version__.split(".")[:2])
+    lo, hi = INCR_HGB_SKLEARN
+    return lo <= version <= hi and hasattr(model, "_bin_data") and hasattr(model, "_bin_mapper")
+
+
+def update_model(model, Xt_train, y_train):
+    """Warm-start update of a fitted estimator -> (model, name) or (None, reason)."""
+    classes = np.unique(np.asarray(y_train))
+
+    if isinstance(model, (RandomForestClassifier, HistGradientBoostingClassifier)):
+        # new trees / iterations must predict the same class columns as the old ones
+        if not np.array_equal(classes, np.asarray(model.classes_)):
+            return None, "class set changed"
+
+        if isinstance(model, RandomForestClassifier):
+            model.set_params(warm_start=True, n_estimators=model.n_estimators + INCR_EXTRA_TREES)
+            with warnings.catch_warnings():
+                # balanced_subsample + warm_start: new trees are balanced on the new rows, as intended
+                warnings.filterwarnings("ignore", message="class_weight presets")
+                model.fit(Xt_train, y_train)
+            model.set_params(warm_start=False)
+            return model, "RandomForest"
+
+        if not frozen_bins_supported(model):
+            return None, f"HistGB warm start not verified on sklearn {sklearn.__version__}"
+        model.set_params(warm_start=True, max_iter=model.n_iter_ + INCR_EXTRA_ITERS)
+        _fit_on_frozen_bins(model, Xt_train, y_train)
+        model.set_params(warm_start=False)
+        return model, "HistGB"
+
+    if isinstance(model, (LogisticRegression, SGDClassifier)):
+        if not set(classes) <= set(model.classes_):
+            return None, "new class in labels"
+
+        if isinstance(model, LogisticRegression):
+            # linear candidate -> SGD (log loss) starting from the LogReg coefficients;
+            # partial_fit keeps a preset coef_ instead of allocating zeros
+            sgd = SGDClassifier(loss="log_loss", alpha=INCR_SGD_ALPHA, random_state=RANDOM_STATE)
+            sgd.coef_ = model.coef_.copy()
+            sgd.intercept_ = model.intercept_.copy()
+            model = sgd
+        # also for an SGD from the out-of-core path (constant eta0=0.1 there)
+        model.set_params(learning_rate="invscaling", eta0=INCR_SGD_ETA0, power_t=INCR_SGD_POWER_T)
+
+        # same weighting as the out-of-core trainer
+        y_arr = np.asarray(y_train)
+        model_classes = getattr(model, "classes_", classes)
+        counts = pd.Series(y_arr).value_counts()
+        w = streaming_training.sqrt_balanced_weights(counts, model_classes)[np.searchsorted(model_classes, y_arr)]
+        rng = np.random.default_rng(RANDOM_STATE)
+        for _ in range(INCR_SGD_EPOCHS):
+            idx = rng.permutation(len(y_arr))
+            model.partial_fit(Xt_train[idx], y_arr[idx], classes=model_classes, sample_weight=w[idx])
+        return model, "SGD"
+
+    return None, f"no incremental update for {type(model).__name__}"
+
+
+def _predict_eval(model, Xt, y) -> dict:
+    return streaming_training.evaluate_chunked(model, Xt, y, EVAL_CHUNK_ROWS)
+
+
+def incremental_update(X_train, X_test, y_train: dict, y_test: dict, state: dict):
+    """Update the previous best pipeline of every target on the new rows.
+
+    The fitted preprocessor is reused as is (transform only), so the update costs
+    one pass of the new rows instead of a refit on the whole window.
+    Returns {target: (metrics, name, pipe)} or None if any target can't be updated or
+    its test f1_macro drops more than INCR_F1_TOLERANCE (caller falls back to a full retrain).
+    """
+    paths = {TARGET_RISK: state["risk_model_path"], TARGET_COMPLEX: state["cx_model_path"]}
+    out = {}
+    for target, path in paths.items():
+        prev = joblib.load(path)
+        pre, model = prev.named_steps["preprocess"], prev.named_steps["model"]
+        if list(getattr(pre, "feature_names_in_", X_train.columns)) != list(X_train.columns):
+            print(f"[INCR] {target}: feature columns changed")
+            return None
+
+        Xt_train, Xt_test = pre.transform(X_train), pre.transform(X_test)
+        prev_m = _predict_eval(model, Xt_test, y_test[target])
+
+        t0 = time.perf_counter()
+        model, name = update_model(model, Xt_train, y_train[target])
+        if model is None:
+            print(f"[INCR] {target}: {name}")
+            return None
+        fit_seconds = time.perf_counter() - t0
+
+        m = _predict_eval(model, Xt_test, y_test[target])
+        m.update({"model": name, "target": target, "fit_seconds": fit_seconds,
+                  "prev_f1_macro": prev_m["f1_macro"]})
+        print("[INCR] {}: {} f1_macro {:.4f} -> {:.4f} ({:.1f}s)".format(
+            target, name, prev_m["f1_macro"], m["f1_macro"], fit_seconds))
+        if m["f1_macro"] < prev_m["f1_macro"] - INCR_F1_TOLERANCE:
+            print(f"[INCR] {target}: update rejected, f1_macro dropped more than {INCR_F1_TOLERANCE}")
+            return None
+        out[target] = (m, name, Pipeline([("preprocess", pre), ("model", model)]))
+    return out
+
+
+def update_drift_reference(ref: dict, df: pd.DataFrame) -> dict:
+    """Add the new rows to the reference counts (edges/categories stay fixed)."""
+    new = drift_counts(ref, df)
+    out = {}
+    for c, h in ref.items():
+        h = dict(h)
+        if c in new:
+            h["counts"] = (np.asarray(h["counts"], dtype=np.int64) + new[c]).tolist()
+        out[c] = h
+    return out
+
+
+def print_mode_comparison(reg) -> None:
+    """Average cost / quality of full vs incremental runs (registry GROUP BY, no log re-read)."""
+    summary = pd.DataFrame(model_registry.mode_summary(reg))
+    if summary.empty:
+        return
+    print("[MODES]")
+    print(summary.to_string(index=False))
+
+
+def register_existing_versions(reg, current_version: str) -> int:
+    """Empty registry: register the joblib files already in VERSIONS_DIR (no metrics),
+    so retention also covers versions saved before the registry existed.
+    current_version (just saved, registered with metrics by the caller) is skipped."""
+    if reg.execute(f"SELECT 1 FROM {model_registry.TABLE} LIMIT 1").fetchone() or not os.path.isdir(VERSIONS_DIR):
+        return 0
+    kinds = {"best_model_risk": TARGET_RISK, "best_model_complexity": TARGET_COMPLEX, "cascade_risk": "cascade_risk",
+             "student_risk": f"student_{TARGET_RISK}", "student_complexity": f"student_{TARGET_COMPLEX}",
+             "joint": "joint"}
+    n = 0
+    for fname in sorted(os.listdir(VERSIONS_DIR)):
+        parts = fname[:-len(".joblib")].split("__") if fname.endswith(".joblib") else []
+        if len(parts) < 2 or parts[1] not in kinds or parts[0] == current_version:
+            continue
+        try:
+            created_at = datetime.strptime(parts[0], "v_%Y%m%d_%H%M%S")
+        except ValueError:
+            continue
+        name = parts[2] if len(parts) > 2 else "DecisionTree"
+        try:
+            model_registry.register(reg, parts[0], kinds[parts[1]], name, os.path.join(VERSIONS_DIR, fname),
+                                    created_at=created_at)
+            n += 1
+        except sqlite3.IntegrityError:
+            pass  # same version/target twice (shouldn't happen)
+    return n
+
+
+def append_training_log(path: str, row: dict) -> None:
+    """Append one row to training_log.csv without re-reading it.
+
+    Only the header line is read; the file is rewritten once when a run adds
+    new columns (older rows get empty cells).
+    """
+    log_df = pd.DataFrame([row])
+    if not os.path.exists(path):
+        log_df.to_csv(path, index=False)
+        return
+
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        header = next(csv.reader(f), [])
+    if set(log_df.columns) <= set(header):
+        log_df.reindex(columns=header).to_csv(path, mode="a", header=False, index=False)
+    else:
+        pd.concat([pd.read_csv(path), log_df], ignore_index=True).to_csv(path, index=False)
 
-    preprocess_onehot, preprocess_ordinal, num_cols, cat_cols = make_preprocessors(X)
 
-    X_train, X_test, y_risk_train, y_risk_test, y_cx_train, y_cx_test = train_test_split(
-        X, y_risk, y_cx, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y_risk
+# ============================================================
+# 3e) OUT-OF-CORE: windows larger than memory
+# ============================================================
+
+def train_out_of_core(con, n_rows: int):
+    """Stream the last n_rows of LABELED_TABLE through streaming_training.
+
+    Memory is bounded by OOC_CHUNK_ROWS, not by n_rows: the preprocessor
+    (running mean/std, capped category vocabularies) and the SGD candidates are
+    fitted with partial_fit, chunk by chunk, on a rowid holdout split.
+    Returns (trained like train_and_select_all, after_rowid of the window).
+    """
+    after_rowid = con.execute(
+        f"SELECT rowid FROM {LABELED_TABLE} ORDER BY rowid DESC LIMIT 1 OFFSET ?", (n_rows - 1,)
+    ).fetchone()[0] - 1
+
+    cols = table_columns(con)
+    # column types from a small sample, same split rule as make_preprocessors
+    sample = pd.read_sql(f"SELECT * FROM {LABELED_TABLE} WHERE rowid > ? LIMIT 10000", con, params=(after_rowid,))
+    _, X_sample, _, _ = prepare_xy(sample)
+    _, _, num_cols, cat_cols = make_preprocessors(X_sample)
+
+    def chunks():
+        for chunk in iter_rowid_chunks(con, cols, after_rowid, OOC_CHUNK_ROWS):
+            yield chunk.replace([np.inf, -np.inf], np.nan)
+
+    trained = streaming_training.train_streaming(
+        chunks, list(X_sample.columns), num_cols, cat_cols, [TARGET_RISK, TARGET_COMPLEX]
     )
+    return trained, after_rowid
+
+
+# ============================================================
+# 3f) DISTILLATION: compact student from the teacher's soft labels
+# ============================================================
 
-    # Train both targets
-    res_risk, best_risk_name, best_risk_pipe = train_and_select(
-        X_train, y_risk_train, X_test, y_risk_test, preprocess_onehot, preprocess_ordinal, "risk_level"
+def distill_student(teacher_pipe, preprocess_ordinal, X_train, Xt_train, X_test, y_test):
+    """Fit a shallow HistGB on the teacher's predict_proba over the training window.
+
+    Soft labels as weights: every training row is repeated once per class with
+    weight = teacher probability of that class (rows below DISTILL_MIN_WEIGHT
+    dropped), so the student matches the teacher's distribution, not only its argmax.
+    preprocess_ordinal is fitted, Xt_train is its output on X_train.
+    Accepted only if both the agreement and the f1_macro hold up (on imbalanced labels a
+    student can agree on > 99% of the rows and still lose the minority classes) and it
+    beats the teacher on latency and size: a slower or bigger copy is no reason to swap.
+    Returns the artifact {"pipeline", "fidelity", "min_agreement", "accepted", ...};
+    main() adds "teacher_version" when it saves it.
+    """
+    classes = np.asarray(teacher_pipe.classes_)
+    P = teacher_pipe.predict_proba(X_train)
+    rows, labels = np.nonzero(P >= DISTILL_MIN_WEIGHT)
+
+    t0 = time.perf_counter()
+    student = HistGradientBoostingClassifier(
+        max_depth=DISTILL_MAX_DEPTH, max_iter=DISTILL_MAX_ITER, random_state=RANDOM_STATE
     )
-    res_cx, best_cx_name, best_cx_pipe = train_and_select(
-        X_train, y_cx_train, X_test, y_cx_test, preprocess_onehot, preprocess_ordinal, "verification_complexity"
+    student.fit(Xt_train[rows], classes[labels], sample_weight=P[rows, labels])
+    fit_seconds = time.perf_counter() - t0
+    pipe = Pipeline([("preprocess", preprocess_ordinal), ("model", student)])
+
+    # fidelity on the held-out split: agreement with the teacher + own quality
+    t_pred = np.asarray(teacher_pipe.predict(X_test))
+    s_pred = np.asarray(pipe.predict(X_test))
+    t_proba = teacher_pipe.predict_proba(X_test)
+    s_proba = pd.DataFrame(pipe.predict_proba(X_test), columns=student.classes_).reindex(
+        columns=classes, fill_value=0.0).to_numpy()
+
+    t_lat = predict_latency_ms(teacher_pipe, X_test)["latency_b1k_ms"]
+    s_lat = predict_latency_ms(pipe, X_test)["latency_b1k_ms"]
+    t_mb = len(pickle.dumps(teacher_pipe, protocol=pickle.HIGHEST_PROTOCOL)) / 2**20
+    s_mb = len(pickle.dumps(pipe, protocol=pickle.HIGHEST_PROTOCOL)) / 2**20
+
+    agreement = float(np.mean(s_pred == t_pred)) if len(t_pred) else 0.0
+    fidelity = {
+        "agreement": agreement,
+        "proba_tv": float(0.5 * np.abs(s_proba - t_proba).sum(axis=1).mean()),  # total variation distance
+        "f1_macro": f1_score(y_test, s_pred, average="macro", zero_division=0),
+        "teacher_f1_macro": f1_score(y_test, t_pred, average="macro", zero_division=0),
+        "latency_b1k_ms": s_lat,
+        "speedup": t_lat / s_lat if s_lat > 0 else np.nan,
+        "model_mb": s_mb,
+        "size_ratio": t_mb / s_mb if s_mb > 0 else np.nan,
+        "fit_seconds": fit_seconds,
+        "soft_rows": int(len(rows)),
+    }
+    return {
+        "pipeline": pipe,
+        "fidelity": fidelity,
+        "min_agreement": DISTILL_MIN_AGREEMENT,
+        "f1_tolerance": DISTILL_F1_TOLERANCE,
+        "min_speedup": DISTILL_MIN_SPEEDUP,
+        "min_size_ratio": DISTILL_MIN_SIZE_RATIO,
+        # NaN speedup / size_ratio (zero student latency or size) compare False -> not accepted
+        "accepted": bool(agreement >= DISTILL_MIN_AGREEMENT
+                         and fidelity["f1_macro"] >= fidelity["teacher_f1_macro"] - DISTILL_F1_TOLERANCE
+                         and fidelity["speedup"] > DISTILL_MIN_SPEEDUP
+                         and fidelity["size_ratio"] > DISTILL_MIN_SIZE_RATIO),
+    }
+
+
+# ============================================================
+# 3g) BACKTEST: rolling-origin evaluation of the candidates
+# ============================================================
+
+def rolling_origins(n_rows: int, folds: int = BACKTEST_FOLDS, test_rows: int | None = BACKTEST_TEST_ROWS):
+    """[(train_end, test_end)] over rows in rowid order: fold k trains on [0, train_end),
+    tests on [train_end, test_end). Test blocks are consecutive and end at the last row."""
+    test_rows = test_rows or n_rows // (folds + 1)
+    if test_rows <= 0 or n_rows - folds * test_rows <= 0:
+        raise ValueError(f"window of {n_rows:,} rows is too small for {folds} folds x {test_rows:,} test rows")
+    first = n_rows - folds * test_rows
+    return [(first + k * test_rows, first + (k + 1) * test_rows) for k in range(folds)]
+
+
+def _fit_backtest_job(job: dict) -> dict:
+    """_fit_candidate on the cached matrices of job["fold"]."""
+    return _fit_candidate(job, _TRAIN_DATA["folds"][job["fold"]])
+
+
+def run_backtest(folds: int = BACKTEST_FOLDS, test_rows: int | None = BACKTEST_TEST_ROWS) -> pd.DataFrame:
+    """`python continuous_training_32.py --backtest`: every candidate x target on K rolling origins.
+
+    Unlike the random train_test_split of main(), each fold trains only on rows
+    older than its test block, so the table shows how quality holds up as data
+    moves forward. Preprocessors are fitted once per fold (on its training rows)
+    and the transformed matrices are shared by all candidates and both targets;
+    all fold x target x candidate fits run in one process pool.
+    Writes BACKTEST_REPORT_PATH; nothing is saved as a model and the state is untouched.
+    """
+    t_start = time.perf_counter()
+    con = connect_ro()
+    df = load_training_window(con, MAX_TRAIN_ROWS if MAX_TRAIN_ROWS is not None else 2000000)
+    con.close()
+
+    df = df.iloc[::-1].reset_index(drop=True)  # oldest first: origins move forward in rowid
+    rowids = df["_rowid_"].to_numpy() if "_rowid_" in df.columns else np.arange(1, len(df) + 1)
+    df, X, y_risk, y_cx = prepare_xy(df)
+    preprocess_onehot, preprocess_ordinal, _, _ = make_preprocessors(X)
+    cands = candidate_grid()
+    kinds = {kind for kind, _ in cands.values()}
+    all_pre = {"onehot": preprocess_onehot, "ordinal": preprocess_ordinal}
+    targets = {TARGET_RISK: y_risk, TARGET_COMPLEX: y_cx}
+
+    origins = rolling_origins(len(X), folds, test_rows)
+    t_pre = time.perf_counter()
+    fold_data = []
+    for train_end, test_end in origins:
+        prepped = fit_preprocessors(X.iloc[:train_end], X.iloc[train_end:test_end], {k: all_pre[k] for k in kinds})
+        fold_data.append({
+            "Xt_train": {k: v[1] for k, v in prepped.items()},
+            "Xt_test": {k: v[2] for k, v in prepped.items()},
+            "y_train": {t: y.iloc[:train_end] for t, y in targets.items()},
+            "y_test": {t: y.iloc[train_end:test_end] for t, y in targets.items()},
+            "order": {},
+        })
+    pre_seconds = time.perf_counter() - t_pre
+
+    cores = os.cpu_count() or 1
+    n_jobs_total = len(origins) * len(targets) * len(cands)
+    n_workers = min(n_jobs_total, N_TRAIN_WORKERS or cores) if PARALLEL_TRAINING else 1
+    n_threads = max(1, cores // n_workers)
+    jobs = []
+    for k in range(len(origins)):
+        for t in targets:
+            for name, (kind, clf) in cands.items():
+                model = clone(clf)
+                if "n_jobs" in model.get_params():
+                    model.set_params(n_jobs=n_threads)
+                jobs.append({"fold": k, "target": t, "name": name, "kind": kind, "model": model,
+                             "n_threads": n_threads, "rows": None, "keep_model": False})
+
+    print(f"[BACKTEST] {len(origins)} folds x {len(targets)} targets x {len(cands)} candidates | "
+          f"window={len(X):,} rows | workers={n_workers} | threads/fit={n_threads}")
+    t_fit = time.perf_counter()
+    with candidate_runner({"folds": fold_data}, n_workers, fit=_fit_backtest_job) as run:
+        results = run(jobs)
+    fit_wall = time.perf_counter() - t_fit
+
+    rows = []
+    for job, r in zip(jobs, results):
+        train_end, test_end = origins[job["fold"]]
+        rows.append({
+            "fold": job["fold"],
+            "train_rows": train_end,
+            "test_rows": test_end - train_end,
+            "test_first_rowid": int(rowids[train_end]),
+            "test_last_rowid": int(rowids[test_end - 1]),
+            **r["metrics"],
+        })
+    report = pd.DataFrame(rows).drop(columns=["rows"])
+    report.to_csv(BACKTEST_REPORT_PATH, index=False)
+
+    print(report[["fold", "target", "model", "train_rows", "f1_macro", "fit_seconds"]].to_string(index=False))
+    summary = (
+        report.groupby(["target", "model"])["f1_macro"].agg(["mean", "std", "min"])
+        .sort_values(["mean"], ascending=False).sort_index(level="target", sort_remaining=False)
     )
+    print("[BACKTEST] f1_macro over folds")
+    print(summary.to_string())
+    print("[BACKTEST] total {:.1f}s | preprocessing {:.1f}s | fits wall {:.1f}s, cpu-sum {:.1f}s".format(
+        time.perf_counter() - t_start, pre_seconds, fit_wall, report["fit_seconds"].sum()
+    ))
+    print("[SAVED] backtest ->", BACKTEST_REPORT_PATH)
+    return report
+
+
+# ============================================================
+# 3h) FEATURE PRUNING: permutation importance -> smallest top-k set
+# ============================================================
+
+def feature_importance(pipes: dict, X_val: pd.DataFrame, y_val: dict) -> pd.DataFrame:
+    """Permutation importance (f1_macro drop) of every raw input column, one column per target.
+
+    Raw columns, not transformed ones: a column is what api_app has to decode
+    and preprocess. Columns are permuted in parallel (joblib, one job per column).
+    """
+    out = {}
+    for target, pipe in pipes.items():
+        r = permutation_importance(
+            pipe, X_val, y_val[target], scoring="f1_macro",
+            n_repeats=PRUNE_REPEATS, random_state=RANDOM_STATE, n_jobs=min(X_val.shape[1], os.cpu_count() or 1),
+        )
+        out[target] = pd.Series(r.importances_mean, index=X_val.columns)
+    return pd.DataFrame(out)
+
+
+def _fit_pruned_job(job: dict) -> dict:
+    """Trial fit of one target on job["columns"] (own preprocessor) -> f1_macro on the job's validation fold.
+
+    job["keep_model"]: the fitted Pipeline is sent back too (all-column baseline -> importance).
+    """
+    d = _TRAIN_DATA
+    cols, target = job["columns"], job["target"]
+    fit_idx, val_idx = d["folds"][job["fold"]]
+    y = d["y_train"][target]
+    pre = feature_encoding.CardinalityEncoder(kind=job["kind"])
+    model = job["model"]
+    with threadpool_limits(limits=job["n_threads"]):
+        model.fit(pre.fit_transform(d["X_train"].iloc[fit_idx][cols]), y.iloc[fit_idx])
+        m = streaming_training.evaluate_chunked(model, pre.transform(d["X_train"].iloc[val_idx][cols]),
+                                                y.iloc[val_idx], EVAL_CHUNK_ROWS)
+    out = {"k": len(cols), "target": target, "fold": job["fold"], "f1_macro": m["f1_macro"]}
+    if job.get("keep_model"):
+        out["pipeline"] = Pipeline([("preprocess", pre), ("model", model)])
+    return out
+
+
+def prune_features(trained: dict, X_train, X_test, y_train: dict, y_test: dict):
+    """Smallest top-k input columns whose models stay within PRUNE_F1_TOLERANCE of all columns.
+
+    k is chosen on the train split, the test split only checks the result:
+    0) PRUNE_CV_FOLDS validation folds (PRUNE_VAL_ROWS each, blocks of a stratified order),
+       trial fits on PRUNE_FIT_ROWS rows outside the fold
+    1) all-column baseline fits of the selected estimators; permutation importance of
+       every column on the first fold, max over targets
+    2) k = 1, 2, ... (top-k columns), all (target, fold) fits in one process pool; the scan
+       stops at the first k whose fold-mean f1 is within the tolerance of the baseline's
+    3) that k is refitted on all of X_train and scored on X_test; if any target falls below
+       its all-column test f1 - PRUNE_F1_TOLERANCE, all columns are kept
+    Returns {"features", "dropped", "importance", "trained", "prepped"}: trained / prepped as
+    train_and_select_all / fit_preprocessors on the reduced columns, None if all columns are kept.
+    None if the pipelines have no CardinalityEncoder (nothing measured).
+    """
+    cols = list(X_train.columns)
+    kinds = {t: getattr(trained[t][2].named_steps["preprocess"], "kind", None) for t in y_train}
+    if None in kinds.values():
+        print("[PRUNE] skipped: preprocessor without a cardinality plan")
+        return None
+
+    cores = os.cpu_count() or 1
+    n_workers = min(len(y_train) * PRUNE_CV_FOLDS, N_TRAIN_WORKERS or cores) if PARALLEL_TRAINING else 1
+    n_threads = max(1, cores // n_workers)
+
+    def unfitted(target):
+        model = clone(trained[target][2].named_steps["model"])
+        if "n_jobs" in model.get_params():
+            model.set_params(n_jobs=n_threads)
+        return model
+
+    def jobs(columns, keep_model=False):
+        return [{"columns": columns, "target": t, "fold": f, "kind": kinds[t], "model": unfitted(t),
+                 "n_threads": n_threads, "keep_model": keep_model} for t in y_train for f in range(len(folds))]
+
+    def fold_mean(results) -> dict:
+        return pd.DataFrame(results).groupby("target")["f1_macro"].mean().to_dict()
+
+    order = stratified_order(y_train[next(iter(y_train))])
+    n_val = min(PRUNE_VAL_ROWS, len(order) // (PRUNE_CV_FOLDS + 1))
+    folds = []
+    for f in range(PRUNE_CV_FOLDS):
+        val_idx = order[f * n_val:(f + 1) * n_val]
+        fit_idx = np.concatenate([order[:f * n_val], order[(f + 1) * n_val:]])[:PRUNE_FIT_ROWS]
+        folds.append((fit_idx, val_idx))
+    data = {"X_train": X_train, "y_train": y_train, "folds": folds}
+
+    with candidate_runner(data, n_workers, fit=_fit_pruned_job) as run:
+        base = run(jobs(cols, keep_model=True))
+        # ranking from the first fold (permutations are the costly part), k from all folds
+        val_idx = folds[0][1]
+        importance = feature_importance({r["target"]: r["pipeline"] for r in base if r["fold"] == 0},
+                                        X_train.iloc[val_idx], {t: y.iloc[val_idx] for t, y in y_train.items()})
+        ranking = importance.max(axis=1).sort_values(ascending=False, kind="stable").index.tolist()
+        print("[PRUNE] importance: " + ", ".join(f"{c}={importance.loc[c].max():.4f}" for c in ranking))
+
+        trial = {len(cols): fold_mean(base)}
+        k = len(cols)
+        for i in range(1, len(cols)):
+            trial[i] = fold_mean(run(jobs(ranking[:i])))
+            if all(trial[i][t] >= trial[len(cols)][t] - PRUNE_F1_TOLERANCE for t in y_train):
+                k = i
+                break
+
+    print(f"[PRUNE] validation f1_macro by k (mean of {len(folds)} folds): " + " | ".join(
+        f"k={i}: " + "/".join(f"{trial[i][t]:.4f}" for t in y_train) for i in sorted(trial)
+    ))
+    keep_all = {"features": cols, "dropped": [], "importance": importance, "trained": None, "prepped": None}
+    if k == len(cols):
+        print("[PRUNE] all columns needed")
+        return keep_all
+
+    features = ranking[:k]
+    X_train, X_test = X_train[features], X_test[features]
+    preprocess_onehot, preprocess_ordinal, _, _ = make_preprocessors(X_train)
+    prepped = fit_preprocessors(X_train, X_test, {"onehot": preprocess_onehot, "ordinal": preprocess_ordinal})
+    data = {
+        "Xt_train": {kd: v[1] for kd, v in prepped.items()},
+        "Xt_test": {kd: v[2] for kd, v in prepped.items()},
+        "y_train": y_train, "y_test": y_test, "order": {},
+    }
+    refit = [{"target": t, "name": trained[t][1], "kind": kinds[t], "model": unfitted(t),
+              "n_threads": n_threads, "rows": None} for t in y_train]
+    results = {r["target"]: r for r in run_candidate_jobs(refit, data, n_workers)}
+
+    out = {}
+    for t, (res, name, pipe, trace) in trained.items():
+        r = results[t]
+        f1_all = res.iloc[0]["f1_macro"]
+        print(f"[PRUNE] {t}: test f1_macro {r['metrics']['f1_macro']:.4f} on {k} columns (all columns {f1_all:.4f})")
+        if r["metrics"]["f1_macro"] < f1_all - PRUNE_F1_TOLERANCE:
+            print(f"[PRUNE] {t}: below all columns - tolerance on the test split, all columns kept")
+            return keep_all
+        pruned_pipe = Pipeline([("preprocess", prepped[r["kind"]][0]), ("model", r["model"])])
+        res = pd.concat([pd.DataFrame([{**r["metrics"], "rung": "pruned"}]), res], ignore_index=True)
+        out[t] = (res, name, pruned_pipe, trace + [trace_entry(r, "pruned", kept=True)])
+
+    dropped = [c for c in cols if c not in features]
+    print(f"[PRUNE] {len(features)}/{len(cols)} columns kept, dropped: {', '.join(dropped)}")
+    return {"features": features, "dropped": dropped, "importance": importance, "trained": out, "prepped": prepped}
+
+
+def save_feature_list(path: str, version: str, features: list[str], dropped: list[str],
+                      importance: pd.DataFrame | None) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = {
+        "version": version,
+        "features": features,
+        "dropped": dropped,
+        "importance": {} if importance is None else {
+            c: {t: round(float(v), 6) for t, v in row.items()} for c, row in importance.iterrows()
+        },
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+
+
+# ============================================================
+# 3i) JOINT MODEL: one multi-output estimator for both targets
+# ============================================================
+
+def train_joint(preprocess_ordinal, Xt_train, y_train: dict, X_test, y_test: dict, pair: dict):
+    """Multi-output RandomForest on y = both targets, compared with the two selected pipelines.
+
+    One forest, one traversal per tree for both labels (the leaves hold the class
+    distributions of every target), one preprocessing pass instead of two.
+    preprocess_ordinal is fitted, Xt_train is its output; pair = {target: selected pipeline}.
+    Latencies are end to end (raw rows -> both predictions), so the pair pays both preprocessors.
+    Returns the artifact {"pipeline", "targets", "metrics", "baseline", "accepted"};
+    main() adds "pair_version" (version of the compared pipelines) when it saves it.
+    """
+    targets = list(y_train)
+    model = clone(MODELS["RandomForest"][1]).set_params(**JOINT_PARAMS)
+    t0 = time.perf_counter()
+    model.fit(Xt_train, np.column_stack([np.asarray(y_train[t]) for t in targets]))
+    fit_seconds = time.perf_counter() - t0
+    pipe = Pipeline([("preprocess", preprocess_ordinal), ("model", model)])
+
+    # predict_proba of a multi-output forest: one (rows x classes) array per target
+    acc = [streaming_training.ChunkedMetrics(c) for c in model.classes_]
+    y_true = [np.asarray(y_test[t]) for t in targets]
+    for start in range(0, len(X_test), EVAL_CHUNK_ROWS):
+        probas = pipe.predict_proba(X_test.iloc[start:start + EVAL_CHUNK_ROWS])
+        for a, y, p in zip(acc, y_true, probas):
+            a.update(y[start:start + EVAL_CHUNK_ROWS], proba=p)
+
+    metrics = {t: a.result() for t, a in zip(targets, acc)}
+    metrics.update(predict_latency_ms(pipe, X_test))
+    metrics["model_mb"] = len(pickle.dumps(pipe, protocol=pickle.HIGHEST_PROTOCOL)) / 2**20
+    metrics["fit_seconds"] = fit_seconds
+
+    baseline = {t: streaming_training.evaluate_chunked(pair[t], X_test, y_test[t], EVAL_CHUNK_ROWS) for t in targets}
+    baseline.update(predict_latency_ms(None, X_test, predict=lambda X: [pair[t].predict_proba(X) for t in targets]))
+    baseline["model_mb"] = sum(len(pickle.dumps(pair[t], protocol=pickle.HIGHEST_PROTOCOL)) for t in targets) / 2**20
+
+    accepted = all(metrics[t]["f1_macro"] >= baseline[t]["f1_macro"] - JOINT_F1_TOLERANCE for t in targets) \
+        and metrics["latency_b1k_ms"] < baseline["latency_b1k_ms"]
+    return {"pipeline": pipe, "targets": targets, "metrics": metrics, "baseline": baseline,
+            "f1_tolerance": JOINT_F1_TOLERANCE, "accepted": bool(accepted)}
+
+
+# ============================================================
+# 4) MAIN: LOAD NEW DATA + DRIFT + TRAIN
+# ============================================================
+
+def main():
+    """One training run; returns the training log row (None if skipped)."""
+    stage_start()
+    os.makedirs(VERSIONS_DIR, exist_ok=True)
+    os.makedirs(MODEL_ROOT, exist_ok=True)
+
+    state = load_state(STATE_PATH)
+    last_rowid = int(state.get("last_rowid", 0))
+
+    con = connect_ro()
+
+    # Cheap change detection: MAX(rowid) is one b-tree seek, the count only walks the new rowid range.
+    # Rows committed while this run trains stay above max_rowid and go to the next run.
+    max_rowid = con.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {LABELED_TABLE}").fetchone()[0]
+    new_rows = con.execute(
+        f"SELECT COUNT(*) FROM {LABELED_TABLE} WHERE rowid > ? AND rowid <= ?", (last_rowid, max_rowid)
+    ).fetchone()[0]
+
+    print(f"[INFO] max_rowid={max_rowid:,} | last_rowid={last_rowid:,} | new_rows={new_rows:,}")
+    stage_done("detect")
+
+    if new_rows < MIN_NEW_ROWS_TO_TRAIN:
+        print("[SKIP] Not enough new data to retrain. Exiting.")
+        con.close()
+        return
+
+    # Drift check: saved reference histograms of the previous training window
+    drift_ref = cached_drift_reference() if last_rowid > 0 else None
+
+    if drift_ref:
+        report = stream_drift(con, drift_ref, last_rowid)
+    else:
+        # No saved reference yet: last DRIFT_SAMPLE_ROWS older rows vs a uniform
+        # reservoir sample of the new rows (memory stays flat however many are new)
+        existing = set(table_columns(con))
+        drift_cols = [c for c in DRIFT_NUM_COLS + DRIFT_CAT_COLS if c in existing]
+
+        df_new = reservoir_sample(con, drift_cols, last_rowid, DRIFT_SAMPLE_ROWS)
+        df_ref = pd.read_sql(
+            f"""
+            SELECT {", ".join(["rowid AS _rowid_"] + drift_cols)} FROM {LABELED_TABLE}
+            WHERE rowid <= ?
+            ORDER BY rowid DESC
+            LIMIT ?
+            """,
+            con, params=(last_rowid, DRIFT_SAMPLE_ROWS)
+        )
+        report = compute_drift(df_ref, df_new, DRIFT_NUM_COLS, DRIFT_CAT_COLS) if len(df_ref) > 0 else None
+
+    drift = drift_summary(report) if report is not None else {"psi_mean": 0.0, "psi_max": 0.0}
+    drift_flag = drift.get("psi_max", 0.0) >= PSI_THRESHOLD
+    if report is not None:
+        report.to_csv(DRIFT_REPORT_PATH, index=False)
+        print(report.to_string(index=False))
+
+    print("[DRIFT] psi_mean={:.4f} psi_max={:.4f} flag={}".format(
+        drift.get("psi_mean", 0.0), drift.get("psi_max", 0.0), drift_flag
+    ))
+    stage_done("drift")
+
+    mode, reason = choose_train_mode(state, drift_flag)
+    print(f"[MODE] {mode} ({reason})")
+
+    trained, cascade, cascade_metrics, df = None, None, {}, None
+    encodings = None
+    features, dropped, importance = None, [], None
+    students = {}
+    joint = None
+    if mode == "incremental":
+        # only the rows added since the last run (rowid > last_rowid = the trailing new_rows)
+        window = load_training_window(con, new_rows)
+        stage_done("load")
+        df, X, y_risk, y_cx = prepare_xy(window)
+        # the previous models (and cascade) were fitted on the pruned columns of the last full run
+        features = state.get("features")
+        if features and set(features) <= set(X.columns):
+            X = X[features]
+        X_train, X_test, y_risk_train, y_risk_test, y_cx_train, y_cx_test = train_test_split(
+            X, y_risk, y_cx, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y_risk
+        )
+        stage_done("split")
+        t_train = time.perf_counter()
+        updated = incremental_update(
+            X_train, X_test,
+            {TARGET_RISK: y_risk_train, TARGET_COMPLEX: y_cx_train},
+            {TARGET_RISK: y_risk_test, TARGET_COMPLEX: y_cx_test},
+            state,
+        )
+        stage_done("train")
+        if updated is None:
+            mode, reason = "full", "incremental update not possible or rejected"
+            print(f"[MODE] {mode} ({reason})")
+        else:
+            train_seconds = time.perf_counter() - t_train
+            trained_rows, eval_rows = len(df), len(X_test)
+            trained = {t: (pd.DataFrame([m]), name, pipe, []) for t, (m, name, pipe) in updated.items()}
+
+            # stage-1 keeps its fitted ordinal preprocessor, thresholds are re-calibrated
+            prev_cascade = state.get("cascade_path")
+            if CASCADE_ENABLED and prev_cascade and os.path.exists(prev_cascade):
+                pre_ord = joblib.load(prev_cascade)["stage1"].named_steps["preprocess"]
+                n_cal = len(X_test) // 2
+                cascade, cascade_metrics = train_cascade(
+                    X_train, y_risk_train,
+                    X_test.iloc[:n_cal], X_test.iloc[n_cal:], y_risk_test.iloc[n_cal:],
+                    pre_ord, trained[TARGET_RISK][2], Xt_train=pre_ord.transform(X_train),
+                )
+                stage_done("cascade")
+
+    n_window = MAX_TRAIN_ROWS
+    if mode == "full" and OUT_OF_CORE_ROWS is not None and (MAX_TRAIN_ROWS is None or MAX_TRAIN_ROWS > OUT_OF_CORE_ROWS):
+        # the full COUNT(*) only when the window could be too large for memory
+        total_rows = con.execute(f"SELECT COUNT(*) FROM {LABELED_TABLE}").fetchone()[0]
+        n_window = total_rows if MAX_TRAIN_ROWS is None else min(MAX_TRAIN_ROWS, total_rows)
+    if mode == "full" and OUT_OF_CORE_ROWS is not None and n_window is not None and n_window > OUT_OF_CORE_ROWS:
+        mode, reason = "out_of_core", f"window {n_window:,} rows > OUT_OF_CORE_ROWS"
+        print(f"[MODE] {mode} ({reason})")
+        t_train = time.perf_counter()
+        trained, after_rowid = train_out_of_core(con, n_window)
+        train_seconds = time.perf_counter() - t_train
+        stage_done("train")
+        trained_rows, eval_rows = n_window, n_window // streaming_training.HOLDOUT_MOD
+
+        # drift reference from a uniform sample of the window (the window itself never fits in memory)
+        existing = set(table_columns(con))
+        df = reservoir_sample(con, [c for c in DRIFT_NUM_COLS + DRIFT_CAT_COLS if c in existing],
+                              after_rowid, DRIFT_SAMPLE_ROWS)
+        stage_done("load")
+
+    if mode == "full":
+        # Training set = previous + new (or only recent slice)
+        # Universal approach: retrain on recent window (fast + adapts)
+        window = load_training_window(con, MAX_TRAIN_ROWS if MAX_TRAIN_ROWS is not None else 2000000)
+        stage_done("load")
+        df, X, y_risk, y_cx = prepare_xy(window)
+        preprocess_onehot, preprocess_ordinal, num_cols, cat_cols = make_preprocessors(X)
+
+        X_train, X_test, y_risk_train, y_risk_test, y_cx_train, y_cx_test = train_test_split(
+            X, y_risk, y_cx, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y_risk
+        )
+        stage_done("split")
+
+        # Train both targets (all candidate fits scheduled together)
+        t_train = time.perf_counter()
+        prepped = fit_preprocessors(X_train, X_test, {"onehot": preprocess_onehot, "ordinal": preprocess_ordinal})
+        encodings = prepped["onehot"][0].encodings_
+        print("[ENCODE] " + " | ".join(
+            f"{c}: {e['encoding']} (n_unique={e['n_unique']}, width={e['width']})"
+            for c, e in encodings.items() if e["encoding"] != "numeric"
+        ))
+        stage_done("preprocess")
+        trained = train_and_select_all(
+            X_train, X_test,
+            {TARGET_RISK: y_risk_train, TARGET_COMPLEX: y_cx_train},
+            {TARGET_RISK: y_risk_test, TARGET_COMPLEX: y_cx_test},
+            preprocess_onehot, preprocess_ordinal, prepped=prepped,
+        )
+        stage_done("train")
+
+        # Smallest feature set within the f1 tolerance; cascade / students use the same columns
+        features = list(X.columns)
+        if PRUNE_FEATURES:
+            pruned = prune_features(
+                trained, X_train, X_test,
+                {TARGET_RISK: y_risk_train, TARGET_COMPLEX: y_cx_train},
+                {TARGET_RISK: y_risk_test, TARGET_COMPLEX: y_cx_test},
+            )
+            if pruned is not None:
+                features, dropped, importance = pruned["features"], pruned["dropped"], pruned["importance"]
+                if pruned["trained"] is not None:
+                    trained, prepped = pruned["trained"], pruned["prepped"]
+                    X_train, X_test = X_train[features], X_test[features]
+                    encodings = prepped["onehot"][0].encodings_  # plan of the saved (pruned) preprocessor
+            stage_done("prune")
+        train_seconds = time.perf_counter() - t_train
+        trained_rows, eval_rows = len(df), len(X_test)
+
+        # Cascade for risk: calibrate on one half of the test split, report on the other
+        if CASCADE_ENABLED:
+            n_cal = len(X_test) // 2
+            cascade, cascade_metrics = train_cascade(
+                X_train, y_risk_train,
+                X_test.iloc[:n_cal], X_test.iloc[n_cal:], y_risk_test.iloc[n_cal:],
+                prepped["ordinal"][0], trained[TARGET_RISK][2], Xt_train=prepped["ordinal"][1],
+            )
+            stage_done("cascade")
+
+        # Students for both targets (the teacher stays the saved best model)
+        if DISTILL_ENABLED:
+            for target, y_test_t in ((TARGET_RISK, y_risk_test), (TARGET_COMPLEX, y_cx_test)):
+                students[target] = distill_student(
+                    trained[target][2], prepped["ordinal"][0], X_train, prepped["ordinal"][1], X_test, y_test_t
+                )
+                f = students[target]["fidelity"]
+                print("[DISTILL] {}: agreement={:.4f} f1={:.4f} (teacher {:.4f}) x{:.1f} faster x{:.1f} smaller{}".format(
+                    target, f["agreement"], f["f1_macro"], f["teacher_f1_macro"], f["speedup"], f["size_ratio"],
+                    "" if students[target]["accepted"] else " -> below threshold, teacher served"
+                ))
+            stage_done("distill")
+
+        # One multi-output forest for both targets vs the two selected pipelines
+        if JOINT_ENABLED:
+            joint = train_joint(
+                prepped["ordinal"][0], prepped["ordinal"][1],
+                {TARGET_RISK: y_risk_train, TARGET_COMPLEX: y_cx_train}, X_test,
+                {TARGET_RISK: y_risk_test, TARGET_COMPLEX: y_cx_test},
+                {t: trained[t][2] for t in (TARGET_RISK, TARGET_COMPLEX)},
+            )
+            jm, jb = joint["metrics"], joint["baseline"]
+            print("[JOINT] f1 risk={:.4f} (pair {:.4f}) cx={:.4f} (pair {:.4f}) | b1k {:.4f} vs {:.4f} ms/row | "
+                  "b1 {:.3f} vs {:.3f} ms{}".format(
+                      jm[TARGET_RISK]["f1_macro"], jb[TARGET_RISK]["f1_macro"],
+                      jm[TARGET_COMPLEX]["f1_macro"], jb[TARGET_COMPLEX]["f1_macro"],
+                      jm["latency_b1k_ms"], jb["latency_b1k_ms"], jm["latency_b1_ms"], jb["latency_b1_ms"],
+                      "" if joint["accepted"] else " -> not accepted, pair served"
+                  ))
+            stage_done("joint")
+    con.close()
+
+    res_risk, best_risk_name, best_risk_pipe, trace_risk = trained[TARGET_RISK]
+    res_cx, best_cx_name, best_cx_pipe, trace_cx = trained[TARGET_COMPLEX]
+    print(pd.concat([res_risk, res_cx], ignore_index=True).to_string(index=False))
+    if cascade is not None:
+        print("[CASCADE] escalated={:.3f} agreement={:.4f} f1_macro={:.4f}".format(
+            cascade_metrics["escalation_rate"], cascade_metrics["agreement"], cascade_metrics["f1_macro"]
+        ))
 
     # Version tag
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     version = f"v_{ts}"
 
+    # the version travels with the pipelines: api_app serves a cascade / student / joint model
+    # only next to its own teachers
+    best_risk_pipe.model_version = version
+    best_cx_pipe.model_version = version
+
     risk_path = os.path.join(VERSIONS_DIR, f"{version}__best_model_risk__{best_risk_name}.joblib")
     cx_path = os.path.join(VERSIONS_DIR, f"{version}__best_model_complexity__{best_cx_name}.joblib")
     joblib.dump(best_risk_pipe, risk_path)
     joblib.dump(best_cx_pipe, cx_path)
 
+    cascade_path = None
+    if cascade is not None:
+        cascade_path = os.path.join(VERSIONS_DIR, f"{version}__cascade_risk.joblib")
+        cascade["heavy_version"] = version  # thresholds are calibrated against this risk model
+        joblib.dump(cascade, cascade_path)
+
+    student_paths = {}
+    for target, kind in ((TARGET_RISK, "risk"), (TARGET_COMPLEX, "complexity")):
+        if target in students:
+            student_paths[target] = os.path.join(VERSIONS_DIR, f"{version}__student_{kind}.joblib")
+            students[target]["teacher_version"] = version
+            joblib.dump(students[target], student_paths[target])
+
+    joint_path = None
+    if joint is not None:
+        joint_path = os.path.join(VERSIONS_DIR, f"{version}__joint.joblib")
+        joint["pair_version"] = version
+        joblib.dump(joint, joint_path)
+    stage_done("dump")
+
     # Log row
     def pick_best(res_df: pd.DataFrame) -> dict:
         r = res_df.iloc[0].to_dict()
@@ -323,52 +1796,206 @@ def main():
     log_row = {
         "timestamp": ts,
         "version": version,
-        "trained_rows": len(df),
-        "new_rows_detected": int(len(df_new)),
+        "train_mode": mode,
+        "train_mode_reason": reason,
+        "trained_rows": trained_rows,
+        "eval_rows": eval_rows,
+        "new_rows_detected": int(new_rows),
         "drift_psi_mean": drift.get("psi_mean", 0.0),
         "drift_psi_max": drift.get("psi_max", 0.0),
         "drift_flag": int(drift_flag),
+        "train_seconds": train_seconds,
 
         "risk_model": best_risk_name,
         "risk_accuracy": row_risk.get("accuracy"),
         "risk_recall_macro": row_risk.get("recall_macro"),
         "risk_f1_macro": row_risk.get("f1_macro"),
         "risk_roc_auc_ovr": row_risk.get("roc_auc_ovr"),
+        "risk_prev_f1_macro": row_risk.get("prev_f1_macro"),  # incremental: previous model, same eval rows
+        **{f"risk_{k}": row_risk.get(k) for k in COST_COLS[1:] + ["within_budget"]},
+        "risk_selection_trace": json.dumps(trace_risk) if trace_risk else None,  # every candidate: f1 + costs per rung
 
         "cx_model": best_cx_name,
         "cx_accuracy": row_cx.get("accuracy"),
         "cx_recall_macro": row_cx.get("recall_macro"),
         "cx_f1_macro": row_cx.get("f1_macro"),
         "cx_roc_auc_ovr": row_cx.get("roc_auc_ovr"),
+        "cx_prev_f1_macro": row_cx.get("prev_f1_macro"),
+        **{f"cx_{k}": row_cx.get(k) for k in COST_COLS[1:] + ["within_budget"]},
+        "cx_selection_trace": json.dumps(trace_cx) if trace_cx else None,
+
+        "cascade_escalation_rate": cascade_metrics.get("escalation_rate"),
+        "cascade_agreement": cascade_metrics.get("agreement"),
+        "cascade_f1_macro": cascade_metrics.get("f1_macro"),
+
+        **{f"{p}_student_{k}": students[t]["fidelity"].get(k) if t in students else None
+           for p, t in (("risk", TARGET_RISK), ("cx", TARGET_COMPLEX))
+           for k in ("agreement", "proba_tv", "f1_macro", "speedup", "size_ratio")},
+        "risk_student_accepted": int(students[TARGET_RISK]["accepted"]) if TARGET_RISK in students else None,
+        "cx_student_accepted": int(students[TARGET_COMPLEX]["accepted"]) if TARGET_COMPLEX in students else None,
+
+        # joint multi-output model vs the pair (latencies: both targets end to end, ms per row)
+        "joint_risk_f1_macro": joint["metrics"][TARGET_RISK]["f1_macro"] if joint else None,
+        "joint_cx_f1_macro": joint["metrics"][TARGET_COMPLEX]["f1_macro"] if joint else None,
+        **{f"{p}_{k}": joint[src][k] if joint else None
+           for p, src in (("joint", "metrics"), ("pair", "baseline"))
+           for k in ("latency_b1_ms", "latency_b1k_ms", "model_mb")},
+        "joint_accepted": int(joint["accepted"]) if joint else None,
 
         "risk_model_path": risk_path,
         "cx_model_path": cx_path,
+        "cascade_path": cascade_path,
+        "risk_student_path": student_paths.get(TARGET_RISK),
+        "cx_student_path": student_paths.get(TARGET_COMPLEX),
+        "joint_path": joint_path,
+        "encodings": json.dumps({c: e["encoding"] for c, e in encodings.items()}) if encodings else None,
+        "features": json.dumps(features) if features else None,
+        "dropped_features": json.dumps(dropped) if dropped else None,
+        "stage_seconds": json.dumps({k: round(v, 3) for k, v in STAGE_SECONDS.items()}),
     }
 
-    log_df = pd.DataFrame([log_row])
-
-    if os.path.exists(LOG_PATH):
-        old = pd.read_csv(LOG_PATH)
-        out = pd.concat([old, log_df], ignore_index=True)
+    append_training_log(LOG_PATH, log_row)
+
+    # Registry: one row per artifact, promotion, retention of old files
+    reg = model_registry.connect(REGISTRY_PATH)
+    if register_existing_versions(reg, version):
+        print("[REGISTRY] registered existing files of", VERSIONS_DIR)
+    created_at = datetime.strptime(ts, "%Y%m%d_%H%M%S")
+    run_info = {"train_mode": mode, "trained_rows": trained_rows, "train_seconds": train_seconds,
+                "created_at": created_at}
+    model_registry.register(reg, version, TARGET_RISK, best_risk_name, risk_path, row_risk, **run_info)
+    model_registry.register(reg, version, TARGET_COMPLEX, best_cx_name, cx_path, row_cx, **run_info)
+    if cascade_path:
+        model_registry.register(reg, version, "cascade_risk", "DecisionTree", cascade_path, cascade_metrics, **run_info)
+    for target, path in student_paths.items():
+        f = students[target]["fidelity"]
+        model_registry.register(reg, version, f"student_{target}", "HistGB", path,
+                                {**f, "accepted": students[target]["accepted"]}, **run_info)
+    if joint_path:
+        jm = joint["metrics"]
+        model_registry.register(reg, version, "joint", "RandomForest", joint_path, {
+            "f1_macro": min(jm[t]["f1_macro"] for t in joint["targets"]),
+            **{f"{t}_f1_macro": jm[t]["f1_macro"] for t in joint["targets"]},
+            **{k: jm[k] for k in ("latency_b1_ms", "latency_b1k_ms", "model_mb", "fit_seconds")},
+            "accepted": joint["accepted"],
+        }, **run_info)
+    if AUTO_PROMOTE:
+        model_registry.promote(reg, version)
+    removed = model_registry.collect_garbage(reg, KEEP_VERSIONS)
+    print_mode_comparison(reg)
+    reg.close()
+    stage_done("registry")
+
+    # Reference histograms of the training data -> online drift monitor in api_app
+    # (incremental: the model has now also seen the new rows, the bins stay the same)
+    prev_ref = cached_drift_reference() if mode == "incremental" else None
+    if prev_ref:
+        save_drift_reference(DRIFT_REF_PATH, update_drift_reference(prev_ref, df), version)
     else:
-        out = log_df
+        save_drift_reference(DRIFT_REF_PATH, build_drift_reference(df, DRIFT_NUM_COLS, DRIFT_CAT_COLS), version)
+    stage_done("drift_reference")
 
-    out.to_csv(LOG_PATH, index=False)
     print("[SAVED] log ->", LOG_PATH)
     print("[SAVED] model risk ->", risk_path)
     print("[SAVED] model cx   ->", cx_path)
-
-    # Update state: set last_rowid to current max rowid
-    con = sqlite3.connect(DB_PATH)
-    max_rowid = pd.read_sql(f"SELECT MAX(rowid) AS m FROM {LABELED_TABLE}", con)["m"].iloc[0]
-    con.close()
-
+    if cascade_path:
+        print("[SAVED] cascade    ->", cascade_path)
+    for target, path in student_paths.items():
+        print(f"[SAVED] student {target} ->", path)
+    if joint_path:
+        print("[SAVED] joint      ->", joint_path)
+    print("[SAVED] drift reference ->", DRIFT_REF_PATH)
+    if mode == "full":
+        save_feature_list(FEATURES_PATH, version, features, dropped, importance)
+        print(f"[SAVED] features ({len(features)}) ->", FEATURES_PATH)
+    print(f"[REGISTRY] {REGISTRY_PATH} | version={version} | promoted={AUTO_PROMOTE} | gc removed {len(removed)} files")
+
+    # Update state: last_rowid = max rowid seen at the start of this run
     state["last_rowid"] = int(max_rowid)
     state["last_train_time"] = ts
+    # previous models = starting point of the next incremental run
+    state["risk_model_path"] = risk_path
+    state["cx_model_path"] = cx_path
+    state["cascade_path"] = cascade_path
+    state["features"] = features  # None after out-of-core runs: the streaming models use every column
+    state["incremental_runs"] = int(state.get("incremental_runs", 0)) + 1 if mode == "incremental" else 0
     save_state(STATE_PATH, state)
 
     print("[STATE] updated ->", STATE_PATH)
+    return log_row
+
+
+# ============================================================
+# 5) DAEMON: poll for new rows, train in a child process
+# ============================================================
+
+def warm_up(con) -> None:
+    """Refresh the parent's caches: drift reference + training window (topped up, not re-read)."""
+    cached_drift_reference()
+
+    rows = MAX_TRAIN_ROWS
+    if rows is None or (OUT_OF_CORE_ROWS is not None and rows > OUT_OF_CORE_ROWS):
+        return  # such windows are streamed, never held in memory
+    if "window" in _WARM and refresh_warm_window(con) is not None:
+        return
+    # generation read before the window: a rewrite during the load is caught on the next refresh
+    _WARM["window_generation"] = snapshot_cache.table_generation(con, LABELED_TABLE)
+    _WARM["window"] = load_training_window(con, rows).iloc[::-1].reset_index(drop=True)
+    _WARM["window_rows"] = rows
+
+
+def run_training_child() -> int:
+    """main() in a forked child: it inherits imports and _WARM; the parent survives crashes."""
+    methods = mp.get_all_start_methods()
+    ctx = mp.get_context("fork") if "fork" in methods else mp.get_context()
+    p = ctx.Process(target=main, name="continuous-training")
+    p.start()
+    p.join()
+    return p.exitcode
+
+
+def run_daemon(poll_seconds: float = DAEMON_POLL_SECONDS) -> None:
+    """Long-running mode: `python continuous_training_32.py --daemon`.
+
+    One persistent read-only connection. PRAGMA data_version changes only when
+    another connection commits, so idle polls cost nothing; after a commit
+    MAX(rowid) - last_rowid gives the pending rows. Training starts once
+    MIN_NEW_ROWS_TO_TRAIN rows are pending (debounce) and runs in a child process.
+    """
+    con = connect_ro()
+    seen_version = None
+    retry_at = 0.0
+    print(f"[DAEMON] polling {DB_PATH} every {poll_seconds}s (min new rows {MIN_NEW_ROWS_TO_TRAIN:,})")
+
+    while True:
+        version = con.execute("PRAGMA data_version").fetchone()[0]
+        if version != seen_version and time.time() >= retry_at:
+            seen_version = version
+            last_rowid = int(load_state(STATE_PATH).get("last_rowid", 0))
+            max_rowid = con.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {LABELED_TABLE}").fetchone()[0]
+            pending = max_rowid - last_rowid
+
+            if pending >= MIN_NEW_ROWS_TO_TRAIN:
+                print(f"[DAEMON] {pending:,} pending rows -> training")
+                warm_up(con)
+                code = run_training_child()
+                trained = int(load_state(STATE_PATH).get("last_rowid", 0)) != last_rowid
+                if code != 0:
+                    print(f"[DAEMON] training failed (exit code {code}), retry in {DAEMON_RETRY_SECONDS}s")
+                    retry_at = time.time() + DAEMON_RETRY_SECONDS
+                    seen_version = None
+                elif trained:
+                    seen_version = None  # state moved: re-check right away (rows may have arrived meanwhile)
+            else:
+                print(f"[DAEMON] {max(pending, 0):,}/{MIN_NEW_ROWS_TO_TRAIN:,} pending rows, waiting")
+
+        time.sleep(poll_seconds)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--daemon" in sys.argv[1:]:
+        run_daemon()
+    elif "--backtest" in sys.argv[1:]:
+        run_backtest()
+    else:
+        main()
\ No newline at end of file
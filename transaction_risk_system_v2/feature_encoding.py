@@ -0,0 +1,236 @@
+# feature_encoding.py
+# ============================================================
+# CARDINALITY-AWARE ENCODING (for 3.2 make_preprocessors)
+# - the encoding of every column is chosen at fit time from its cardinality:
+#     numeric                     -> imputer (+ scaler for linear models)
+#     low  (<= LOW_CARD_MAX)      -> one-hot / ordinal, as before
+#     mid                         -> hashing into HASH_WIDTH buckets (bounded width)
+#     high (> HIGH_CARD_RATIO)    -> datetime parts if it parses as a date, else dropped
+# - tr_datetime ("65 22:48:17", one value per row) used to be one-hot encoded:
+#   a sparse matrix as wide as the window and a vocabulary of the same size
+# - hashing, not target encoding: the fitted preprocessors are shared by both
+#   targets (fit_preprocessors fits them once, without y)
+# - the chosen encodings are kept on the fitted transformer (encodings_),
+#   i.e. inside the saved Pipeline; own module so api_app can unpickle it
+# ============================================================
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, StandardScaler
+
+
+# ============================================================
+# 0) SETTINGS
+# ============================================================
+
+LOW_CARD_MAX = 50           # <= distinct values: one-hot / ordinal
+HIGH_CARD_RATIO = 0.5       # distinct / rows above this: datetime parts or drop
+HASH_WIDTH = 64             # buckets of a mid-cardinality column
+DATETIME_MIN_PARSED = 0.95  # share of parsed values to treat a string column as a datetime
+DATETIME_SAMPLE = 10_000    # values tried when detecting datetimes
+
+DATETIME_PARTS = ["weekday", "hour", "minute"]  # no absolute day / year: they do not extrapolate
+
+
+# ============================================================
+# 1) COLUMN TRANSFORMERS
+# ============================================================
+
+def parse_datetime_parts(s: pd.Series) -> pd.DataFrame:
+    """DATETIME_PARTS of "<day index> HH:MM:SS" (competition format) or ISO strings; NaN if unparsable."""
+    s = s.astype(object).where(s.notna(), None).astype(str)
+    out = pd.DataFrame(np.nan, index=s.index, columns=DATETIME_PARTS)
+
+    rel = s.str.extract(r"^\s*(\d+)\s+(\d{1,2}):(\d{2})", expand=True)
+    is_rel = rel[0].notna()
+    if is_rel.any():
+        r = rel[is_rel].astype(np.int64)
+        out.loc[is_rel, "weekday"] = r[0] % 7
+        out.loc[is_rel, "hour"] = r[1]
+        out.loc[is_rel, "minute"] = r[2]
+
+    rest = ~is_rel & (s != "None")
+    if rest.any():
+        dt = pd.to_datetime(s[rest], errors="coerce", format="mixed")
+        out.loc[rest, "weekday"] = dt.dt.dayofweek
+        out.loc[rest, "hour"] = dt.dt.hour
+        out.loc[rest, "minute"] = dt.dt.minute
+    return out
+
+
+class DatetimeParts(BaseEstimator, TransformerMixin):
+    """String datetime columns -> weekday / hour / minute per column (float, NaN if unparsable)."""
+
+    def fit(self, X, y=None):
+        X = pd.DataFrame(X)
+        self.columns_ = list(X.columns)
+        self.n_features_in_ = len(self.columns_)
+        return self
+
+    def transform(self, X):
+        X = pd.DataFrame(X, columns=self.columns_)
+        return np.hstack([parse_datetime_parts(X[c]).to_numpy(dtype=float) for c in self.columns_])
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray([f"{c}_{p}" for c in self.columns_ for p in DATETIME_PARTS], dtype=object)
+
+
+def hash_buckets(s: pd.Series, width: int) -> np.ndarray:
+    """Stable bucket ids (pandas hash, independent of PYTHONHASHSEED); NaN is its own value."""
+    values = s.astype(object).where(s.notna(), "__nan__").astype(str).to_numpy(dtype=object)
+    return (pd.util.hash_array(values) % np.uint64(width)).astype(np.int64)
+
+
+class HashingEncoder(BaseEstimator, TransformerMixin):
+    """Mid-cardinality columns -> fixed width, no vocabulary.
+
+    output="onehot": sparse indicator of the bucket (width columns per input column)
+    output="bucket": the bucket id itself (one column, for tree models)
+    """
+
+    def __init__(self, width=HASH_WIDTH, output="onehot"):
+        self.width = width
+        self.output = output
+
+    def fit(self, X, y=None):
+        X = pd.DataFrame(X)
+        self.columns_ = list(X.columns)
+        self.n_features_in_ = len(self.columns_)
+        return self
+
+    def transform(self, X):
+        X = pd.DataFrame(X, columns=self.columns_)
+        buckets = np.column_stack([hash_buckets(X[c], self.width) for c in self.columns_])
+        if self.output == "bucket":
+            return buckets.astype(float)
+        n = len(X)
+        rows = np.repeat(np.arange(n), len(self.columns_))
+        cols = (buckets + np.arange(len(self.columns_)) * self.width).ravel()
+        return sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, self.width * len(self.columns_)))
+
+    def get_feature_names_out(self, input_features=None):
+        if self.output == "bucket":
+            return np.asarray([f"{c}_bucket" for c in self.columns_], dtype=object)
+        return np.asarray([f"{c}_h{i}" for c in self.columns_ for i in range(self.width)], dtype=object)
+
+
+# ============================================================
+# 2) ENCODING PLAN
+# ============================================================
+
+def _is_datetime_like(s: pd.Series) -> bool:
+    sample = s.dropna()
+    sample = sample.iloc[:DATETIME_SAMPLE]
+    if sample.empty:
+        return False
+    parsed = parse_datetime_parts(sample)["hour"].notna().mean()
+    return parsed >= DATETIME_MIN_PARSED
+
+
+def plan_encodings(X: pd.DataFrame, low_card_max: int = LOW_CARD_MAX,
+                   high_card_ratio: float = HIGH_CARD_RATIO) -> dict:
+    """{column: {"encoding", "n_unique"}}, encoding in numeric / category / hash / datetime / drop."""
+    plan = {}
+    n = max(len(X), 1)
+    numeric = set(X.select_dtypes(include=[np.number]).columns)  # any width: table_schema downcasts
+    for c in X.columns:
+        if c in numeric:
+            plan[c] = {"encoding": "numeric", "n_unique": None}
+            continue
+        k = int(X[c].nunique(dropna=True))
+        if k <= low_card_max:
+            enc = "category"
+        elif k / n <= high_card_ratio:
+            enc = "hash"
+        else:
+            enc = "datetime" if _is_datetime_like(X[c]) else "drop"
+        plan[c] = {"encoding": enc, "n_unique": k}
+    return plan
+
+
+def _columns(plan: dict, encoding: str) -> list[str]:
+    return [c for c, p in plan.items() if p["encoding"] == encoding]
+
+
+# ============================================================
+# 3) PREPROCESSOR
+# ============================================================
+
+class CardinalityEncoder(BaseEstimator, TransformerMixin):
+    """ColumnTransformer built at fit time from plan_encodings(X).
+
+    kind="onehot":  scaled numerics, one-hot / hashed indicators -> sparse (linear models)
+    kind="ordinal": raw numerics, ordinal codes / bucket ids     -> dense (tree models)
+    After fit: encodings_ = {column: {"encoding", "n_unique", "width"}}.
+    """
+
+    def __init__(self, kind="onehot", low_card_max=LOW_CARD_MAX, high_card_ratio=HIGH_CARD_RATIO,
+                 hash_width=HASH_WIDTH):
+        self.kind = kind
+        self.low_card_max = low_card_max
+        self.high_card_ratio = high_card_ratio
+        self.hash_width = hash_width
+
+    def _build(self, plan: dict) -> ColumnTransformer:
+        onehot = self.kind == "onehot"
+        num_steps = [("imputer", SimpleImputer(strategy="median"))]
+        if onehot:
+            num_steps.append(("scaler", StandardScaler(with_mean=False)))
+        cat_encoder = (
+            ("onehot", OneHotEncoder(handle_unknown="ignore")) if onehot
+            else ("ord", OrdinalEncoder(handle_unknown="use_encoded_value", unknown_value=-1))
+        )
+        dt_steps = [("parts", DatetimeParts()), ("imputer", SimpleImputer(strategy="median", keep_empty_features=True))]
+        if onehot:
+            dt_steps.append(("scaler", StandardScaler(with_mean=False)))
+
+        return ColumnTransformer(
+            transformers=[
+                ("num", Pipeline(num_steps), _columns(plan, "numeric")),
+                ("cat", Pipeline([("imputer", SimpleImputer(strategy="most_frequent")), cat_encoder]),
+                 _columns(plan, "category")),
+                ("hash", HashingEncoder(width=self.hash_width, output="onehot" if onehot else "bucket"),
+                 _columns(plan, "hash")),
+                ("datetime", Pipeline(dt_steps), _columns(plan, "datetime")),
+            ],
+            remainder="drop",  # "drop" columns of the plan
+            sparse_threshold=0.3 if onehot else 0.0,
+        )
+
+    def _widths(self, plan: dict) -> dict:
+        """Output columns per input column."""
+        onehot = self.kind == "onehot"
+        cat = _columns(plan, "category")
+        cat_widths = {}
+        if onehot and cat:
+            enc = self.column_transformer_.named_transformers_["cat"].named_steps["onehot"]
+            cat_widths = {c: len(v) for c, v in zip(cat, enc.categories_)}
+        width = {"numeric": 1, "hash": self.hash_width if onehot else 1, "datetime": len(DATETIME_PARTS), "drop": 0}
+        return {c: cat_widths.get(c, 1) if p["encoding"] == "category" else width[p["encoding"]]
+                for c, p in plan.items()}
+
+    def fit_transform(self, X: pd.DataFrame, y=None):
+        plan = plan_encodings(X, self.low_card_max, self.high_card_ratio)
+        self.column_transformer_ = self._build(plan)
+        Xt = self.column_transformer_.fit_transform(X, y)
+        widths = self._widths(plan)
+        self.encodings_ = {c: {**p, "width": widths[c]} for c, p in plan.items()}
+        self.feature_names_in_ = np.asarray(list(X.columns), dtype=object)
+        self.n_features_in_ = len(self.feature_names_in_)
+        return Xt
+
+    def fit(self, X: pd.DataFrame, y=None):
+        self.fit_transform(X, y)
+        return self
+
+    def transform(self, X: pd.DataFrame):
+        return self.column_transformer_.transform(X)
+
+    def get_feature_names_out(self, input_features=None):
+        return self.column_transformer_.get_feature_names_out()
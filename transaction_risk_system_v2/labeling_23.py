@@ -10,6 +10,9 @@ import pandas as pd
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 
+import snapshot_cache
+import table_schema
+
 # ==============================
 # 0) МЕНЯТЬ НА СОРЕВНОВАНИИ
 # ==============================
@@ -77,6 +80,9 @@ FROM {EVENTS_TABLE}
 """
 
 df = pd.read_sql(sql, con)
+# компактные типы (общая схема с continuous_training_32): int16/int32/float32 + category;
+# amount не трогаем — он пишется обратно в transactions_labeled, float32 округлил бы суммы
+df = table_schema.compact(df, exclude=["amount"], report=True, label="transactions")
 
 # ==============================
 # 2) Feature engineering
@@ -197,6 +203,18 @@ out_cols = [
 out_df = df[out_cols].copy()
 
 out_df.to_sql("transactions_labeled", con, if_exists="replace", index=False)
+# метка перезаписи: демон continuous_training_32 и снапшот сбрасывают свои копии старой таблицы
+snapshot_cache.mark_rewritten(con, "transactions_labeled")
 
 print("[OK] Saved to DB table: transactions_labeled")
+
+# ==============================
+# 8) Parquet-снапшот для continuous_training_32 (если есть pyarrow)
+# ==============================
+# Таблица перезаписана целиком (replace) -> снапшот пересобираем с нуля.
+# Дальше continuous_training_32 сам дописывает только новые диапазоны rowid.
+if snapshot_cache.SNAPSHOT_AVAILABLE:
+    manifest = snapshot_cache.export_new_partitions(con, "transactions_labeled", reset=True)
+    print(f"[OK] Snapshot: {len(manifest['partitions'])} partitions -> "
+          f"{snapshot_cache.snapshot_dir('transactions_labeled')}")
 print(out_df[["risk_level", "verification_complexity"]].value_counts().head(10))
\ No newline at end of file
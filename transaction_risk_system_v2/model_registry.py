@@ -0,0 +1,198 @@
+# model_registry.py
+# ============================================================
+# MODEL REGISTRY (for 3.2) — one SQLite table instead of globbing
+# models/versions and re-reading training_log.csv
+# - register(): one INSERT per (version, target) artifact
+# - indexed queries: best model of a target in the last N days, promoted model
+# - retention: files of unpromoted versions beyond the newest N are deleted,
+#   their rows stay (metrics history) with path = NULL, deleted_at set
+# - cascade / students / joint model are promoted only together with the
+#   version of the models they were trained against (DEPENDENT_TARGETS)
+# ============================================================
+
+import os
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+
+# ============================================================
+# 0) SETTINGS
+# ============================================================
+
+REGISTRY_PATH = "models/registry.db"
+TABLE = "model_versions"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    id INTEGER PRIMARY KEY,
+    version TEXT NOT NULL,
+    created_at TEXT NOT NULL,          -- ISO, sortable
+    target TEXT NOT NULL,              -- risk_level / verification_complexity / cascade_risk
+    family TEXT,                       -- RandomForest, HistGB, LogReg, SGD, ...
+    model_name TEXT,                   -- candidate name incl. grid suffix
+    train_mode TEXT,
+    trained_rows INTEGER,
+    train_seconds REAL,
+    f1_macro REAL,
+    accuracy REAL,
+    recall_macro REAL,
+    roc_auc_ovr REAL,
+    latency_b1_ms REAL,
+    latency_b1k_ms REAL,
+    model_mb REAL,                     -- pickled estimator
+    file_bytes INTEGER,                -- joblib on disk
+    metrics_json TEXT,                 -- everything else measured for this candidate
+    path TEXT,
+    promoted INTEGER NOT NULL DEFAULT 0,
+    deleted_at TEXT,
+    UNIQUE (version, target)
+);
+CREATE INDEX IF NOT EXISTS ix_{TABLE}_target_created ON {TABLE} (target, created_at);
+CREATE INDEX IF NOT EXISTS ix_{TABLE}_target_promoted ON {TABLE} (target, promoted);
+"""
+
+# artifact target -> targets of the models it was trained against (same version)
+DEPENDENT_TARGETS = {
+    "cascade_risk": ["risk_level"],
+    "student_risk_level": ["risk_level"],
+    "student_verification_complexity": ["verification_complexity"],
+    "joint": ["risk_level", "verification_complexity"],
+}
+
+COLUMNS = ["f1_macro", "accuracy", "recall_macro", "roc_auc_ovr", "latency_b1_ms", "latency_b1k_ms", "model_mb"]
+
+
+def connect(path: str = REGISTRY_PATH) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    con = sqlite3.connect(path)
+    con.row_factory = sqlite3.Row
+    con.executescript(SCHEMA)
+    return con
+
+
+def _num(v):
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return None
+    return v if v == v else None  # NaN -> NULL
+
+
+# ============================================================
+# 1) WRITE
+# ============================================================
+
+def register(con, version: str, target: str, model_name: str, path: str | None, metrics: dict | None = None,
+             train_mode: str | None = None, trained_rows: int | None = None, train_seconds: float | None = None,
+             created_at: datetime | None = None) -> int:
+    """One row per saved artifact; returns its id."""
+    metrics = dict(metrics or {})
+    created_at = (created_at or datetime.now()).isoformat(timespec="seconds")
+    family = model_name.split("_")[0] if model_name else None
+    file_bytes = os.path.getsize(path) if path and os.path.exists(path) else None
+    extra = {k: _num(v) if not isinstance(v, str) else v for k, v in metrics.items() if k not in COLUMNS}
+
+    with con:
+        cur = con.execute(
+            f"""
+            INSERT INTO {TABLE} (version, created_at, target, family, model_name, train_mode, trained_rows,
+                                 train_seconds, {", ".join(COLUMNS)}, file_bytes, metrics_json, path)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, {", ".join("?" * len(COLUMNS))}, ?, ?, ?)
+            """,
+            (version, created_at, target, family, model_name, train_mode, trained_rows, _num(train_seconds),
+             *[_num(metrics.get(c)) for c in COLUMNS], file_bytes, json.dumps(extra, default=str), path),
+        )
+    return cur.lastrowid
+
+
+def promote(con, version: str, targets: list[str] | None = None) -> None:
+    """Mark version as the promoted (served) one of its targets; the previous one is un-promoted.
+
+    Dependent artifacts then follow their base models: the cascade / student / joint
+    row of the version all its bases are promoted at is promoted, any other is
+    un-promoted (an incremental run registers new base models but no students).
+    """
+    if targets is None:
+        targets = [r[0] for r in con.execute(f"SELECT target FROM {TABLE} WHERE version = ?", (version,))]
+    with con:
+        for t in targets:
+            con.execute(f"UPDATE {TABLE} SET promoted = 0 WHERE target = ? AND promoted = 1", (t,))
+            con.execute(f"UPDATE {TABLE} SET promoted = 1 WHERE target = ? AND version = ?", (t, version))
+
+        for dep, bases in DEPENDENT_TARGETS.items():
+            base_versions = {r[0] for r in con.execute(
+                f"SELECT version FROM {TABLE} WHERE promoted = 1 AND target IN ({', '.join('?' * len(bases))})",
+                bases,
+            )}
+            con.execute(f"UPDATE {TABLE} SET promoted = 0 WHERE target = ? AND promoted = 1", (dep,))
+            if len(base_versions) == 1:
+                con.execute(
+                    f"UPDATE {TABLE} SET promoted = 1 WHERE target = ? AND version = ? AND deleted_at IS NULL",
+                    (dep, base_versions.pop()),
+                )
+
+
+def collect_garbage(con, keep: int) -> list[str]:
+    """Delete the files of unpromoted artifacts older than the newest `keep` versions of each target."""
+    rows = con.execute(
+        f"""
+        SELECT id, path FROM (
+            SELECT id, path, promoted, deleted_at,
+                   ROW_NUMBER() OVER (PARTITION BY target ORDER BY created_at DESC, id DESC) AS rn
+            FROM {TABLE}
+        )
+        WHERE rn > ? AND promoted = 0 AND deleted_at IS NULL
+        """,
+        (int(keep),),
+    ).fetchall()
+
+    removed = []
+    now = datetime.now().isoformat(timespec="seconds")
+    with con:
+        for r in rows:
+            if r["path"] and os.path.exists(r["path"]):
+                os.remove(r["path"])
+                removed.append(r["path"])
+            con.execute(f"UPDATE {TABLE} SET deleted_at = ?, path = NULL WHERE id = ?", (now, r["id"]))
+    return removed
+
+
+# ============================================================
+# 2) READ
+# ============================================================
+
+def best_model(con, target: str, days: int | None = 30, metric: str = "f1_macro") -> dict | None:
+    """Best still-available artifact of target created in the last `days` days."""
+    if metric not in COLUMNS:
+        raise ValueError(f"unknown metric: {metric}")
+    since = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds") if days else ""
+    row = con.execute(
+        f"""
+        SELECT * FROM {TABLE}
+        WHERE target = ? AND created_at >= ? AND deleted_at IS NULL
+        ORDER BY {metric} DESC LIMIT 1
+        """,
+        (target, since),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def promoted_model(con, target: str) -> dict | None:
+    row = con.execute(f"SELECT * FROM {TABLE} WHERE target = ? AND promoted = 1", (target,)).fetchone()
+    return dict(row) if row else None
+
+
+def mode_summary(con) -> list[dict]:
+    """Mean cost / quality per (train_mode, target) — full vs incremental vs out-of-core runs."""
+    rows = con.execute(
+        f"""
+        SELECT train_mode, target, COUNT(*) AS runs, AVG(train_seconds) AS train_seconds,
+               AVG(trained_rows) AS trained_rows, AVG(f1_macro) AS f1_macro
+        FROM {TABLE}
+        WHERE train_mode IS NOT NULL
+        GROUP BY train_mode, target
+        ORDER BY target, train_mode
+        """
+    ).fetchall()
+    return [dict(r) for r in rows]
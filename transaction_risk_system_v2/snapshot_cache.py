@@ -0,0 +1,222 @@
+# snapshot_cache.py
+# ============================================================
+# PARQUET SNAPSHOT CACHE of transactions_labeled (for 2.3 / 3.2)
+# - labeling_23 exports the table into rowid-partitioned Parquet files
+# - continuous_training_32 syncs only new rowid ranges, then assembles
+#   its training window by memory-mapping the last partitions
+# - no pyarrow -> SNAPSHOT_AVAILABLE = False, callers fall back to SQLite
+# - writers that replace the table bump its generation (mark_rewritten);
+#   the snapshot and the daemon's cached window are dropped when it changes
+# - one Arrow schema per snapshot (from the declared SQLite types, kept in
+#   the manifest): every partition is cast to it, so they always concatenate
+# ============================================================
+
+import os
+import json
+import shutil
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    SNAPSHOT_AVAILABLE = True
+except Exception:
+    SNAPSHOT_AVAILABLE = False
+
+
+# ============================================================
+# 0) SETTINGS
+# ============================================================
+
+SNAPSHOT_ROOT = "db/snapshots"      # next to db/app.db
+PARTITION_ROWS = 100_000            # rows per Parquet file
+COMPRESSION = "none"                # uncompressed -> memory-mapped reads are near zero-cost
+MANIFEST_NAME = "manifest.json"
+GENERATIONS_TABLE = "table_generations"  # table_name -> rewrite counter, in the same DB
+
+
+def snapshot_dir(table: str, root: str = SNAPSHOT_ROOT) -> str:
+    return os.path.join(root, table)
+
+
+# ============================================================
+# 1) TABLE GENERATION: explicit marker of a rewritten table
+# ============================================================
+
+def table_generation(con, table: str) -> int:
+    """Rewrite counter of table, 0 if it was never marked (works on read-only connections)."""
+    try:
+        row = con.execute(f"SELECT generation FROM {GENERATIONS_TABLE} WHERE table_name = ?", (table,)).fetchone()
+    except sqlite3.OperationalError:  # no marker table yet
+        return 0
+    return int(row[0]) if row else 0
+
+
+def mark_rewritten(con, table: str) -> int:
+    """Bump the generation of table after it was replaced (to_sql(if_exists="replace")).
+
+    Same row count or more, so rowids alone cannot tell a rewrite from appends;
+    readers with cached copies compare the generation instead. Returns the new one.
+    """
+    with con:
+        con.execute(
+            f"CREATE TABLE IF NOT EXISTS {GENERATIONS_TABLE} "
+            "(table_name TEXT PRIMARY KEY, generation INTEGER NOT NULL, rewritten_at TEXT)"
+        )
+        con.execute(
+            f"""
+            INSERT INTO {GENERATIONS_TABLE} (table_name, generation, rewritten_at) VALUES (?, 1, ?)
+            ON CONFLICT(table_name) DO UPDATE SET generation = generation + 1, rewritten_at = excluded.rewritten_at
+            """,
+            (table, datetime.now().isoformat(timespec="seconds")),
+        )
+    return table_generation(con, table)
+
+
+# ============================================================
+# 2) MANIFEST
+# ============================================================
+
+def load_manifest(path: str) -> dict:
+    mpath = os.path.join(path, MANIFEST_NAME)
+    if os.path.exists(mpath):
+        with open(mpath, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"columns": None, "schema": None, "generation": 0, "last_rowid": 0, "partitions": []}
+
+
+def _save_manifest(path: str, manifest: dict) -> None:
+    tmp = os.path.join(path, MANIFEST_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(path, MANIFEST_NAME))
+
+
+def _declared_type(decl: str):
+    """Arrow type of a declared SQLite column type (affinity rules), None if it gives no type."""
+    decl = (decl or "").upper()
+    if "INT" in decl:
+        return pa.int64()
+    if any(k in decl for k in ("CHAR", "CLOB", "TEXT")):
+        return pa.string()
+    if any(k in decl for k in ("REAL", "FLOA", "DOUB")):
+        return pa.float64()
+    return None
+
+
+def snapshot_schema(con, table: str, chunk: pd.DataFrame) -> dict:
+    """{column: arrow type alias} for the whole snapshot, _rowid_ first.
+
+    Inferred per chunk, a column that is all-null in one chunk (null) or has a
+    null among ints (double) would differ between partitions. Declared types fix
+    it; columns without one take the type of the first chunk (null -> string).
+    """
+    schema = {"_rowid_": "int64"}
+    for _, name, decl, *_ in con.execute(f"PRAGMA table_info({table})"):
+        t = _declared_type(decl)
+        if t is None:
+            t = pa.Array.from_pandas(chunk[name]).type
+            if pa.types.is_null(t):
+                t = pa.string()
+        schema[name] = str(t)
+    return schema
+
+
+def _arrow_schema(schema: dict):
+    return pa.schema([(name, pa.type_for_alias(t)) for name, t in schema.items()])
+
+
+# ============================================================
+# 3) EXPORT: new rowid ranges -> Parquet partitions
+# ============================================================
+
+def export_new_partitions(con, table: str, root: str = SNAPSHOT_ROOT,
+                          partition_rows: int = PARTITION_ROWS, reset: bool = False) -> dict:
+    """Append rows with rowid > manifest.last_rowid as new partitions.
+
+    reset=True (or a changed column list / table generation, a manifest without
+    a schema, or a table that shrank below the manifest) wipes the snapshot and
+    re-exports everything — labeling_23 rewrites the table with
+    if_exists="replace", so it always resets.
+    Partition files are written first and the manifest last, so a crash
+    never leaves the manifest pointing at a missing file.
+    """
+    if not SNAPSHOT_AVAILABLE:
+        raise ImportError("pyarrow is required for the Parquet snapshot cache")
+
+    path = snapshot_dir(table, root)
+    manifest = load_manifest(path)
+
+    columns = [r[1] for r in con.execute(f"PRAGMA table_info({table})")]
+    max_rowid = con.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+    generation = table_generation(con, table)
+
+    if (reset or manifest["columns"] != columns or manifest.get("generation", 0) != generation
+            or not manifest.get("schema") or max_rowid < manifest["last_rowid"]):
+        shutil.rmtree(path, ignore_errors=True)
+        manifest = {"columns": columns, "schema": None, "generation": generation, "last_rowid": 0,
+                    "partitions": []}
+
+    os.makedirs(path, exist_ok=True)
+
+    last = int(manifest["last_rowid"])
+    while True:
+        chunk = pd.read_sql(
+            f"SELECT rowid AS _rowid_, * FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            con, params=(last, partition_rows)
+        )
+        if chunk.empty:
+            break
+
+        if manifest["schema"] is None:
+            manifest["schema"] = snapshot_schema(con, table, chunk)
+        # ArrowInvalid here = a value that does not fit the declared type (e.g. 1.5 in INTEGER)
+        arrow_table = pa.Table.from_pandas(chunk, schema=_arrow_schema(manifest["schema"]), preserve_index=False)
+
+        lo, hi = int(chunk["_rowid_"].iloc[0]), int(chunk["_rowid_"].iloc[-1])
+        name = f"part_{lo:012d}_{hi:012d}.parquet"
+        tmp = os.path.join(path, name + ".tmp")
+        pq.write_table(arrow_table, tmp, compression=COMPRESSION)
+        os.replace(tmp, os.path.join(path, name))
+
+        manifest["partitions"].append({"file": name, "rowid_min": lo, "rowid_max": hi, "rows": len(chunk)})
+        manifest["last_rowid"] = last = hi
+        _save_manifest(path, manifest)
+
+    _save_manifest(path, manifest)
+    return manifest
+
+
+# ============================================================
+# 4) LOAD: last n rows via memory-mapped partitions
+# ============================================================
+
+def load_window(table: str, n_rows: int | None, root: str = SNAPSHOT_ROOT) -> pd.DataFrame | None:
+    """Last n_rows rows (by rowid, ascending) with a _rowid_ column.
+
+    Only the trailing partitions that cover n_rows are opened.
+    Returns None if the snapshot (or pyarrow) is not available.
+    """
+    if not SNAPSHOT_AVAILABLE:
+        return None
+
+    path = snapshot_dir(table, root)
+    parts = load_manifest(path)["partitions"]
+    if not parts:
+        return None
+
+    picked, covered = [], 0
+    for p in reversed(parts):
+        picked.append(p)
+        covered += p["rows"]
+        if n_rows is not None and covered >= n_rows:
+            break
+
+    tables = [pq.read_table(os.path.join(path, p["file"]), memory_map=True) for p in reversed(picked)]
+    t = pa.concat_tables(tables)
+    if n_rows is not None and t.num_rows > n_rows:
+        t = t.slice(t.num_rows - n_rows)
+    return t.to_pandas()
@@ -0,0 +1,318 @@
+# streaming_training.py
+# ============================================================
+# OUT-OF-CORE TRAINING (for 3.2, windows larger than memory)
+# - StreamingPreprocessor: numeric mean/std and category vocabularies
+#   accumulated chunk by chunk (partial_fit), then frozen
+# - train_streaming: partial_fit estimators over a chunk iterator,
+#   deterministic rowid holdout, flat memory in the number of rows
+# - ChunkedMetrics / evaluate_chunked: confusion matrix + binned AUC
+#   accumulated chunk by chunk from predict_proba alone (also used by
+#   continuous_training_32 for every candidate)
+# - kept in its own module so the fitted pipelines unpickle in api_app
+# ============================================================
+
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+
+
+# ============================================================
+# 0) SETTINGS
+# ============================================================
+
+MAX_CATEGORIES = 100      # per column, the rest -> all-zero one-hot row (like handle_unknown="ignore")
+PRUNE_FACTOR = 10         # category counts kept per column while fitting = MAX_CATEGORIES * PRUNE_FACTOR
+HOLDOUT_MOD = 5           # rowid % HOLDOUT_MOD == 0 -> evaluation rows (~20%, same rows every epoch)
+EPOCHS = 3                # passes over the stream
+EVAL_CHUNK_ROWS = 50_000  # rows per predict_proba call while evaluating
+AUC_BINS = 1000           # score histogram bins per class (binned ROC AUC, error ~1/AUC_BINS)
+
+# averaged constant-step SGD: stable across chunks in rowid order, no step-size schedule to tune per run
+MODELS = {
+    "SGD_log": SGDClassifier(loss="log_loss", alpha=1e-6, learning_rate="constant", eta0=0.1,
+                             average=True, random_state=42),
+    "SGD_huber": SGDClassifier(loss="modified_huber", alpha=1e-6, learning_rate="constant", eta0=0.1,
+                               average=True, random_state=42),
+}
+
+
+# ============================================================
+# 1) STREAMING PREPROCESSOR
+# ============================================================
+
+class StreamingPreprocessor(BaseEstimator, TransformerMixin):
+    """Scaled numerics + one-hot categories, fitted with partial_fit over chunks.
+
+    numeric:     NaN -> running mean, then (x - mean) / std (exact mean/var merged per chunk)
+    categorical: vocabulary = MAX_CATEGORIES most frequent values seen while fitting
+    Output is a CSR matrix, as the onehot ColumnTransformer of continuous_training_32.
+    """
+
+    def __init__(self, num_cols=(), cat_cols=(), max_categories=MAX_CATEGORIES):
+        self.num_cols = num_cols
+        self.cat_cols = cat_cols
+        self.max_categories = max_categories
+
+    def partial_fit(self, X: pd.DataFrame, y=None):
+        if not hasattr(self, "n_"):
+            self.feature_names_in_ = np.asarray(list(X.columns), dtype=object)
+            self.n_features_in_ = len(self.feature_names_in_)
+            k = len(self.num_cols)
+            self.n_, self.mean_, self.m2_ = np.zeros(k), np.zeros(k), np.zeros(k)
+            self.cat_counts_ = {c: pd.Series(dtype=np.int64) for c in self.cat_cols}
+            self.vocab_ = None
+
+        if self.num_cols:
+            A = X[list(self.num_cols)].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+            A[~np.isfinite(A)] = np.nan
+            n_b = (~np.isnan(A)).sum(axis=0)
+            mean_b = np.nansum(A, axis=0) / np.maximum(n_b, 1)
+            m2_b = np.nansum((A - mean_b) ** 2, axis=0)
+            # Chan et al. parallel merge of (n, mean, M2)
+            n = self.n_ + n_b
+            delta = mean_b - self.mean_
+            safe_n = np.maximum(n, 1)
+            self.mean_ = self.mean_ + delta * n_b / safe_n
+            self.m2_ = self.m2_ + m2_b + delta ** 2 * self.n_ * n_b / safe_n
+            self.n_ = n
+
+        for c in self.cat_cols:
+            vc = X[c].dropna().astype(str).value_counts()
+            counts = self.cat_counts_[c].add(vc, fill_value=0)
+            # bounded memory for high-cardinality columns: only the heavy hitters are kept
+            if len(counts) > self.max_categories * PRUNE_FACTOR:
+                counts = counts.nlargest(self.max_categories * PRUNE_FACTOR)
+            self.cat_counts_[c] = counts
+
+        self.vocab_ = None  # re-frozen lazily on the next transform
+        return self
+
+    def fit(self, X: pd.DataFrame, y=None):
+        for attr in ("n_", "mean_", "m2_", "cat_counts_", "vocab_"):
+            self.__dict__.pop(attr, None)
+        return self.partial_fit(X, y)
+
+    def _freeze(self) -> None:
+        self.scale_ = np.sqrt(self.m2_ / np.maximum(self.n_, 1))
+        self.scale_[self.scale_ == 0] = 1.0
+        self.vocab_ = {
+            c: pd.Index(self.cat_counts_[c].sort_values(ascending=False).index[:self.max_categories])
+            for c in self.cat_cols
+        }
+        self.offsets_ = np.cumsum([len(self.num_cols)] + [len(self.vocab_[c]) for c in self.cat_cols])
+
+    def transform(self, X: pd.DataFrame):
+        if self.vocab_ is None:
+            self._freeze()
+        n = len(X)
+        blocks = []
+
+        if self.num_cols:
+            A = X[list(self.num_cols)].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+            A[~np.isfinite(A)] = np.nan
+            A = np.where(np.isnan(A), self.mean_, A)
+            blocks.append(sp.csr_matrix((A - self.mean_) / self.scale_))
+
+        rows, cols = [], []
+        for j, c in enumerate(self.cat_cols):
+            idx = self.vocab_[c].get_indexer(X[c].astype(str).where(X[c].notna(), None))
+            hit = idx >= 0
+            rows.append(np.nonzero(hit)[0])
+            cols.append(idx[hit] + self.offsets_[j])
+        if self.cat_cols:
+            r, k = np.concatenate(rows), np.concatenate(cols) - self.offsets_[0]
+            width = int(self.offsets_[-1] - self.offsets_[0])
+            blocks.append(sp.csr_matrix((np.ones(len(r)), (r, k)), shape=(n, width)))
+
+        return sp.hstack(blocks, format="csr") if blocks else sp.csr_matrix((n, 0))
+
+
+# ============================================================
+# 2) CHUNKED EVALUATION
+# ============================================================
+
+class ChunkedMetrics:
+    """Multiclass metrics from chunks: memory is O(classes^2 + classes * bins), not O(rows).
+
+    update() takes the true labels and predict_proba of one chunk; the predicted
+    label is the argmax of the probabilities (what predict() returns for the
+    models here), so each chunk is scored once. Without probabilities pass pred=.
+    result() matches sklearn.metrics: accuracy, recall_macro, f1_macro (zero_division=0,
+    macro over labels seen in y_true or predictions) and roc_auc_ovr from per-class
+    score histograms (NaN unless every class of the model occurs in y_true).
+    """
+
+    def __init__(self, classes, bins: int = AUC_BINS):
+        self.classes = np.asarray(classes)
+        self.bins = bins
+        k = len(self.classes)
+        self.confusion = np.zeros((k + 1, k + 1), dtype=np.int64)  # index k: labels unknown to the model
+        self.pos = np.zeros((k, bins), dtype=np.int64)
+        self.neg = np.zeros((k, bins), dtype=np.int64)
+        self.has_proba = True
+
+    def _index(self, y) -> np.ndarray:
+        y = np.asarray(y)
+        k = len(self.classes)
+        idx = np.searchsorted(self.classes, y)  # sklearn classes_ are sorted
+        idx = np.minimum(idx, max(k - 1, 0))
+        return np.where(self.classes[idx] == y, idx, k) if k else np.zeros(len(y), dtype=np.int64)
+
+    def update(self, y_true, proba=None, pred=None) -> None:
+        k = len(self.classes)
+        y_idx = self._index(y_true)
+        if proba is not None:
+            p_idx = np.argmax(proba, axis=1)
+        else:
+            self.has_proba = False
+            p_idx = self._index(pred)
+        self.confusion += np.bincount(y_idx * (k + 1) + p_idx, minlength=(k + 1) ** 2).reshape(k + 1, k + 1)
+
+        if proba is not None:
+            b = np.clip((np.asarray(proba) * self.bins).astype(np.int64), 0, self.bins - 1)
+            for c in range(k):
+                is_pos = y_idx == c
+                self.pos[c] += np.bincount(b[is_pos, c], minlength=self.bins)
+                self.neg[c] += np.bincount(b[~is_pos, c], minlength=self.bins)
+
+    def _auc(self, c: int) -> float:
+        # scores descending: negatives of a bin rank below all positives of higher bins, ties count 1/2
+        pos, neg = self.pos[c][::-1], self.neg[c][::-1]
+        above = np.cumsum(pos) - pos
+        return float((neg * (above + 0.5 * pos)).sum() / (pos.sum() * neg.sum()))
+
+    def result(self) -> dict:
+        cm = self.confusion
+        k = len(self.classes)
+        n = cm.sum()
+        tp = np.diag(cm).astype(float)
+        tp[k] = 0  # unknown true label / unknown prediction never count as a hit
+        support, predicted = cm.sum(axis=1), cm.sum(axis=0)
+        present = (support > 0) | (predicted > 0)
+
+        recall = np.divide(tp, support, out=np.zeros_like(tp), where=support > 0)
+        precision = np.divide(tp, predicted, out=np.zeros_like(tp), where=predicted > 0)
+        denom = precision + recall
+        f1 = np.divide(2 * precision * recall, denom, out=np.zeros_like(tp), where=denom > 0)
+
+        out = {
+            "accuracy": float(tp.sum() / n) if n else 0.0,
+            "recall_macro": float(recall[present].mean()) if present.any() else 0.0,
+            "f1_macro": float(f1[present].mean()) if present.any() else 0.0,
+            "roc_auc_ovr": np.nan,
+        }
+        if self.has_proba and k >= 2 and support[k] == 0 and (support[:k] > 0).all():
+            out["roc_auc_ovr"] = self._auc(1) if k == 2 else float(np.mean([self._auc(c) for c in range(k)]))
+        return out
+
+
+def evaluate_chunked(model, Xt, y, chunk_rows: int = EVAL_CHUNK_ROWS) -> dict:
+    """ChunkedMetrics of a fitted estimator (or Pipeline) over Xt in chunk_rows slices."""
+    y = np.asarray(y)
+    acc = ChunkedMetrics(model.classes_)
+    has_proba = hasattr(model, "predict_proba")
+    for start in range(0, Xt.shape[0], chunk_rows):
+        X_chunk = Xt.iloc[start:start + chunk_rows] if isinstance(Xt, pd.DataFrame) else Xt[start:start + chunk_rows]
+        y_chunk = y[start:start + chunk_rows]
+        if has_proba:
+            acc.update(y_chunk, proba=model.predict_proba(X_chunk))
+        else:
+            acc.update(y_chunk, pred=model.predict(X_chunk))
+    return acc.result()
+
+
+# ============================================================
+# 3) STREAMING TRAINER
+# ============================================================
+
+def _holdout_mask(chunk: pd.DataFrame) -> np.ndarray:
+    return (chunk["_rowid_"].to_numpy() % HOLDOUT_MOD) == 0
+
+
+def sqrt_balanced_weights(class_counts: pd.Series, classes) -> np.ndarray:
+    """Per-class weights for partial_fit, aligned with classes.
+
+    class_weight="balanced" (partial_fit can't compute it), square-rooted: full
+    weights of rare classes make single SGD steps too large.
+    """
+    counts = class_counts.reindex(classes, fill_value=0).astype(float)
+    return np.sqrt(counts.sum() / (len(classes) * counts.clip(lower=1))).to_numpy()
+
+
+def train_streaming(chunks, feature_cols: list[str], num_cols: list[str], cat_cols: list[str],
+                    targets: list[str], models: dict | None = None, epochs: int = EPOCHS,
+                    log=print) -> dict:
+    """chunks(): fresh iterator of DataFrames with _rowid_, feature_cols and targets.
+
+    pass 0:   preprocessor statistics + class counts of the training rows
+    pass 1..: partial_fit of every (target, model) on every chunk, sqrt-balanced row weights
+    last:     holdout evaluation, ChunkedMetrics per (target, model): memory flat in the rows
+    Returns {target: (results_df, best_name, best_pipe, trace)} like train_and_select_all.
+    """
+    models = MODELS if models is None else models
+    t0 = time.perf_counter()
+
+    pre = StreamingPreprocessor(num_cols=num_cols, cat_cols=cat_cols)
+    class_counts = {t: pd.Series(dtype=np.int64) for t in targets}
+    n_rows = 0
+    for chunk in chunks():
+        train = chunk[~_holdout_mask(chunk)]
+        pre.partial_fit(train[feature_cols])
+        for t in targets:
+            class_counts[t] = class_counts[t].add(train[t].astype(str).value_counts(), fill_value=0)
+        n_rows += len(chunk)
+    log(f"[OOC] pass 0: {n_rows:,} rows, preprocessor fitted ({time.perf_counter() - t0:.1f}s)")
+
+    classes = {t: np.asarray(sorted(class_counts[t].index)) for t in targets}
+    # balanced weights from the full-stream counts
+    weights = {t: sqrt_balanced_weights(class_counts[t], classes[t]) for t in targets}
+    fitted = {(t, name): clone(m) for t in targets for name, m in models.items()}
+    fit_seconds = dict.fromkeys(fitted, 0.0)
+
+    rng = np.random.default_rng(42)
+    for epoch in range(epochs):
+        for chunk in chunks():
+            train = chunk[~_holdout_mask(chunk)]
+            if train.empty:
+                continue
+            order = rng.permutation(len(train))  # rowid order inside a chunk is not iid
+            Xt = pre.transform(train[feature_cols])[order]
+            for t in targets:
+                y = train[t].astype(str).to_numpy()[order]
+                w = weights[t][np.searchsorted(classes[t], y)]
+                for name in models:
+                    t1 = time.perf_counter()
+                    fitted[(t, name)].partial_fit(Xt, y, classes=classes[t], sample_weight=w)
+                    fit_seconds[(t, name)] += time.perf_counter() - t1
+        log(f"[OOC] epoch {epoch + 1}/{epochs} done ({time.perf_counter() - t0:.1f}s)")
+
+    # holdout: metrics accumulated chunk by chunk, one predict_proba per chunk and model
+    acc = {k: ChunkedMetrics(m.classes_) for k, m in fitted.items()}
+    for chunk in chunks():
+        test = chunk[_holdout_mask(chunk)]
+        if test.empty:
+            continue
+        Xt = pre.transform(test[feature_cols])
+        for (t, name), m in fitted.items():
+            acc[(t, name)].update(test[t].astype(str).to_numpy(), proba=m.predict_proba(Xt))
+
+    out = {}
+    for t in targets:
+        rows, best, best_f1 = [], None, -1
+        for name in models:
+            m = acc[(t, name)].result()
+            m.update({"model": name, "target": t, "rows": n_rows, "fit_seconds": fit_seconds[(t, name)]})
+            rows.append(m)
+            if m["f1_macro"] > best_f1:
+                best, best_f1 = name, m["f1_macro"]
+
+        res = pd.DataFrame(rows).sort_values("f1_macro", ascending=False).reset_index(drop=True)
+        pipe = Pipeline([("preprocess", pre), ("model", fitted[(t, best)])])
+        out[t] = (res, best, pipe, [])
+    return out
@@ -0,0 +1,174 @@
+# synthetic_data.py
+# ============================================================
+# SYNTHETIC transactions_labeled (for benchmarks of 3.2)
+# - same columns / types as labeling_23 writes:
+#   customer_id, tr_datetime, mcc_code, tr_type, amount, hour, flow,
+#   rule_score, anomaly_score, risk_score, risk_level, verification_complexity
+# - vectorized numpy, generated and inserted in chunks (10M rows in flat memory)
+# - labels follow the labeling_23 rules; anomaly_score is simulated
+#   (no IsolationForest over 10M rows)
+# - rowid order = time order, like a table that is appended to
+# ============================================================
+
+import os
+import sys
+import time
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import snapshot_cache
+
+
+# ============================================================
+# 0) SETTINGS
+# ============================================================
+
+DB_PATH = "db/app.db"
+TABLE = "transactions_labeled"
+SIZES = {"100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+
+CHUNK_ROWS = 500_000
+SEED = 42
+ROWS_PER_CUSTOMER = 50      # customers = rows / ROWS_PER_CUSTOMER (Zipf-like activity)
+DAYS = 450                  # tr_datetime "day hh:mm:ss", day grows with rowid
+OUTLIER_SHARE = 0.01        # rows with a high anomaly_score unrelated to amount / MCC
+
+# (code, probability)
+MCC_CODES = [(4814, 0.22), (5411, 0.25), (5499, 0.08), (5541, 0.07), (5912, 0.08),
+             (6010, 0.06), (6011, 0.12), (4829, 0.07), (5812, 0.05)]
+TR_TYPES = [(1010, 0.35), (1030, 0.30), (2010, 0.15), (2370, 0.05), (7010, 0.10), (7030, 0.05)]
+
+# labeling_23 business rules (keep in sync)
+X_MED = 50_000
+X_HIGH = 150_000
+Y_FREQ = 200
+RISK_MCC_LIST = {6011, 4829, 5541}
+LOW_THR = 35
+HIGH_THR = 70
+
+# sampling tables
+_MCC, _MCC_P = np.array([c for c, _ in MCC_CODES]), np.array([p for _, p in MCC_CODES])
+_MCC_P = _MCC_P / _MCC_P.sum()
+_TYPES, _TYPES_P = np.array([c for c, _ in TR_TYPES]), np.array([p for _, p in TR_TYPES])
+_TYPES_P = _TYPES_P / _TYPES_P.sum()
+_HOUR_P = np.array([1, 1, 1, 1, 1, 2, 3, 5, 6, 7, 7, 7, 7, 7, 7, 7, 7, 7, 6, 5, 4, 3, 2, 1], dtype=float)
+_HOUR_P = _HOUR_P / _HOUR_P.sum()
+
+
+# ============================================================
+# 1) GENERATOR
+# ============================================================
+
+def _customers(n_rows: int, rng: np.random.Generator):
+    """Activity weights (Zipf-like) and the expected transaction count of every customer."""
+    n_customers = max(1, n_rows // ROWS_PER_CUSTOMER)
+    w = 1.0 / np.arange(1, n_customers + 1) ** 0.8
+    w = rng.permutation(w / w.sum())
+    return w, w * n_rows
+
+
+def generate_chunk(start: int, n: int, n_total: int, weights: np.ndarray, tx_count: np.ndarray,
+                   rng: np.random.Generator) -> pd.DataFrame:
+    """Rows [start, start + n) of an n_total-row table."""
+    customer = rng.choice(len(weights), size=n, p=weights)
+
+    # time grows with the row index (rowid order = time order)
+    day = ((start + np.arange(n)) * DAYS // n_total).astype(np.int64)
+    hour = rng.choice(24, size=n, p=_HOUR_P)
+    minute, second = rng.integers(0, 60, size=n), rng.integers(0, 60, size=n)
+    tr_datetime = (pd.Series(day).astype(str) + " " + pd.Series(hour).map("{:02d}".format) + ":"
+                   + pd.Series(minute).map("{:02d}".format) + ":" + pd.Series(second).map("{:02d}".format))
+
+    mcc = rng.choice(_MCC, size=n, p=_MCC_P)
+    tr_type = rng.choice(_TYPES, size=n, p=_TYPES_P)
+
+    # |amount|: log-normal with a heavy tail per MCC; sign = spend / income
+    scale = np.where(np.isin(mcc, [6010, 6011, 4829]), 9.5, 8.0)
+    amount_abs = np.round(rng.lognormal(scale, 1.4, size=n), 2)
+    spend = rng.random(n) < 0.5
+    amount = np.where(spend, -amount_abs, amount_abs)
+
+    # rule_score: labeling_23 section 3
+    cust_cnt = tx_count[customer]
+    is_night = hour <= 5
+    rule = (np.where(amount_abs > X_MED, 25, 0) + np.where(amount_abs > X_HIGH, 35, 0)
+            + np.where(cust_cnt > Y_FREQ, 20, 0) + np.where(np.isin(mcc, list(RISK_MCC_LIST)), 25, 0)
+            + np.where(is_night & (amount_abs > X_MED), 15, 0))
+    rule_score = np.clip(rule, 0, 100).astype(float)
+
+    # anomaly_score: stands in for the IsolationForest score (large amounts, nights, noise,
+    # plus ~OUTLIER_SHARE behavioural outliers that no rule explains -> "hard" verification)
+    z = (np.log1p(amount_abs) - 8.3) / 1.5
+    raw = 12 + 9 * np.maximum(z, 0) ** 2 + 10 * is_night + rng.gamma(2.0, 4.0, size=n)
+    raw += np.where(rng.random(n) < OUTLIER_SHARE, rng.uniform(30, 60, size=n), 0)
+    anomaly_score = np.clip(raw, 0, 100)
+
+    risk_score = np.clip(0.6 * rule_score + 0.4 * anomaly_score, 0, 100)
+    risk_level = np.where(risk_score >= HIGH_THR, "high", np.where(risk_score >= LOW_THR, "medium", "low"))
+
+    # verification_complexity: labeling_23 section 6
+    has_big = amount_abs > X_MED
+    has_mcc = np.isin(mcc, list(RISK_MCC_LIST))
+    not_low = risk_level != "low"
+    ml_only = (rule_score < 15) & (anomaly_score > 60)
+    complexity = np.where((has_big | has_mcc) & not_low, "simple",
+                          np.where((cust_cnt > Y_FREQ) & not_low, "medium",
+                                   np.where(ml_only, "hard", "medium")))
+
+    return pd.DataFrame({
+        "customer_id": customer + 1,
+        "tr_datetime": tr_datetime.to_numpy(),
+        "mcc_code": mcc,
+        "tr_type": tr_type,
+        "amount": amount,
+        "hour": hour,
+        "flow": np.where(amount < 0, "spend", np.where(amount > 0, "income", "zero")),
+        "rule_score": rule_score,
+        "anomaly_score": anomaly_score,
+        "risk_score": risk_score,
+        "risk_level": risk_level,
+        "verification_complexity": complexity,
+    })
+
+
+def generate_db(n_rows: int, db_path: str = DB_PATH, overwrite: bool = False, seed: int = SEED,
+                chunk_rows: int = CHUNK_ROWS, log=print) -> dict:
+    """Write an n_rows TABLE into db_path; returns {"rows", "seconds", "db_bytes"}.
+
+    An existing TABLE is only replaced with overwrite=True (db/app.db may hold real data).
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    con = sqlite3.connect(db_path)
+    try:
+        exists = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABLE,)).fetchone()
+        if exists and not overwrite:
+            raise FileExistsError(f"{db_path} already has {TABLE} (pass overwrite=True / --overwrite)")
+        # bulk load: no journal / fsync, a crash leaves a file that is simply regenerated
+        con.execute("PRAGMA journal_mode = OFF")
+        con.execute("PRAGMA synchronous = OFF")
+        con.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+        t0 = time.perf_counter()
+        rng = np.random.default_rng(seed)
+        weights, tx_count = _customers(n_rows, rng)
+        for start in range(0, n_rows, chunk_rows):
+            chunk = generate_chunk(start, min(chunk_rows, n_rows - start), n_rows, weights, tx_count, rng)
+            chunk.to_sql(TABLE, con, if_exists="append", index=False)
+            con.commit()
+            log(f"[GEN] {start + len(chunk):,}/{n_rows:,} rows ({time.perf_counter() - t0:.1f}s)")
+        snapshot_cache.mark_rewritten(con, TABLE)  # cached copies of a previous TABLE are stale
+        seconds = time.perf_counter() - t0
+    finally:
+        con.close()
+    return {"rows": n_rows, "seconds": seconds, "db_bytes": os.path.getsize(db_path)}
+
+
+if __name__ == "__main__":
+    # python synthetic_data.py 1m [db_path] [--overwrite]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    size = args[0] if args else "100k"
+    n = SIZES[size] if size in SIZES else int(size)
+    info = generate_db(n, args[1] if len(args) > 1 else DB_PATH, overwrite="--overwrite" in sys.argv)
+    print(f"[OK] {info['rows']:,} rows in {info['seconds']:.1f}s, {info['db_bytes'] / 2**20:,.1f} MB")
@@ -0,0 +1,79 @@
+# table_schema.py
+# ============================================================
+# COMPACT DTYPES for transactions / transactions_labeled (2.3 + 3.2)
+# - pd.read_sql gives int64 / float64 and Python-object strings;
+#   apply_schema() downcasts numerics and turns low-cardinality
+#   strings into categoricals
+# - one definition, used by labeling_23 and continuous_training_32
+# ============================================================
+
+import numpy as np
+import pandas as pd
+
+
+# ============================================================
+# 0) SCHEMA
+# ============================================================
+
+# column -> target dtype; missing columns are skipped, unknown columns left as is.
+# tr_datetime stays a string (high cardinality: a categorical would not be smaller).
+SCHEMA = {
+    "customer_id": "int32",
+    "term_id": "int32",
+    "mcc_code": "int16",
+    "tr_type": "int16",
+    "amount": "float32",
+    "hour": "int8",
+    "flow": "category",
+    "rule_score": "float32",
+    "anomaly_score": "float32",
+    "risk_score": "float32",
+    "risk_level": "category",
+    "verification_complexity": "category",
+}
+
+
+def _to_int(s: pd.Series, dtype: str) -> pd.Series:
+    """Integer column -> dtype if all values fit; NULLs / overflow -> smallest safe type."""
+    x = pd.to_numeric(s, errors="coerce")
+    if x.isna().any():
+        # NULLs -> float; float32 is exact only up to 2^24 (ids can be larger)
+        return x.astype(np.float32 if x.abs().max() < 2**24 else np.float64)
+    info = np.iinfo(dtype)
+    if len(x) and (x.min() < info.min or x.max() > info.max):
+        return pd.to_numeric(x, downcast="integer")
+    return x.astype(dtype)
+
+
+def apply_schema(df: pd.DataFrame, schema: dict = SCHEMA, exclude=()) -> pd.DataFrame:
+    """Cast the schema columns of df (in place on a shallow copy) and return it.
+
+    exclude: columns to keep in their loaded dtype (e.g. values written back to the DB).
+    """
+    df = df.copy(deep=False)
+    for c, dtype in schema.items():
+        if c not in df.columns or c in exclude or str(df[c].dtype) == dtype:
+            continue
+        if dtype == "category":
+            df[c] = df[c].astype("category")
+        elif dtype.startswith("int"):
+            df[c] = _to_int(df[c], dtype)
+        else:
+            df[c] = pd.to_numeric(df[c], errors="coerce").astype(dtype)
+    return df
+
+
+def bytes_per_row(df: pd.DataFrame) -> float:
+    return float(df.memory_usage(deep=True).sum()) / max(len(df), 1)
+
+
+def compact(df: pd.DataFrame, exclude=(), report: bool = False, label: str = "") -> pd.DataFrame:
+    """apply_schema + optional "[MEM] before -> after bytes/row" line."""
+    if not report:
+        return apply_schema(df, exclude=exclude)
+    before = bytes_per_row(df)
+    out = apply_schema(df, exclude=exclude)
+    after = bytes_per_row(out)
+    print(f"[MEM] {label + ': ' if label else ''}{before:,.0f} -> {after:,.0f} bytes/row "
+          f"({len(df):,} rows, {before * len(df) / 2**20:,.1f} -> {after * len(df) / 2**20:,.1f} MB)")
+    return out
@@ -0,0 +1,60 @@
+# Дрейф /predict_batch: отсутствующие ключи и null не попадают в онлайн-гистограммы.
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_app  # noqa: E402
+
+MODEL_COLS = ["risk_score", "anomaly_score"]
+
+
+def _fit(y_col: str):
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.random((200, len(MODEL_COLS))), columns=MODEL_COLS)
+    y = np.where(X[y_col] > 0.5, "high", "low")
+    return Pipeline([("scale", StandardScaler()), ("model", LogisticRegression())]).fit(X, y)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # модели знают только MODEL_COLS; amount — колонка только для /drift
+    monkeypatch.setattr(api_app, "risk_model", _fit("risk_score"))
+    monkeypatch.setattr(api_app, "cx_model", _fit("anomaly_score"))
+    monkeypatch.setattr(api_app, "joint_model", None)
+    monkeypatch.setattr(api_app, "cascade", None)
+    monkeypatch.setattr(api_app, "expected_cols", set(MODEL_COLS))
+    monkeypatch.setattr(api_app, "expected_order", list(MODEL_COLS))
+    edges = {"amount": [0.0, 10.0, 100.0, 1000.0], "risk_score": [0.0, 0.5, 1.0]}
+    monkeypatch.setattr(api_app, "drift_state", {
+        col: {"inner": np.asarray(e[1:-1]), "ref": np.ones(len(e) - 1, dtype=np.int64),
+              "live": np.zeros(len(e) - 1, dtype=np.int64)}
+        for col, e in edges.items()
+    })
+    return api_app.app.test_client()
+
+
+def test_batch_drift_skips_missing_keys(client):
+    rows = [
+        {"amount": 5.0, "risk_score": 0.7, "anomaly_score": 0.1},
+        {"amount": 500.0},                       # risk_score нет -> не бин "0"
+        {"risk_score": None, "anomaly_score": 0.2},  # amount нет, risk_score null
+        {"amount": "abc", "risk_score": "0.2"},  # нечисловая строка пропускается, "0.2" — число
+    ]
+    r = client.post("/predict_batch", data=json.dumps({"rows": rows}), content_type="application/json")
+    assert r.status_code == 200
+    assert r.get_json()["count"] == len(rows)
+
+    cols = client.get("/drift").get_json()["columns"]
+    assert cols["amount"]["live_counts"] == [1, 0, 1]
+    assert cols["amount"]["n"] == 2
+    assert cols["risk_score"]["live_counts"] == [1, 1]
+    assert cols["risk_score"]["n"] == 2